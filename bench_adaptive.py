@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Compare fixed and adaptive (stop-early) tx_measure
+
+Measures a simulated channel (mg_sim) with a noisy meter, once transmitting
+the full packet_count and once with AdaptiveStop, and reports time, number
+of readings, packets sent, the average and its 95% confidence interval.
+
+    python bench_adaptive.py [tolerance_db]
+"""
+
+import sys
+import time
+import random
+import mg_sim
+from mg_measure import tx_measure, AdaptiveStop
+
+NOISE = 0.08            # meter noise, dB (1 sigma)
+PACKET_TIME = 0.0002    # on air per packet, so 5000 packets is a 1s burst
+
+def run(adaptive):
+    station = mg_sim.SimStation(n_slaves=0, timing=mg_sim.SimTiming(packet_time=PACKET_TIME))
+    station.meter.noise = NOISE
+    t0 = time.time()
+    stats = tx_measure(station.TX, station.meter, 5000, adaptive=adaptive)
+    return (time.time() - t0, stats)
+
+if __name__ == '__main__':
+    tolerance = float(sys.argv[1]) if len(sys.argv) > 1 else 0.02
+    random.seed(1)
+    print "%-9s %7s %9s %8s %9s %10s" % ("mode", "time", "readings", "packets", "mean", "ci95")
+    for (name, adaptive) in [("fixed", None),
+                             ("adaptive", AdaptiveStop(tolerance_db=tolerance))]:
+        (elapsed, stats) = run(adaptive)
+        print "%-9s %6.2fs %9d %8d %9.4f %10.4f" % (name, elapsed, stats.count,
+            stats.packets_sent, stats.trimmed_mean(), stats.ci95())
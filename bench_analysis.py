@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark the batch analysis of sweep result files
+
+Writes synthetic txpo, steptxgc and get_pdout_parms text files for a number
+of modules, each measured in two chamber runs (25C and 85C), then computes
+the mg_analysis reports (txpo/pdout fits per channel, TXGC slopes, pdout
+variance per nsamples, temperature drift) twice:
+
+    lines       - the csv module and Python loops over rows and groups, as
+                  a by-hand report script does it
+    vectorised  - mg_analysis.ResultTable and its reports
+
+Reports the load and analysis time of each, and the largest difference
+between their results.
+
+    python bench_analysis.py [modules]
+"""
+
+import os
+import sys
+import csv
+import time
+import random
+import shutil
+import tempfile
+import collections
+import mg_analysis
+from mg_analysis import ResultTable
+
+CHANNELS = range(8, 35)
+STEP_CHANNELS = [8, 18, 19, 23, 24, 29, 30, 34]
+
+def write_files(root, modules):
+    rng = random.Random(1)
+    for (run, temp) in [('run_25C', 25), ('run_85C', 85)]:
+        os.makedirs(os.path.join(root, run))
+        for m in range(modules):
+            mac = "00:25:1d:%02x:%02x:00" % (m // 256, m % 256)
+            name = mac.replace(':', '-')
+            base = 18.0 + rng.gauss(0, 0.3)
+            def path(fmt):
+                return os.path.join(root, run, fmt % name)
+            with open(path('txpo_%s.txt'), 'w') as f:
+                f.write("datetime, MAC, channel, temp, txgc, txpo, pdout\n")
+                for ch in CHANNELS:
+                    txpo = base + 0.01 * ch - 0.004 * (temp - 25) + rng.gauss(0, 0.02)
+                    f.write("10/17/2026 12:00:00, %s, %d, %d, %d, %r, %d\n" % (mac, ch, temp,
+                        42, txpo, int(1200 + 40 * txpo + rng.gauss(0, 3))))
+            with open(path('steptxgc_%s.csv'), 'w') as f:
+                f.write("datetime, MAC, channel, temp, txgc, txpo, pdout\n")
+                for txgc in [9, 56]:
+                    for ch in STEP_CHANNELS:
+                        txpo = base - 8.5 + 0.25 * (txgc - 9) + rng.gauss(0, 0.02)
+                        f.write("10/17/2026 12:00:00, %s, %d, %d, %d, %r, %d\n" % (mac, ch,
+                            temp, txgc, txpo, int(1200 + 40 * txpo)))
+            with open(path('get_pdout_parms_%s.csv'), 'w') as f:
+                f.write("datetime, MAC, channel, temp, txgc, txpo, pdout, delay, nsamples\n")
+                for nsamples in [4, 8, 16, 32, 64]:
+                    for ch in CHANNELS:
+                        txpo = base + 0.01 * ch
+                        for n in range(4):
+                            f.write("10/17/2026 12:00:00, %s, %d, %d, %d, %r, %d, %d, %d\n" % (
+                                mac, ch, temp, 45, txpo,
+                                int(1200 + 40 * txpo + rng.gauss(0, 40.0 / nsamples ** 0.5)),
+                                4000, nsamples))
+
+def lines_load(root):
+    """Every row as a dict, via the csv module"""
+    rows = []
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        for name in sorted(filenames):
+            kind = ('txpo' if name.startswith('txpo_') else 'steptxgc'
+                    if name.startswith('steptxgc_') else 'pdout_parms')
+            with open(os.path.join(dirpath, name)) as f:
+                reader = csv.reader(f, skipinitialspace=True)
+                header = next(reader)
+                for fields in reader:
+                    row = dict(zip(header, fields))
+                    for key in header[2:]:
+                        row[key] = float(row[key])
+                    row['kind'] = kind
+                    rows.append(row)
+    return rows
+
+def fit(points):
+    n = len(points)
+    mx = sum(x for (x, y) in points) / n
+    my = sum(y for (x, y) in points) / n
+    sxx = sum((x - mx) ** 2 for (x, y) in points)
+    if(sxx == 0):
+        return None
+    return sum((x - mx) * (y - my) for (x, y) in points) / sxx
+
+def lines_reports(rows):
+    fits = collections.defaultdict(list)
+    slopes = collections.defaultdict(list)
+    pdouts = collections.defaultdict(list)
+    drift = collections.defaultdict(list)
+    for r in rows:
+        if(r['txpo'] != 0):
+            fits[(r['kind'], r['channel'])].append((r['pdout'], r['txpo']))
+            drift[(r['kind'], r['MAC'], r['channel'], r['txgc'])].append((r['temp'], r['txpo']))
+            if(9 <= r['txgc'] <= 56):
+                slopes[(r['kind'], r['MAC'], r['channel'])].append((r['txgc'], r['txpo']))
+        if('nsamples' in r):
+            pdouts[(r['MAC'], r['channel'], r['txgc'], r['delay'], r['nsamples'])].append(r['pdout'])
+    out = {}
+    out['fits'] = dict((k, fit(v)) for (k, v) in fits.items())
+    out['slopes'] = dict((k, fit(v)) for (k, v) in slopes.items())
+    out['drift'] = dict((k, fit(v)) for (k, v) in drift.items())
+    var = collections.defaultdict(list)
+    for (k, v) in pdouts.items():
+        mean = sum(v) / len(v)
+        var[k[3:]].append(sum((x - mean) ** 2 for x in v) / (len(v) - 1))
+    out['variance'] = dict((k, sum(v) / len(v)) for (k, v) in var.items())
+    return out
+
+def vectorised_reports(table):
+    fits = mg_analysis.txpo_pdout_fits(table)
+    slopes = mg_analysis.txgc_slopes(table)
+    drift = mg_analysis.temp_drift(table)
+    (detail, summary) = mg_analysis.pdout_variance(table)
+    out = {}
+    out['fits'] = dict(((k, float(c)), s) for (k, c, s) in
+        zip(fits['kind'], fits['channel'], fits['slope_db_per_count']))
+    out['slopes'] = dict(((k, m, float(c)), s) for (k, m, c, s) in
+        zip(slopes['kind'], slopes['MAC'], slopes['channel'], slopes['slope_db_per_step']))
+    out['drift'] = dict(((k, m, float(c), float(g)), s) for (k, m, c, g, s) in
+        zip(drift['kind'], drift['MAC'], drift['channel'], drift['txgc'], drift['drift_db_per_c']))
+    out['variance'] = dict(((float(d), float(n)), v) for (d, n, v) in
+        zip(summary['delay'], summary['nsamples'], summary['mean_var']))
+    return out
+
+def max_difference(a, b):
+    worst = 0.0
+    for report in a:
+        for (key, value) in a[report].items():
+            if(value is None):
+                continue
+            worst = max(worst, abs(value - b[report][key]))
+    return worst
+
+def timed(fn, *args):
+    t0 = time.time()
+    result = fn(*args)
+    return (result, time.time() - t0)
+
+if __name__ == '__main__':
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    root = tempfile.mkdtemp()
+    try:
+        write_files(root, modules)
+        paths = [os.path.join(root, run) for run in sorted(os.listdir(root))]
+        (rows, lines_load_s) = timed(lines_load, root)
+        (expected, lines_report_s) = timed(lines_reports, rows)
+        (table, load_s) = timed(ResultTable.load, paths)
+        (got, report_s) = timed(vectorised_reports, table)
+        print "%d modules, %d files, %d rows" % (modules, len(table.files), len(table))
+        print "%-11s %8s %10s %8s" % ("path", "load s", "reports s", "total s")
+        for (name, load, report) in [("lines", lines_load_s, lines_report_s),
+                                     ("vectorised", load_s, report_s)]:
+            print "%-11s %8.2f %10.2f %8.2f" % (name, load, report, load + report)
+        print "largest difference: %.3g" % max_difference(expected, got)
+    finally:
+        shutil.rmtree(root)
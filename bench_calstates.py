@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark the cal driver's per-transition state lookups
+
+Walks the whole cal state sequence (BEGIN, F0_B5 .. F34_P2, FINISHED) and
+does, for each transition, the lookups the cal thread makes: which kind of
+state it is, its name for the log line, and the IDLE and RADIOCAL_OK checks.
+Once with the old Enumish lists (list scans) and once with the compiled
+StateTable in mg_calstates. Reports microseconds per transition.
+
+    python bench_calstates.py [passes]
+"""
+
+import sys
+import time
+import mg_calstates
+from mg_calstates import rcss, RADIOCAL_OK, STATE_BEGIN, STATE_IDLE, STATE_FINISHED
+
+class Enumish(object):
+    """The list-backed table the cal scripts used, kept here for comparison"""
+    def __init__(self, data):
+        assert(type(data) == type([]))
+        self.data = data
+
+    def __getitem__(self, index):
+        if(type(index) == type("")):
+            if(index in self.data):
+                return self.data.index(index)
+            else:
+                return None
+        elif(type(index) == type(7)):
+            if(index < len(self.data)):
+                return self.data[index]
+            else:
+                return None
+
+old_rcs = Enumish(mg_calstates.RADIOCAL_STATUS)
+old_rcss = Enumish(mg_calstates.RADIOCAL_STATES)
+
+def sequence():
+    """The state ids the device returns over one session"""
+    return range(STATE_BEGIN + 1, STATE_FINISHED + 1) + [STATE_IDLE]
+
+def legacy_pass(states):
+    n = 0
+    status = 0
+    for state in states:
+        if(state == old_rcss["RADIOCALSTATE_F0_B5"]):
+            n += 1
+        else:
+            name = old_rcss[state]
+        if((state == old_rcss["RADIOCALSTATE_IDLE"]) | (status != old_rcs["RADIOCAL_OK"])):
+            n += 1
+    return n
+
+def table_pass(states):
+    n = 0
+    status = 0
+    for state in states:
+        info = rcss.info(state)
+        if(not info.takes_measurement):
+            n += 1
+        else:
+            name = info.name
+        if((state == STATE_IDLE) | (status != RADIOCAL_OK)):
+            n += 1
+    return n
+
+def run(fn, passes):
+    states = sequence()
+    t0 = time.time()
+    for i in range(passes):
+        fn(states)
+    return (time.time() - t0) / (passes * len(states))
+
+if __name__ == '__main__':
+    passes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print "%d states, %d transitions per session" % (len(rcss), len(sequence()))
+    print "%-10s %12s %14s" % ("lookup", "us/transition", "us/session")
+    for (name, fn) in [("enumish", legacy_pass), ("table", table_pass)]:
+        per = run(fn, passes)
+        print "%-10s %12.3f %14.1f" % (name, 1e6 * per, 1e6 * per * len(sequence()))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark the tx_measure handshake against a simulated device and meter
+
+Compares the old busy-wait PMThread (which spins on dev_running while holding
+the GIL) with the event-driven handshake in mg_measure. For each run it
+reports the latency from the start of the transmission to the first meter
+sample, and the process CPU time burned per tx_measure call.
+
+    python bench_handshake.py [runs]
+"""
+
+import os
+import sys
+import time
+import threading
+import mg_measure
+
+# Simulated timing, roughly what the bench sees over USB serial
+TX_SETUP_TIME = 0.002   # host->module command before the radio keys up
+TX_TIME = 0.250         # time on air for the packet burst
+FETCH_TIME = 0.020      # one FETCH? round trip
+
+class FakeDevice(object):
+    """Just enough of TxAPI for tx_measure; does its serial I/O in pure
+    Python so it needs the GIL, like the real pysummit transport"""
+    def __init__(self):
+        self.tx_start = None
+
+    def _serial(self, seconds):
+        # Poll-style serial wait: the real transport reads the port in
+        # Python, so a thread hogging the GIL delays it
+        end = time.time() + seconds
+        while(time.time() < end):
+            time.sleep(0.0005)
+
+    def transmit_packets(self, packet_count):
+        self.tx_start = time.time()
+        self._serial(TX_SETUP_TIME)
+        self._serial(TX_TIME)
+        return (0x01, None)
+
+class FakeMeter(object):
+    def __init__(self):
+        self.first_sample = None
+
+    def cmd(self, command, timeout=None, do_error_check=True):
+        if(command in ("FETCH?", "MEAS?")):
+            if(self.first_sample is None):
+                self.first_sample = time.time()
+            time.sleep(FETCH_TIME)
+            return "-10.00"
+        return ""
+
+def legacy_tx_measure(dev, power_meter, packet_count):
+    """The pre-handshake implementation, kept here for comparison"""
+    dev_running = threading.Event()
+    pm_ready = threading.Event()
+    measurements = []
+
+    def sdev():
+        if(pm_ready.is_set()):
+            dev_running.set()
+            dev.transmit_packets(packet_count)
+            dev_running.clear()
+
+    def pm():
+        pm_ready.set()
+        while(not dev_running.is_set()):
+            pass
+        while(dev_running.is_set()):
+            measurements.append(power_meter.cmd("FETCH?", timeout=15))
+        power_meter.cmd("INIT:CONT ON")
+        pm_ready.clear()
+
+    pm_thread = threading.Thread(target=pm)
+    sdev_thread = threading.Thread(target=sdev)
+    pm_thread.daemon = True
+    sdev_thread.daemon = True
+    pm_thread.start()
+    # The original started the device thread right away and relied on luck
+    # for pm_ready to be set in time; give it the same chance here
+    time.sleep(0.001)
+    sdev_thread.start()
+    pm_thread.join(TX_TIME * 20)
+    return measurements
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+def run(measure, runs):
+    missed = 0
+    latencies = []
+    cpu = []
+    walls = []
+    for i in range(runs):
+        dev = FakeDevice()
+        meter = FakeMeter()
+        c0 = cpu_time()
+        w0 = time.time()
+        measure(dev, meter, 5000)
+        walls.append(time.time() - w0)
+        cpu.append(cpu_time() - c0)
+        if(dev.tx_start is not None and meter.first_sample is not None):
+            latencies.append(meter.first_sample - dev.tx_start)
+        else:
+            missed += 1
+    return (latencies, cpu, walls, missed)
+
+def report(name, results):
+    (latencies, cpu, walls, missed) = results
+    wall = sum(walls) / len(walls)
+    busy = sum(cpu) / len(cpu)
+    if(latencies):
+        lat = "%7.2f ms" % (1000.0 * sum(latencies) / len(latencies))
+    else:
+        lat = "    n/a   "
+    print "%-10s first-sample latency %s   cpu %6.1f ms/call (%5.1f%% of wall)   missed %d" % \
+        (name, lat, 1000.0 * busy, 100.0 * busy / wall, missed)
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    report("busy-wait", run(legacy_tx_measure, runs))
+    report("event", run(mg_measure.tx_measure, runs))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark importing an archive of result text files
+
+Writes a synthetic archive: for a number of modules, chamber runs at 25C and
+85C, each with a txpo file (cycling through the plain, DUMP_PDOUT and
+DUMP_PDOUT + DUMP_TXGC_REGS layouts), a steptxgc file and a get_pdout_parms
+file (cycling through the mg_get_pdout_parms and mg_pdout_timing_test
+layouts). Then imports it with mg_import into a new database:
+
+    serial    - one process (--workers 1)
+    pool      - one worker process per CPU (at least two)
+    rerun     - the pool import again: every file unchanged
+    touched   - again with every file's mtime changed, so each is hashed
+                but none parsed
+
+Reports files, rows and seconds for each, and checks both databases got the
+same rows.
+
+    python bench_import.py [modules]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import multiprocessing
+import mg_resultdb
+from mg_import import import_files
+
+CHANNELS = range(8, 35)
+STEP_CHANNELS = [8, 18, 19, 23, 24, 29, 30, 34]
+TXPO_LAYOUTS = [
+    ("datetime, MAC, channel, temp, txgc, txpo", "%s, %s, %d, %d, %d, %r"),
+    ("datetime, MAC, channel, temp, txgc, txpo, pdout", "%s, %s, %d, %d, %d, %r, %d"),
+    ("datetime, MAC, channel, temp, txgc, txpo, pdout, gc_index, gc0, gc1, gc2, gc3, gc4, "
+     "gc5, gc6, gc7", "%s, %s, %d, %d, %d, %r, %d" + ", %d" * 9),
+]
+WHEN = "10/17/2026 %02d:%02d:%02d"
+
+def write_archive(root, modules):
+    """Rows written"""
+    rng = random.Random(1)
+    rows = 0
+    for (run, temp) in [('run_25C', 25), ('run_85C', 85)]:
+        for m in range(modules):
+            run_dir = os.path.join(root, run, 'batch%02d' % (m // 100))
+            if(not os.path.isdir(run_dir)):
+                os.makedirs(run_dir)
+            mac = "00:25:1d:%02x:%02x:00" % (m // 256, m % 256)
+            name = mac.replace(':', '-')
+            base = 18.0 + rng.gauss(0, 0.3)
+            def when(i):
+                return WHEN % (9 + i // 3600, (i // 60) % 60, i % 60)
+            (heading, fmt) = TXPO_LAYOUTS[m % len(TXPO_LAYOUTS)]
+            with open(os.path.join(run_dir, 'txpo_%s.txt' % name), 'w') as f:
+                f.write("%s\n" % heading)
+                for (i, ch) in enumerate(CHANNELS):
+                    txpo = base + 0.01 * ch + rng.gauss(0, 0.02)
+                    values = (when(i), mac, ch, temp, 42, txpo, int(1200 + 40 * txpo),
+                        3, 0x1F, 0x2F, 0x3F, 0x4F, 0x5F, 0x6F, 0x7F, 0x8F)
+                    f.write("%s\n" % (fmt % values[:fmt.count('%')]))
+                    rows += 1
+            with open(os.path.join(run_dir, 'steptxgc_%s.csv' % name), 'w') as f:
+                f.write("datetime, MAC, channel, temp, txgc, txpo, pdout\n")
+                for txgc in [9, 56]:
+                    for ch in STEP_CHANNELS:
+                        txpo = base - 8.5 + 0.25 * (txgc - 9) + rng.gauss(0, 0.02)
+                        f.write("%s, %s, %d, %d, %d, %r, %d\n" % (when(txgc), mac, ch, temp,
+                            txgc, txpo, int(1200 + 40 * txpo)))
+                        rows += 1
+            timing = m % 2 == 1
+            with open(os.path.join(run_dir, 'get_pdout_parms_%s.csv' % name), 'w') as f:
+                if(timing):
+                    f.write("datetime, MAC, channel, pdout, delay, nsamples\n")
+                else:
+                    f.write("datetime, MAC, channel, temp, txgc, txpo, pdout, delay, nsamples\n")
+                i = 0
+                for nsamples in [4, 8, 16, 32, 64]:
+                    for ch in CHANNELS:
+                        for n in range(4):
+                            pdout = int(1200 + 40 * base + rng.gauss(0, 10))
+                            if(timing):
+                                f.write("%s, %s, %d, %d, %d, %d\n" % (when(i), mac, ch, pdout,
+                                    4000, nsamples))
+                            else:
+                                f.write("%s, %s, %d, %d, %d, %r, %d, %d, %d\n" % (when(i), mac,
+                                    ch, temp, 45, base, pdout, 4000, nsamples))
+                            i += 1
+                            rows += 1
+    return rows
+
+def touch_all(root):
+    later = time.time() + 60
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        for name in filenames:
+            os.utime(os.path.join(dirpath, name), (later, later))
+
+def timed_import(name, archive, db, workers):
+    t0 = time.time()
+    counts = import_files([archive], db, workers, log=sys.stderr)
+    elapsed = time.time() - t0
+    print "%-8s %8d %8d %10d %10d %8.2f" % (name, counts['imported'], counts['unchanged'] +
+        counts['duplicate'], counts['rows'], counts['rows'] / elapsed if counts['rows'] else 0,
+        elapsed)
+
+def checksum(db):
+    # txpo summed as integers: a float sum depends on the (unordered) import order
+    return mg_resultdb.query("SELECT count(*), sum(channel), sum(pdout), "
+        "sum(CAST(round(txpo * 1e6) AS INTEGER)), sum(datetime), count(DISTINCT run_id), "
+        "count(DISTINCT mac) FROM readings", db=db)
+
+if __name__ == '__main__':
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    root = tempfile.mkdtemp()
+    try:
+        archive = os.path.join(root, 'archive')
+        rows = write_archive(archive, modules)
+        print "%d modules, %d files, %d rows, %d CPUs" % (modules, 6 * modules, rows,
+            multiprocessing.cpu_count())
+        print "%-8s %8s %8s %10s %10s %8s" % ("import", "files", "skipped", "rows", "rows/s",
+            "s")
+        serial_db = os.path.join(root, 'serial.db')
+        pool_db = os.path.join(root, 'pool.db')
+        timed_import("serial", archive, serial_db, 1)
+        workers = max(2, multiprocessing.cpu_count())
+        timed_import("pool", archive, pool_db, workers)
+        timed_import("rerun", archive, pool_db, workers)
+        touch_all(archive)
+        timed_import("touched", archive, pool_db, workers)
+        print "same rows: %s" % (checksum(serial_db) == checksum(pool_db))
+    finally:
+        shutil.rmtree(root)
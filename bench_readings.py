@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark parsing the meter's FETCH? replies
+
+Feeds the same burst of ASCII replies (as the E4418B sends them, with one
+9.9E37 overload reply in every OVERLOAD_EVERY) through:
+
+    legacy    - keep the raw strings, then map(float, data) and average the
+                trimmed list, as the scripts did before RunningStats
+    unchecked - RunningStats with a bare float() per reply, as it was before
+                ReadingParser
+    parser    - mg_measure.RunningStats, parsing and checking each reply with
+                a ReadingParser
+    kept      - the same, keeping the readings too (RunningStats(keep=True))
+
+Reports replies per second and the trimmed mean each gets.
+
+    python bench_readings.py [replies] [bursts]
+"""
+
+import sys
+import time
+import random
+from mg_measure import RunningStats
+
+OVERLOAD_EVERY = 1000
+
+def make_replies(n):
+    rng = random.Random(1)
+    replies = []
+    for i in range(n):
+        if(i % OVERLOAD_EVERY == OVERLOAD_EVERY // 2):
+            replies.append("+9.90000000E+37")
+        else:
+            replies.append("%+.8E" % rng.gauss(18.3, 0.05))
+    return replies
+
+def legacy(replies):
+    data = []
+    for meas in replies:
+        data.append(meas)
+    data = map(float, data)
+    trimmed = data[1:-1]
+    return sum(trimmed) / len(trimmed)
+
+class Unchecked(object):
+    """float() and nothing else"""
+    parse = staticmethod(float)
+
+def unchecked(replies):
+    stats = RunningStats(parser=Unchecked())
+    for meas in replies:
+        stats.add(meas)
+    return stats.trimmed_mean()
+
+def parser(replies):
+    stats = RunningStats()
+    for meas in replies:
+        stats.add(meas)
+    return stats.trimmed_mean()
+
+def kept(replies):
+    stats = RunningStats(keep=True)
+    for meas in replies:
+        stats.add(meas)
+    return stats.trimmed_mean()
+
+def run(fn, replies, bursts):
+    t0 = time.time()
+    for i in range(bursts):
+        mean = fn(replies)
+    return ((time.time() - t0) / (bursts * len(replies)), mean)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    bursts = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    replies = make_replies(n)
+    print "%d replies per burst, %d overload" % (n, sum(1 for r in replies if "E+37" in r))
+    print "%-10s %12s %10s %16s" % ("path", "replies/s", "us/reply", "trimmed mean")
+    for (name, fn) in [("legacy", legacy), ("unchecked", unchecked), ("parser", parser),
+                      ("kept", kept)]:
+        (per, mean) = run(fn, replies, bursts)
+        print "%-10s %12.0f %10.3f %16.6g" % (name, 1.0 / per, 1e6 * per, mean)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Count register round trips saved by the batched register API
+
+Replays the register traffic of one mg_txpo_test sweep (TXGC index plus the
+eight gain registers on each of channels 8-34) and one mg_step_txgc_test
+sweep (eight fixed-TXGC writes on each of 8 channels, for 2 TXGC values)
+against a mock transport with the TxAPI's rd/wr only, with the original
+per-register loops and with rd_batch/wr_batch, and prints the number of
+round trips for each. The TxAPI has no block transfer, so the batched
+calls still make one round trip per register; what the txpo sweep saves
+is the separate txgc read. The txpo setup (three config writes and their
+read-backs) and the steptxgc sweep (gain table writes, a transmit, then the
+txgc read) are also replayed through CachedDevice to show what the shadow
+cache saves. In txpo the read-backs are fresh (they check the device) and
+every set_radio_channel drops the cached gain table, so it saves nothing;
+in steptxgc the txgc read is the value just written, and transmitting
+doesn't drop it.
+
+    python bench_regs.py
+"""
+
+import time
+from mg_regs import rd_batch, wr_batch, GC_ADDRS, CachedDevice
+
+TXVECTOR_POWER_REG = 0x40100C
+ROUND_TRIP = 0.004   # simulated seconds per serial round trip
+
+class MockTransport(object):
+    """A register file that counts round trips"""
+    def __init__(self):
+        self.regs = {TXVECTOR_POWER_REG: 3}
+        self.round_trips = 0
+
+    def _trip(self):
+        self.round_trips += 1
+        time.sleep(ROUND_TRIP)
+
+    def rd(self, addr):
+        self._trip()
+        return (0x01, self.regs.get(addr, 0x2D))
+
+    def wr(self, addr, value):
+        self._trip()
+        self.regs[addr] = value
+        return (0x01, None)
+
+    def set_radio_channel(self, idx, ch):
+        self._trip()
+        return (0x01, None)
+
+    def transmit_packets(self, packet_count):
+        self._trip()
+        return (0x01, None)
+
+def txpo_loop(dev):
+    for ch in range(8,35):
+        (status, gc_index) = dev.rd(TXVECTOR_POWER_REG)
+        (status, txgc) = dev.rd(GC_ADDRS[gc_index])
+        gc_val = [dev.rd(addr)[1] for addr in GC_ADDRS]
+
+def txpo_batched(dev):
+    for ch in range(8,35):
+        results = rd_batch(dev, [TXVECTOR_POWER_REG] + GC_ADDRS)
+
+def steptxgc_loop(dev):
+    for txgcval in [9,56]:
+        for ch in [8, 18, 19, 23, 24, 29, 30, 34]:
+            for regaddr in GC_ADDRS:
+                dev.wr(regaddr, txgcval)
+
+def steptxgc_batched(dev):
+    for txgcval in [9,56]:
+        for ch in [8, 18, 19, 23, 24, 29, 30, 34]:
+            wr_batch(dev, [(regaddr, txgcval) for regaddr in GC_ADDRS])
+
+def txpo_setup(dev):
+    for (addr, val) in [(0x406004, 0x00), (0x408840, 0x00), (0x401004, 0x07)]:
+        dev.wr(addr, val)
+    rd_batch(dev, [0x408840, 0x406004, 0x401004], fresh=True)
+    for ch in range(8,35):
+        dev.set_radio_channel(0, ch)
+        results = rd_batch(dev, [TXVECTOR_POWER_REG] + GC_ADDRS)
+
+def steptxgc_sweep(dev):
+    for txgcval in [9,56]:
+        for ch in [8, 18, 19, 23, 24, 29, 30, 34]:
+            dev.set_radio_channel(0, ch)
+            wr_batch(dev, [(regaddr, txgcval) for regaddr in GC_ADDRS])
+            dev.transmit_packets(5000)
+            (status, gc_index) = dev.rd(TXVECTOR_POWER_REG)
+            (status, gc) = dev.rd(GC_ADDRS[gc_index])
+
+def measure(transport_class, fn):
+    dev = transport_class()
+    t0 = time.time()
+    fn(dev)
+    return (dev.round_trips, time.time() - t0)
+
+if __name__ == '__main__':
+    print "%-10s %-22s %12s %10s" % ("sweep", "access", "round trips", "time")
+    for (name, loop, batched) in [("txpo", txpo_loop, txpo_batched),
+                                  ("steptxgc", steptxgc_loop, steptxgc_batched)]:
+        for (label, fn) in [("per-register", loop), ("batched", batched)]:
+            (trips, elapsed) = measure(MockTransport, fn)
+            print "%-10s %-22s %12d %9.2fs" % (name, label, trips, elapsed)
+
+    for (name, fn) in [("txpo setup", txpo_setup), ("steptxgc", steptxgc_sweep)]:
+        for label in ["uncached", "cached"]:
+            dev = MockTransport()
+            if(label == "cached"):
+                dev = CachedDevice(dev)
+            fn(dev)
+            trips = dev.dev.round_trips if label == "cached" else dev.round_trips
+            print "%-10s %-22s %12d" % (name, label, trips)
+            if(label == "cached"):
+                print dev.stats()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark the result database against grepping the result files
+
+Records synthetic txpo and get_pdout_parms runs for a number of modules (two
+chamber runs each, 25C and 85C, half the modules on firmware 197.3 and half
+on 198.3) through ResultWriter, once writing the result files alone and once
+with a mg_resultdb run as well, and reports what the run adds per row. The
+txpo runs are also written as the text files the scripts used to leave, one
+directory per chamber run.
+
+Then times some typical queries on the database, and the first against
+scanning the text files (as grepping does; the files can't tell firmware
+apart, so the scan answers the query without that condition):
+
+    python bench_resultdb.py [modules]
+"""
+
+import os
+import sys
+import csv
+import time
+import random
+import shutil
+import tempfile
+import mg_resultdb
+from mg_results import ResultWriter
+
+TXPO = ['datetime', 'MAC', 'channel', 'temp', 'txgc', 'txpo', 'pdout']
+PDOUT = TXPO + ['delay', 'nsamples']
+CHANNELS = range(8, 35)
+NSAMPLES = [4, 8, 16, 32, 64]
+WHEN = "10/17/2026 12:00:00"
+
+QUERIES = [
+    ("ch24 txpo, fw>=198, temp>60",
+     "SELECT mac, temp, txpo FROM readings WHERE script = 'txpo' AND channel = 24 "
+     "AND firmware_major >= 198 AND temp > 60", ()),
+    ("runs of one MAC",
+     "SELECT id, script, started, rows FROM runs WHERE mac = ? ORDER BY started",
+     ("00:25:1d:00:10:00",)),
+    ("rows of one run",
+     "SELECT channel, txpo, pdout FROM results WHERE run_id = ?", (1000,)),
+    ("ch24 mean pdout per nsamples, 85C",
+     "SELECT nsamples, avg(pdout) FROM readings WHERE channel = 24 AND temp = 85 "
+     "AND script = 'pdout_parms' GROUP BY nsamples", ()),
+]
+
+def sweeps(modules):
+    """(script, mac, firmware, temp, columns, rows) for every synthetic run"""
+    rng = random.Random(1)
+    for temp in [25, 85]:
+        for m in range(modules):
+            mac = "00:25:1d:%02x:%02x:00" % (m // 256, m % 256)
+            firmware = ((197 + m % 2) << 5) | 3
+            base = 18.0 + rng.gauss(0, 0.3)
+            rows = []
+            for ch in CHANNELS:
+                txpo = base + 0.01 * ch - 0.004 * (temp - 25) + rng.gauss(0, 0.02)
+                rows.append((WHEN, mac, ch, temp, 42, txpo, int(1200 + 40 * txpo)))
+            yield ('txpo', mac, firmware, temp, TXPO, rows)
+            rows = []
+            for nsamples in NSAMPLES:
+                for ch in CHANNELS:
+                    for n in range(4):
+                        rows.append((WHEN, mac, ch, temp, 45, base + 0.01 * ch,
+                            int(1200 + 40 * base + rng.gauss(0, 10)), 4000, nsamples))
+            yield ('pdout_parms', mac, firmware, temp, PDOUT, rows)
+
+def record(root, modules, db):
+    """Seconds spent in ResultWriter.add()/close(), and rows written"""
+    spent = 0.0
+    total = 0
+    for (script, mac, firmware, temp, columns, rows) in sweeps(modules):
+        path = os.path.join(root, '%s.mgr' % script)
+        run = None
+        if(db is not None):
+            run = mg_resultdb.open_run(script, mac, 0xFD, firmware, path=path, db=db)
+        t0 = time.time()
+        results = ResultWriter(path, columns, script=script, run=run, batch_rows=1000)
+        for row in rows:
+            results.add(row)
+        results.close()
+        spent += time.time() - t0
+        total += len(rows)
+        if(db is None and script == 'txpo'):
+            write_text(root, temp, mac, rows)
+    return (spent, total)
+
+def write_text(root, temp, mac, rows):
+    run_dir = os.path.join(root, 'run_%dC' % temp)
+    if(not os.path.isdir(run_dir)):
+        os.makedirs(run_dir)
+    with open(os.path.join(run_dir, 'txpo_%s.txt' % mac.replace(':', '-')), 'w') as f:
+        f.write("%s\n" % ", ".join(TXPO))
+        for row in rows:
+            f.write("%s, %s, %d, %d, %d, %r, %d\n" % row)
+
+def scan_text(root):
+    """ch24 txpo at temp > 60, by reading every txpo text file"""
+    found = []
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        for name in filenames:
+            if(name.startswith('txpo_') and name.endswith('.txt')):
+                with open(os.path.join(dirpath, name)) as f:
+                    reader = csv.reader(f, skipinitialspace=True)
+                    next(reader)
+                    for fields in reader:
+                        if(int(fields[2]) == 24 and int(fields[3]) > 60):
+                            found.append((fields[1], int(fields[3]), float(fields[5])))
+    return found
+
+def best_of(n, fn, *args):
+    best = None
+    for i in range(n):
+        t0 = time.time()
+        result = fn(*args)
+        elapsed = time.time() - t0
+        if(best is None or elapsed < best):
+            best = elapsed
+    return (result, best)
+
+if __name__ == '__main__':
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    root = tempfile.mkdtemp()
+    try:
+        db = os.path.join(root, 'results.db')
+        (plain_s, rows) = record(root, modules, None)
+        (db_s, rows) = record(root, modules, db)
+        print "%d modules, %d runs, %d rows, %.0f MB database" % (modules, 4 * modules, rows,
+            os.path.getsize(db) / 1e6)
+        print "ResultWriter: %.2f us/row alone, %.2f us/row with the run" % (
+            1e6 * plain_s / rows, 1e6 * db_s / rows)
+        conn = mg_resultdb.connect(db)
+        print "%-34s %8s %10s" % ("query", "rows", "ms")
+        for (name, sql, params) in QUERIES:
+            (found, elapsed) = best_of(5, lambda: conn.execute(sql, params).fetchall())
+            print "%-34s %8d %10.2f" % (name, len(found), 1e3 * elapsed)
+        conn.close()
+        (found, elapsed) = best_of(1, scan_text, root)
+        print "%-34s %8d %10.2f" % ("scan text files (ch24, temp>60)", len(found), 1e3 * elapsed)
+    finally:
+        shutil.rmtree(root)
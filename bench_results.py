@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark writing sweep result rows
+
+Writes the same mg_txpo_test rows (all the gc columns) once as the scripts
+used to, formatting each row and flushing it to the text file, and once
+through mg_results.ResultWriter, which packs rows and commits them in
+batches with an fsync. Reports microseconds per row and the file size per
+row. Both keep a crash from losing more than one batch (one row for text),
+but the text file is flushed rather than fsynced. The result file is
+written again with the CSV alongside (csv_path), as the scripts do.
+
+    python bench_results.py [rows]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from mg_results import ResultWriter, ResultFile
+
+HEADINGS = ("datetime, MAC, channel, temp, txgc, txpo, pdout, gc_index, "
+            "gc0, gc1, gc2, gc3, gc4, gc5, gc6, gc7")
+FMT = "%s, %s, %d, %d, %d, %r, %d, %d, %d, %d, %d, %d, %d, %d, %d, %d"
+
+def make_rows(n):
+    t0 = time.time()
+    rows = []
+    for i in range(n):
+        txgc = 40 + i % 24
+        rows.append((time.strftime("%m/%d/%Y %H:%M:%S", time.localtime(t0 + i)),
+            "00:25:1d:00:00:00", 1 + i % 35, 35, txgc, 18.0 + 0.0137 * i,
+            1800 + i % 200, 3) + (txgc,) * 8)
+    return rows
+
+def legacy_write(path, rows):
+    """Per-row format, write and flush, as the scripts did"""
+    with open(path, 'w') as f:
+        f.write("%s\n" % HEADINGS)
+        for outputs in rows:
+            out_str = FMT % outputs
+            f.write("%s\n" % out_str)
+            f.flush()
+
+def results_write(path, rows):
+    with ResultWriter(path, HEADINGS.split(", "), script='bench') as results:
+        for outputs in rows:
+            results.add(outputs)
+
+def results_csv_write(path, rows):
+    with ResultWriter(path, HEADINGS.split(", "), script='bench',
+                      csv_path=path + '.csv') as results:
+        for outputs in rows:
+            results.add(outputs)
+
+def run(fn, path, rows):
+    t0 = time.time()
+    fn(path, rows)
+    return ((time.time() - t0) / len(rows), os.path.getsize(path))
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rows = make_rows(n)
+    tmp = tempfile.mkdtemp()
+    try:
+        print "%d rows" % n
+        print "%-8s %10s %12s %10s" % ("writer", "us/row", "bytes/row", "MB")
+        for (name, fn, path) in [("text", legacy_write, os.path.join(tmp, 'r.txt')),
+                                 ("results", results_write, os.path.join(tmp, 'r.mgr')),
+                                 ("+csv", results_csv_write, os.path.join(tmp, 'c.mgr'))]:
+            (per, size) = run(fn, path, rows)
+            print "%-8s %10.2f %12.1f %10.2f" % (name, 1e6 * per, float(size) / n, size / 1e6)
+        t0 = time.time()
+        ResultFile(os.path.join(tmp, 'r.mgr')).export_csv(os.path.join(tmp, 'r.csv'))
+        print "CSV export: %.2f us/row" % (1e6 * (time.time() - t0) / n)
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark the pipelined channel sweep against the sequential one
+
+Runs the mg_txpo_test sweep stages (set channel, temperature, TXGC and gain
+register reads, transmit, pdout) over channels 8-34 against a simulated
+device and meter (mg_sim), and reports total sweep wall time for both
+modes.
+
+    python bench_sweep.py
+"""
+
+import mg_sim
+from mg_sweep import ChannelSweep
+
+def txpo_sweep(pipelined):
+    station = mg_sim.SimStation(n_slaves=0)
+    dev = station.TX
+    gc_addrs = range(0x4089A0, 0x4089C0, 4)
+
+    def setup(ch):
+        dev.set_radio_channel(0, ch)
+        (status, temp) = dev.temperature()
+        (status, gc_index) = dev.rd(0x40100C)
+        (status, txgc) = dev.rd(gc_addrs[gc_index])
+        gc_val = [dev.rd(addr)[1] for addr in gc_addrs]
+        return {'temp': temp, 'txgc': txgc, 'gc_val': gc_val}
+
+    def post_tx(ch, state):
+        (status, state['pdout']) = dev.get_pdout(9000, 32)
+        return state
+
+    def make_rows(ch, state, data):
+        return [(ch, state['temp'], state['txgc'], state['pdout'], data.count)]
+
+    return ChannelSweep(dev, station.meter, setup, post_tx, make_rows,
+        packet_count=5000, pipelined=pipelined)
+
+if __name__ == '__main__':
+    results = {}
+    for pipelined in (False, True):
+        sweep = txpo_sweep(pipelined)
+        rows = list(sweep.run(range(8,35)))
+        results[pipelined] = sweep.elapsed
+        print "%-10s %2d channels in %6.2fs" % \
+            ("pipelined" if pipelined else "sequential", len(rows), sweep.elapsed)
+    print "saved %.2fs (%.1f%%)" % (results[False] - results[True],
+        100.0 * (results[False] - results[True]) / results[False])
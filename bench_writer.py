@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark what the PMThread pays per logged reading
+
+Logs the PMThread's per-reading line ("%d: %s") from a worker thread, once
+through the plain FileHandler logging.conf used to have and once through
+mg_writer.QueuedFileHandler. Reports the time the logging thread spends per
+call (mean and worst), then how long the writer took to catch up. The
+results/row case is the same for QueuedResultWriter.add().
+
+Each is run twice: as the disk is here, and with every flush of the log
+file stalled for stall_ms (default 2), as a busy disk or network share
+would.
+
+    python bench_writer.py [records] [stall_ms]
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import mg_writer
+
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+class StalledFile(object):
+    """A file whose flush() takes stall seconds longer"""
+    def __init__(self, f, stall):
+        self.f = f
+        self.stall = stall
+
+    def flush(self):
+        time.sleep(self.stall)
+        self.f.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+def log_from_thread(logger, n):
+    """(mean, worst) seconds per logger.info call on a worker thread"""
+    times = []
+    def run():
+        for i in range(n):
+            t0 = time.time()
+            logger.info("%d: %s" % (i, "+1.83451200E+01"))
+            times.append(time.time() - t0)
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+    return (sum(times) / n, max(times))
+
+def bench(name, handler, n, stall):
+    if(stall):
+        if(isinstance(handler, mg_writer.QueuedFileHandler)):
+            handler._sink.stream = StalledFile(handler._sink.stream, stall)
+        else:
+            handler.stream = StalledFile(handler.stream, stall)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    logger = logging.getLogger('bench.%s' % name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    (mean, worst) = log_from_thread(logger, n)
+    t0 = time.time()
+    handler.flush()
+    catch_up = time.time() - t0
+    logger.removeHandler(handler)
+    handler.close()
+    print "%-8s %6.1f %10.2f %10.1f %12.1f" % (name, 1e3 * stall, 1e6 * mean, 1e6 * worst,
+        1e3 * catch_up)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    stall_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    tmp = tempfile.mkdtemp()
+    try:
+        print "%d records" % n
+        print "%-8s %6s %10s %10s %12s" % ("handler", "stall", "mean us", "worst us",
+            "catch-up ms")
+        for stall in (0.0, stall_ms / 1e3):
+            bench("file", logging.FileHandler(os.path.join(tmp, 'file.log')), n, stall)
+            bench("queued", mg_writer.QueuedFileHandler(os.path.join(tmp, 'queued.log')),
+                n, stall)
+        writer = mg_writer.get_writer()
+        print "writer: %d items in %d batches, %d syncs" % (writer.items, writer.batches,
+            writer.syncs)
+    finally:
+        shutil.rmtree(tmp)
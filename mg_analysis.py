@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Batch analysis of the sweep result files (needs numpy)
+
+Loads any number of result files into one columnar ResultTable (a numpy
+float64 array per column, NaN where a file doesn't have the column) and
+computes, vectorised across every MAC and channel at once:
+
+    txpo_pdout_fits  - txpo against pdout, fitted per channel over all modules
+    txgc_slopes      - dB per TXGC step per module and channel, from the
+                       rows with TXGC in TXGC_RANGE (the steptxgc sweep)
+    pdout_variance   - variance of the repeated pdout reads, per module,
+                       channel and pdout settings, and summed up per
+                       (delay, nsamples)
+    temp_drift       - dB per degree C per module, channel and TXGC, over
+                       every file measured at more than one temperature
+
+Each returns a summary table (an ordered dict of column -> array) that
+write_table() saves as CSV.
+
+The .mgr files (mg_results) are read straight into arrays. The text files
+(txpo_<MAC>.txt, steptxgc_<MAC>.csv, get_pdout_parms_<MAC>.csv) are parsed
+a whole file at a time, with numpy doing the numbers; only a file with
+empty fields falls back to numpy.genfromtxt. Where a script wrote both, the
+.mgr file is used. The file's kind comes from the script named in an .mgr
+header, or else from the file name and its columns (mg_pdout_timing_test
+writes get_pdout_parms_<MAC>.csv too, without txpo). The datetime column
+isn't loaded.
+
+    python mg_analysis.py [--out DIR] FILE_OR_DIR ...
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import collections
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("mg_analysis needs numpy (pip install numpy)")
+from mg_results import ResultFile, results_path, KINDS, TEXT_PATTERNS, detect_kind
+
+# TXGC values the slope is fitted over (mg_step_txgc_test steps 9 and 56)
+TXGC_RANGE = (9, 56)
+
+# Columns loaded, besides the MAC
+NUMERIC_COLUMNS = ['channel', 'temp', 'txgc', 'txpo', 'pdout', 'gc_index', 'delay',
+                   'nsamples', 'nreadings', 'ci95', 'packets']
+
+def find_files(paths):
+    """The result files in paths (files or directories), preferring the .mgr
+    file where a script wrote both"""
+    found = []
+    for path in paths:
+        if(os.path.isdir(path)):
+            for pattern in TEXT_PATTERNS + ['*.mgr']:
+                found.extend(glob.glob(os.path.join(path, pattern)))
+        else:
+            found.append(path)
+    found = sorted(set(found))
+    mgr = set(p for p in found if p.endswith('.mgr'))
+    return [p for p in found if p.endswith('.mgr') or results_path(p) not in mgr]
+
+
+_LEADING = re.compile(r'(?m)^[^,\n]*,\s*([^,\n]*),')
+# Every row starts "MM/DD/YYYY HH:MM:SS, xx:xx:xx:xx:xx:xx, "
+_DATETIME_WIDTH = 19
+_MAC_WIDTH = 17
+_PREFIX_WIDTH = _DATETIME_WIDTH + 2 + _MAC_WIDTH + 1
+
+def _split_rows(body):
+    """(MAC per row, the rows' numeric fields as one comma-separated string)
+
+    The scripts' rows start with a fixed-width datetime and MAC, so numpy
+    can cut them off every row at once. Rows that don't are split with a
+    regular expression instead."""
+    buf = np.frombuffer(body, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord('\n'))
+    if(len(buf) and buf[-1] != ord('\n')):
+        ends = np.append(ends, len(buf))
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    if(len(starts) and (starts[-1] + _PREFIX_WIDTH < len(buf)) and
+       np.all(ends - starts > _PREFIX_WIDTH) and
+       np.all(buf[starts + _DATETIME_WIDTH] == ord(',')) and
+       np.all(buf[starts + _PREFIX_WIDTH - 1] == ord(','))):
+        mac_at = starts[:, None] + (_DATETIME_WIDTH + 2) + np.arange(_MAC_WIDTH)
+        macs = buf[mac_at].copy().view('S%d' % _MAC_WIDTH).ravel()
+        keep = np.ones(len(buf), dtype=bool)
+        keep[(starts[:, None] + np.arange(_PREFIX_WIDTH)).ravel()] = False
+        fields = buf[keep]
+        fields[fields == ord('\n')] = ord(',')
+        return (macs, fields.tostring())
+    return (_LEADING.findall(body), _LEADING.sub('', body).replace('\n', ','))
+
+def load_text(path):
+    """(kind, columns, MACs per row, {column: array}) of a text result file"""
+    with open(path, 'rb') as f:
+        header = f.readline()
+        body = f.read()
+    columns = [c.strip() for c in header.split(',')]
+    if(columns[:2] != ['datetime', 'MAC']):
+        raise ValueError("%s: not a result file (columns %s)" % (path, ", ".join(columns)))
+    (macs, fields) = _split_rows(body.replace('\r\n', '\n'))
+    numeric = columns[2:]
+    values = np.fromstring(fields, sep=',')
+    if(values.size != len(macs) * len(numeric)):
+        # Empty fields (values the writer had as None): the slow path
+        values = np.genfromtxt(path, delimiter=',', skip_header=1, usecols=range(2, len(columns)))
+    values = values.reshape(len(macs), len(numeric))
+    data = dict((name, values[:, i]) for (i, name) in enumerate(numeric))
+    return (detect_kind(path, columns), columns, macs, data)
+
+def load_mgr(path):
+    """(kind, columns, MACs per row, {column: array}) of an mg_results file"""
+    rf = ResultFile(path)
+    records = rf.to_numpy()
+    data = {}
+    macs = []
+    for (i, name) in enumerate(rf.columns):
+        present = (records['present'] >> i) & 1 == 1
+        if(name == 'MAC'):
+            table = np.array(rf.macs + [''], dtype=object)
+            macs = table[np.where(present, records['MAC'], len(rf.macs))]
+        elif(name != 'datetime'):
+            data[name] = np.where(present, records[name].astype(np.float64), np.nan)
+    return (detect_kind(path, rf.columns, rf.script), rf.columns, macs, data)
+
+
+class ResultTable(object):
+    """Many result files as columns
+
+    columns holds a float64 array per NUMERIC_COLUMNS name; mac and kind are
+    int arrays indexing self.macs and KINDS; file indexes self.files.
+    """
+    def __init__(self, columns, mac, kind, file, macs, files):
+        self.columns = columns
+        self.mac = mac
+        self.kind = kind
+        self.file = file
+        self.macs = macs
+        self.files = files
+
+    def __len__(self):
+        return len(self.mac)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def load(cls, paths):
+        files = []
+        parts = []
+        for path in find_files(paths):
+            try:
+                loader = load_mgr if path.endswith('.mgr') else load_text
+                (kind, columns, macs, data) = loader(path)
+            except (IOError, ValueError) as info:
+                sys.stderr.write("Skipping %s: %s\n" % (path, info))
+                continue
+            if(kind is None):
+                sys.stderr.write("Skipping %s: not a sweep result file\n" % path)
+                continue
+            if(len(macs) == 0):
+                continue
+            parts.append((len(files), kind, macs, data))
+            files.append(path)
+        mac_names = sorted(set(m for (i, kind, macs, data) in parts for m in set(macs)))
+        mac_index = dict((m, i) for (i, m) in enumerate(mac_names))
+        columns = {}
+        for name in NUMERIC_COLUMNS:
+            columns[name] = np.concatenate([data[name] if name in data else
+                np.full(len(macs), np.nan) for (i, kind, macs, data) in parts] or [np.empty(0)])
+        mac = []
+        kind_code = []
+        file_code = []
+        for (i, kind, macs, data) in parts:
+            (names, inverse) = np.unique(np.asarray(macs, dtype=object), return_inverse=True)
+            mac.append(np.array([mac_index[m] for m in names], dtype=np.int32)[inverse])
+            kind_code.append(np.full(len(macs), KINDS.index(kind), dtype=np.int32))
+            file_code.append(np.full(len(macs), i, dtype=np.int32))
+        def joined(arrays):
+            return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int32)
+        return cls(columns, joined(mac), joined(kind_code), joined(file_code), mac_names, files)
+
+    def kind_mask(self, *kinds):
+        return np.in1d(self.kind, [KINDS.index(k) for k in kinds])
+
+
+def group(*keys):
+    """(the distinct key rows, each row's group number) for rows grouped by
+    keys (arrays of one length)"""
+    # Number each key's values, fold the numbers into one int64 per row and
+    # group on that
+    uniques = []
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        key = np.asarray(key, dtype=np.float64).copy()
+        # NaN never equals itself: give missing keys a value of their own
+        key[np.isnan(key)] = -1
+        (values, codes) = np.unique(key, return_inverse=True)
+        combined = combined * len(values) + codes
+        uniques.append(values)
+    (groups, inverse) = np.unique(combined, return_inverse=True)
+    rows = np.empty((len(groups), len(keys)))
+    for (i, values) in reversed(list(enumerate(uniques))):
+        (groups, codes) = divmod(groups, len(values))
+        rows[:, i] = values[codes]
+    return (rows, inverse)
+
+def group_fit(x, y, inverse, ngroups):
+    """Least-squares y = slope*x + intercept in each group; returns (n,
+    slope, intercept, r2, rms residual) arrays, NaN where x doesn't vary"""
+    def total(weights=None):
+        return np.bincount(inverse, weights, minlength=ngroups)
+    n = total()
+    mx = total(x) / n
+    my = total(y) / n
+    dx = x - mx[inverse]
+    dy = y - my[inverse]
+    sxx = total(dx * dx)
+    syy = total(dy * dy)
+    sxy = total(dx * dy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+        r2 = np.where((sxx > 0) & (syy > 0), sxy * sxy / (sxx * syy), np.nan)
+        resid = np.maximum(syy - slope * sxy, 0.0)
+        rms = np.where(n > 2, np.sqrt(resid / (n - 2)), np.nan)
+    return (n.astype(np.int64), slope, my - slope * mx, r2, rms)
+
+def _finite(table, *names):
+    ok = np.ones(len(table), dtype=bool)
+    for name in names:
+        ok &= np.isfinite(table[name])
+    return ok
+
+def _macs(table, codes):
+    return np.array(table.macs, dtype=object)[codes.astype(np.int64)]
+
+def _kinds(codes):
+    return np.array(KINDS, dtype=object)[codes.astype(np.int64)]
+
+
+def txpo_pdout_fits(table):
+    """txpo (dBm) against pdout per sweep kind and channel, over every module"""
+    rows = _finite(table, 'channel', 'txpo', 'pdout') & (table['txpo'] != 0)
+    (keys, inverse) = group(table.kind[rows], table['channel'][rows])
+    (n, slope, intercept, r2, rms) = group_fit(table['pdout'][rows], table['txpo'][rows],
+        inverse, len(keys))
+    return collections.OrderedDict([
+        ('kind', _kinds(keys[:, 0])), ('channel', keys[:, 1].astype(np.int64)),
+        ('modules', _count_distinct(table.mac[rows], inverse, len(keys))), ('n', n),
+        ('slope_db_per_count', slope), ('intercept_dbm', intercept), ('r2', r2),
+        ('rms_db', rms)])
+
+def _count_distinct(values, inverse, ngroups):
+    """Number of distinct values in each group"""
+    (pairs, null) = group(inverse, values)
+    return np.bincount(pairs[:, 0].astype(np.int64), minlength=ngroups)
+
+def txgc_slopes(table, txgc_range=TXGC_RANGE):
+    """dB per TXGC step per sweep kind, module and channel, over TXGC in
+    txgc_range"""
+    (lo, hi) = txgc_range
+    with np.errstate(invalid='ignore'):
+        rows = (_finite(table, 'channel', 'txgc', 'txpo') & (table['txgc'] >= lo) &
+                (table['txgc'] <= hi) & (table['txpo'] != 0))
+    (keys, inverse) = group(table.kind[rows], table.mac[rows], table['channel'][rows])
+    txgc = table['txgc'][rows]
+    (n, slope, intercept, r2, rms) = group_fit(txgc, table['txpo'][rows], inverse, len(keys))
+    low = np.full(len(keys), np.inf)
+    high = np.full(len(keys), -np.inf)
+    np.minimum.at(low, inverse, txgc)
+    np.maximum.at(high, inverse, txgc)
+    keep = np.isfinite(slope)
+    return collections.OrderedDict([
+        ('kind', _kinds(keys[keep, 0])), ('MAC', _macs(table, keys[keep, 1])),
+        ('channel', keys[keep, 2].astype(np.int64)), ('n', n[keep]),
+        ('txgc_lo', low[keep].astype(np.int64)), ('txgc_hi', high[keep].astype(np.int64)),
+        ('slope_db_per_step', slope[keep]),
+        ('intercept_dbm', intercept[keep])])
+
+def pdout_variance(table):
+    """Variance of repeated pdout reads: (per module/channel/settings table,
+    per (delay, nsamples) summary)"""
+    rows = _finite(table, 'channel', 'pdout', 'nsamples')
+    delay = table['delay'][rows]
+    nsamples = table['nsamples'][rows]
+    (keys, inverse) = group(table.mac[rows], table['channel'][rows], table['txgc'][rows],
+        delay, nsamples)
+    pdout = table['pdout'][rows]
+    n = np.bincount(inverse, minlength=len(keys))
+    mean = np.bincount(inverse, pdout, len(keys)) / n
+    dev = pdout - mean[inverse]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = np.where(n > 1, np.bincount(inverse, dev * dev, len(keys)) / (n - 1), np.nan)
+    detail = collections.OrderedDict([
+        ('MAC', _macs(table, keys[:, 0])), ('channel', keys[:, 1].astype(np.int64)),
+        ('txgc', keys[:, 2].astype(np.int64)), ('delay', keys[:, 3].astype(np.int64)),
+        ('nsamples', keys[:, 4].astype(np.int64)), ('n', n), ('pdout_mean', mean),
+        ('pdout_var', var)])
+    ok = np.isfinite(var)
+    (settings, which) = group(keys[ok, 3], keys[ok, 4])
+    groups = np.bincount(which, minlength=len(settings))
+    var_ok = var[ok]
+    order = np.lexsort((var_ok, which))
+    # Median per settings group from the sorted variances
+    starts = np.concatenate([[0], np.cumsum(groups)[:-1]])
+    sorted_var = var_ok[order]
+    median = (sorted_var[starts + (groups - 1) // 2] + sorted_var[starts + groups // 2]) / 2
+    summary = collections.OrderedDict([
+        ('delay', settings[:, 0].astype(np.int64)), ('nsamples', settings[:, 1].astype(np.int64)),
+        ('groups', groups), ('mean_var', np.bincount(which, var_ok, len(settings)) / groups),
+        ('median_var', median), ('max_var', _group_max(var_ok, which, len(settings)))])
+    return (detail, summary)
+
+def _group_max(values, inverse, ngroups):
+    out = np.full(ngroups, -np.inf)
+    np.maximum.at(out, inverse, values)
+    return out
+
+def temp_drift(table):
+    """dB per degree C per sweep kind, module, channel and TXGC, where the
+    temperature varied"""
+    rows = _finite(table, 'channel', 'temp', 'txpo', 'txgc') & (table['txpo'] != 0)
+    (keys, inverse) = group(table.kind[rows], table.mac[rows], table['channel'][rows],
+        table['txgc'][rows])
+    temp = table['temp'][rows]
+    (n, slope, intercept, r2, rms) = group_fit(temp, table['txpo'][rows], inverse, len(keys))
+    low = np.full(len(keys), np.inf)
+    high = np.full(len(keys), -np.inf)
+    np.minimum.at(low, inverse, temp)
+    np.maximum.at(high, inverse, temp)
+    keep = np.isfinite(slope)
+    return collections.OrderedDict([
+        ('kind', _kinds(keys[keep, 0])), ('MAC', _macs(table, keys[keep, 1])),
+        ('channel', keys[keep, 2].astype(np.int64)), ('txgc', keys[keep, 3].astype(np.int64)),
+        ('n', n[keep]), ('temp_lo', low[keep]), ('temp_hi', high[keep]),
+        ('drift_db_per_c', slope[keep]), ('r2', r2[keep])])
+
+
+def write_table(path, table):
+    """Save a summary table as CSV, in the scripts' ", " style"""
+    names = list(table.keys())
+    columns = [table[name] for name in names]
+    with open(path, 'w') as f:
+        f.write("%s\n" % ", ".join(names))
+        for i in range(len(columns[0]) if columns else 0):
+            f.write("%s\n" % ", ".join(_cell(column[i]) for column in columns))
+
+def _cell(value):
+    if(isinstance(value, (float, np.floating))):
+        return "%.6g" % value
+    return str(value)
+
+REPORTS = [
+    ('txpo_pdout_fits.csv', txpo_pdout_fits),
+    ('txgc_slopes.csv', txgc_slopes),
+    ('pdout_variance.csv', lambda t: pdout_variance(t)[0]),
+    ('pdout_variance_summary.csv', lambda t: pdout_variance(t)[1]),
+    ('temp_drift.csv', temp_drift),
+]
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='+', metavar='FILE_OR_DIR')
+    parser.add_argument('--out', default='.', help="directory for the summary tables")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    table = ResultTable.load(args.paths)
+    t1 = time.time()
+    print "Loaded %d rows from %d files (%d modules) in %.2fs" % (len(table),
+        len(table.files), len(table.macs), t1 - t0)
+    for kind in KINDS:
+        rows = int(table.kind_mask(kind).sum())
+        if(rows):
+            print "  %-13s %8d rows" % (kind, rows)
+    if(not os.path.isdir(args.out)):
+        os.makedirs(args.out)
+    for (name, report) in REPORTS:
+        summary = report(table)
+        path = os.path.join(args.out, name)
+        write_table(path, summary)
+        print "%-28s %6d rows" % (path, len(summary.values()[0]))
+    print "Analysis took %.2fs" % (time.time() - t1)
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Coroutine execution layer for the Summit module and power meter I/O
+
+The scripts run on Python 2, which has no asyncio, so this is the same idea
+with generators (as in Tornado/Trollius): a coroutine is a generator that
+yields Futures (mg_measure.Future) and gets each one's result back when it is
+done, or its exception raised at the yield. Yielding another coroutine runs
+it and waits for it; yielding a list waits for all of them. A coroutine
+returns a value with raise Return(value).
+
+    def point(dev, pm, ch):
+        yield dev.set_radio_channel(0, ch)
+        (status, temp) = yield dev.temperature()
+        stats = yield measure(dev, pm, 5000)
+        raise Return((ch, temp, stats.trimmed_mean()))
+
+    loop = Loop()
+    executor = Executor()
+    dev = AsyncDevice(TX, executor)
+    pm = AsyncMeter(connect_meter(), executor)
+    print loop.run_until_complete(loop.spawn(point(dev, pm, 8)))
+
+AsyncDevice and AsyncMeter turn every blocking call (PM.cmd, TX.rd/wr,
+transmit_packets, invoke_radio_cal_state, ...) into a Future run on an
+Executor. The executor has a fixed number of threads shared by every DUT.
+Calls on the same device or meter run one at a time, in order, as its serial
+link requires. Calls on different links overlap. The coroutines all run on
+the loop's one thread, so any number of DUT sessions fit in one process
+without a thread pair each.
+
+AsyncWorkers runs the scripts' transmit-and-measure jobs this way. It has
+the same submit() as mg_measure.MeasurementWorkers, so a script's sweep runs
+on it unchanged (main(..., workers=AsyncWorkers())). One AsyncWorkers can
+serve every DUT in the process: mg_multi_dut --coroutines gives each DUT
+session its own thread for the script, but all of their bursts and meter
+readings are driven from the one loop thread, on one Executor, instead of a
+device thread and a meter thread per DUT.
+"""
+
+import sys
+import time
+import types
+import heapq
+import Queue
+import logging
+import threading
+import collections
+from pysummit import decoders as dec
+from mg_measure import Future, RunningStats, Measurement, MEAS_TIMEOUT
+
+class Return(Exception):
+    """raise Return(value) to return value from a coroutine"""
+    def __init__(self, value=None):
+        super(Return, self).__init__()
+        self.value = value
+
+# -------------------------------------------------------
+# Executor: blocking calls on a shared pool of threads
+# -------------------------------------------------------
+class Executor(object):
+    """Runs blocking calls on max_workers threads
+
+    Calls submitted for the same link run one at a time in submission order,
+    so a worker never sits blocked behind another call on a busy link.
+    """
+    def __init__(self, max_workers=8):
+        self._jobs = Queue.Queue()
+        self._links = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(max_workers):
+            t = threading.Thread(target=self._work, name='Executor-%d' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, link, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) behind the other calls on link; returns
+        a Future"""
+        future = Future()
+        job = (link, fn, args, kwargs, future)
+        with self._lock:
+            pending = self._links.get(link)
+            if(pending is not None):
+                pending.append(job)
+                return future
+            self._links[link] = collections.deque()
+        self._jobs.put(job)
+        return future
+
+    def _work(self):
+        while(True):
+            job = self._jobs.get()
+            if(job is None):
+                break
+            (link, fn, args, kwargs, future) = job
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                result = None
+                future.set_exception(sys.exc_info())
+                sys.exc_clear()
+            else:
+                future.set_result(result)
+            # Hand the link its next call, if any
+            with self._lock:
+                pending = self._links[link]
+                if(pending):
+                    self._jobs.put(pending.popleft())
+                else:
+                    del self._links[link]
+            # Don't keep the last call's arguments and result alive while
+            # waiting for the next one
+            del job, link, fn, args, kwargs, future, result
+
+    def shutdown(self):
+        for t in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join()
+
+class _AsyncWrapper(object):
+    def __init__(self, obj, executor):
+        self._obj = obj
+        self._executor = executor
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if(not callable(attr)):
+            return attr
+        obj = self._obj
+        executor = self._executor
+
+        def submit(*args, **kwargs):
+            return executor.submit(obj, attr, *args, **kwargs)
+        return submit
+
+    def __getitem__(self, key):
+        return self._obj[key]
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on this link, e.g. a helper that talks to
+        the same meter; returns a Future"""
+        return self._executor.submit(self._obj, fn, *args, **kwargs)
+
+class AsyncDevice(_AsyncWrapper):
+    """A Summit device whose calls (rd, wr, transmit_packets,
+    invoke_radio_cal_state, ...) return Futures"""
+
+class AsyncMeter(_AsyncWrapper):
+    """A power meter whose calls (cmd, meter_reset, ...) return Futures"""
+
+# -------------------------------------------------------
+# Loop: runs the coroutines
+# -------------------------------------------------------
+class Task(Future):
+    """A coroutine scheduled on a Loop; done when the coroutine returns"""
+    def __init__(self, loop, gen):
+        super(Task, self).__init__()
+        self.loop = loop
+        self.gen = gen
+
+    def _step(self, value=None, exc_info=None):
+        try:
+            if(exc_info is not None):
+                yielded = self.gen.throw(*exc_info)
+            else:
+                yielded = self.gen.send(value)
+        except StopIteration:
+            self.set_result(None)
+        except Return as ret:
+            self.set_result(ret.value)
+        except Exception:
+            self.set_exception(sys.exc_info())
+        else:
+            if(isinstance(yielded, (list, tuple))):
+                yielded = gather([self.loop.as_future(y) for y in yielded])
+            yielded = self.loop.as_future(yielded)
+            if(not isinstance(yielded, Future)):
+                self.loop.call_soon(self._step, None, (TypeError,
+                    TypeError("Coroutines must yield Futures, not %r" % (yielded,)), None))
+                return
+            yielded.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        # Runs on whichever thread finished the future
+        if(future.exc_info() is not None):
+            self.loop.call_soon(self._step, None, future.exc_info())
+        else:
+            self.loop.call_soon(self._step, future.result())
+
+def gather(futures):
+    """A Future of the list of results of futures"""
+    futures = list(futures)
+    result = Future()
+    if(not futures):
+        result.set_result([])
+        return result
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            last = (remaining[0] == 0)
+        if(not last):
+            return
+        for f in futures:
+            if(f.exc_info() is not None):
+                result.set_exception(f.exc_info())
+                return
+        result.set_result([f.result() for f in futures])
+
+    for future in futures:
+        future.add_done_callback(done)
+    return result
+
+class Loop(object):
+    """Runs coroutines on the thread that calls run_until_complete()"""
+    def __init__(self):
+        self._ready = Queue.Queue()
+        self._timers = []
+        self._timer_lock = threading.Lock()
+        self._seq = 0
+        self._stopped = False
+
+    def call_soon(self, fn, *args):
+        """Run fn(*args) on the loop thread (safe from any thread)"""
+        self._ready.put((fn, args))
+
+    def as_future(self, obj):
+        """Spawn obj if it is a coroutine; anything else is returned as is"""
+        if(isinstance(obj, types.GeneratorType)):
+            return self.spawn(obj)
+        return obj
+
+    def spawn(self, gen):
+        """Schedule the coroutine gen; returns its Task"""
+        task = Task(self, gen)
+        self.call_soon(task._step)
+        return task
+
+    def sleep(self, seconds):
+        """A Future done after seconds, without holding a thread"""
+        future = Future()
+        with self._timer_lock:
+            self._seq += 1
+            heapq.heappush(self._timers, (time.time() + seconds, self._seq, future))
+        self.call_soon(lambda: None)    # wake the loop to see the new timer
+        return future
+
+    def _fire_timers(self):
+        now = time.time()
+        with self._timer_lock:
+            due = []
+            while(self._timers and self._timers[0][0] <= now):
+                due.append(heapq.heappop(self._timers)[2])
+            wait = (self._timers[0][0] - now) if self._timers else None
+        for future in due:
+            future.set_result(None)
+        return wait
+
+    def _run_once(self):
+        wait = self._fire_timers()
+        try:
+            (fn, args) = self._ready.get(timeout=wait if wait is not None else 1.0)
+        except Queue.Empty:
+            return
+        fn(*args)
+
+    def run_until_complete(self, future):
+        """Run the loop until future is done; returns its result"""
+        while(not future.done()):
+            self._run_once()
+        return future.result()
+
+    def run_forever(self):
+        """Run the loop until stop() is called"""
+        self._stopped = False
+        while(not self._stopped):
+            self._run_once()
+
+    def stop(self):
+        """Make run_forever() return (safe from any thread)"""
+        def stop():
+            self._stopped = True
+        self.call_soon(stop)
+
+# -------------------------------------------------------
+# Coroutine version of mg_measure.tx_measure
+# -------------------------------------------------------
+def measure(dev, pm, packet_count, meas_cmd="FETCH?", adaptive=None, buffered=None,
+            tx_done=None):
+    """Coroutine: transmit packet_count packets while sampling; returns
+    RunningStats with packets_sent (like mg_measure.tx_measure)
+
+    dev and pm are an AsyncDevice and an AsyncMeter. With adaptive (an
+    AdaptiveStop) the burst is sent in chunks and stops once the reading
+    has settled. With buffered (a mg_meter.BufferedReadout for pm's meter)
+    the readings are read back in one transfer after the burst, when the
+    meter supports it; adaptive takes precedence. tx_done, a Future, is
+    given the number of packets sent as soon as the device is done.
+    """
+    logger = logging.getLogger('measure')
+    if(tx_done is None):
+        tx_done = Future()
+    stats = RunningStats()
+    sent = 0
+    try:
+        if(buffered is not None and adaptive is None and (yield pm.submit(buffered.probe))):
+            tx = dev.transmit_packets(packet_count)
+            yield pm.submit(buffered.arm)
+            (status, null) = yield tx
+            if(status == 0x01):
+                sent = packet_count
+            else:
+                logger.error(dec.decode_error_status(status, 'transmit_packets'))
+            tx_done.set_result(sent)
+            for meas in (yield pm.submit(buffered.read, timeout=MEAS_TIMEOUT)):
+                stats.add(meas)
+        else:
+            chunk = adaptive.chunk_packets if adaptive is not None else packet_count
+            while(sent < packet_count):
+                n = min(chunk, packet_count - sent)
+                tx = dev.transmit_packets(n)
+                settled = False
+                while(not tx.done()):
+                    stats.add((yield pm.cmd(meas_cmd, timeout=MEAS_TIMEOUT)))
+                    if(adaptive is not None and adaptive.settled(stats)):
+                        settled = True
+                        break
+                (status, null) = yield tx
+                if(status != 0x01):
+                    logger.error(dec.decode_error_status(status, 'transmit_packets'))
+                    break
+                sent += n
+                if(settled):
+                    break
+            tx_done.set_result(sent)
+    except Exception:
+        if(not tx_done.done()):
+            tx_done.set_exception(sys.exc_info())
+        raise
+    if(stats.rejected()):
+        logger.warning("Rejected %d of %d replies" % (stats.rejected(),
+            stats.rejected() + stats.count))
+    yield pm.cmd("INIT:CONT ON")
+    stats.packets_sent = sent
+    raise Return(stats)
+
+class AsyncWorkers(object):
+    """Transmit-and-measure jobs run as coroutines on one loop thread
+
+    Takes the same jobs as mg_measure.MeasurementWorkers and returns the
+    same Measurement, but any number of DUT sessions can share one: the
+    device and meter calls of every job run on an Executor of max_workers
+    threads. Each DUT has at most two calls in flight (its burst and a
+    reading), so max_workers=2*N keeps N DUTs from waiting on each other.
+    """
+    def __init__(self, max_workers=8):
+        self.executor = Executor(max_workers)
+        self.loop = Loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='AsyncWorkers')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, dev, power_meter, packet_count, meas_cmd="FETCH?", adaptive=None,
+               buffered=None):
+        """Queue a transmit-and-measure job; returns a Measurement (see
+        MeasurementWorkers.submit)"""
+        begin_lease = getattr(power_meter, 'begin_lease', None)
+        if(begin_lease is not None):
+            begin_lease()
+        tx_future = Future()
+        task = self.loop.spawn(self._job(dev, power_meter, packet_count, meas_cmd,
+            adaptive, buffered, tx_future))
+        return Measurement(tx_future, task)
+
+    def _job(self, dev, power_meter, packet_count, meas_cmd, adaptive, buffered, tx_future):
+        pm = AsyncMeter(power_meter, self.executor)
+        exc_info = None
+        try:
+            stats = yield measure(AsyncDevice(dev, self.executor), pm, packet_count,
+                meas_cmd, adaptive, buffered, tx_future)
+        except Exception:
+            exc_info = sys.exc_info()
+        # Give a shared meter back once we are done with it
+        if(hasattr(power_meter, 'end_lease')):
+            yield pm.end_lease()
+        if(exc_info is not None):
+            raise exc_info[0], exc_info[1], exc_info[2]
+        raise Return(stats)
+
+    def shutdown(self):
+        self.loop.stop()
+        self.thread.join()
+        self.executor.shutdown()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark harness for the sweep and calibration entry points
+
+Runs the real entry points against the simulator (mg_sim) with configurable
+timing and reports, per scenario:
+
+    channels/minute       set_radio_channel calls per minute of wall time
+    points/minute         transmit_packets (or cal state) calls per minute
+    fetch/s               FETCH?/MEAS? readings per second
+    register/transmit/meter seconds
+                          busy time of the simulated device register I/O
+                          (rd/wr, channel, temperature, pdout, flash), of the
+                          device on air (transmit, cal) and of the meter
+    cpu                   process CPU seconds, and as a % of wall time
+
+Scenarios run in a scratch directory (with a copy of pm_offset.dat) so the
+result files don't land in the working tree, and the scripts' console output
+is discarded. Results go to a JSON file so runs can be compared across
+changes:
+
+    python mg_bench.py [--scale 0.1] [--out bench_results.json] [scenario ...]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import mg_sim
+
+REGISTER_CATEGORIES = ['reg', 'channel', 'temperature', 'pdout', 'flash']
+TRANSMIT_CATEGORIES = ['transmit', 'cal']
+METER_CATEGORIES = ['meter_fetch', 'meter_cmd', 'meter_setup']
+
+def _main_of(module_name):
+    def run(station):
+        return mg_sim.run_main(__import__(module_name), station)
+    return run
+
+def _cal_tx_measure(station):
+    # Just the calibration session, without the meter/device bring-up in main()
+    import cal_olympus_mjg
+    station.install()
+    try:
+        cal_olympus_mjg.tx_measure(dev=station.TX, power_meter=station.meter)
+    finally:
+        station.uninstall()
+
+SCENARIOS = [
+    ('txpo', _main_of('mg_txpo_test')),
+    ('steptxgc', _main_of('mg_step_txgc_test')),
+    ('pdout_parms', _main_of('mg_get_pdout_parms')),
+    ('pdout_timing', _main_of('mg_pdout_timing_test')),
+    ('cal_tx_measure', _cal_tx_measure),
+]
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+def _sum(table, categories):
+    return sum(table.get(c, 0) for c in categories)
+
+def run_scenario(name, fn, timing):
+    """Run one scenario in a scratch directory; returns a dict of metrics"""
+    station = mg_sim.SimStation(timing=timing)
+    here = os.path.dirname(os.path.abspath(__file__))
+    scratch = tempfile.mkdtemp(prefix='mg_bench_')
+    shutil.copy(os.path.join(here, 'pm_offset.dat'), scratch)
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    os.chdir(scratch)
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        c0 = cpu_time()
+        t0 = time.time()
+        fn(station)
+        wall = time.time() - t0
+        cpu = cpu_time() - c0
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    (calls, seconds) = station.busy()
+    channels = calls.get('channel', 0)
+    points = _sum(calls, TRANSMIT_CATEGORIES)
+    return {
+        'scenario': name,
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'cpu_pct': 100.0 * cpu / wall if wall else 0.0,
+        'channels': channels,
+        'channels_per_min': 60.0 * channels / wall if wall else 0.0,
+        'points': points,
+        'points_per_min': 60.0 * points / wall if wall else 0.0,
+        'fetches': calls.get('meter_fetch', 0),
+        'fetch_per_s': calls.get('meter_fetch', 0) / wall if wall else 0.0,
+        'register_s': _sum(seconds, REGISTER_CATEGORIES),
+        'transmit_s': _sum(seconds, TRANSMIT_CATEGORIES),
+        'meter_s': _sum(seconds, METER_CATEGORIES),
+        'calls': calls,
+        'busy_s': seconds,
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def report(result):
+    print "%-15s %7.1fs  %6.1f ch/min  %6.1f pts/min  %5.1f fetch/s  " \
+          "reg %6.2fs  tx %6.2fs  meter %6.2fs  cpu %5.1f%%" % \
+        (result['scenario'], result['wall_s'], result['channels_per_min'],
+         result['points_per_min'], result['fetch_per_s'], result['register_s'],
+         result['transmit_s'], result['meter_s'], result['cpu_pct'])
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('scenarios', nargs='*', help="scenarios to run (default: all of %s)" %
+        ", ".join(name for (name, fn) in SCENARIOS))
+    parser.add_argument('--scale', type=float, default=1.0,
+        help="multiply every simulated latency by this")
+    parser.add_argument('--jitter', type=float, default=0.0,
+        help="+/- fraction of jitter on every simulated latency")
+    parser.add_argument('--out', default='bench_results.json', help="JSON results file")
+    args = parser.parse_args()
+
+    selected = [(name, fn) for (name, fn) in SCENARIOS
+                if not args.scenarios or name in args.scenarios]
+    timing = mg_sim.SimTiming(scale=args.scale, jitter=args.jitter)
+
+    results = []
+    for (name, fn) in selected:
+        result = run_scenario(name, fn, timing)
+        report(result)
+        results.append(result)
+
+    with open(args.out, 'w') as f:
+        json.dump({
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+            'revision': git_revision(),
+            'timing': dict((k, v) for (k, v) in vars(timing).items()),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print "Results written to %s" % args.out
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Radio cal session driver shared by the cal scripts, with a checkpoint journal
+
+run_cal() steps the firmware's radio cal state machine from
+RADIOCALSTATE_BEGIN to IDLE. The meter samples each state (a
+mg_measure.CalReadings), and the state's reading goes to the device with
+the next state.
+
+Every reading the device accepts is appended to the module's journal
+(cal_journal_<MAC>.jsonl) and flushed to disk at once. A reading counts as
+accepted when the invoke_radio_cal_state carrying it returns RADIOCAL_OK.
+A session that doesn't get back to IDLE leaves the journal behind: a meter
+IOError, a serial timeout, a RADIOCAL_* failure or a Ctrl-C. The next
+session on that module then resumes after the last channel block (see
+mg_calstates) whose readings were all accepted. The firmware works its
+results out from every reading it is given since RADIOCALSTATE_BEGIN, so
+the session invokes BEGIN and then replays every state up to the end of
+that block with its journaled reading, in order, as the first session did
+(the device runs each state again, but the meter isn't read). Only then
+does it go on live. If the firmware refuses any of the replay (anything
+but RADIOCAL_OK), the journal is dropped and the session starts over from
+BEGIN.
+
+A journal older than CAL_JOURNAL_MAX_AGE isn't resumed, since the module
+will have drifted. RESUME_CAL = False turns resuming off.
+"""
+
+import os
+import json
+import time
+import logging
+from mg_calstates import rcss, RADIOCAL_OK, STATE_BEGIN, STATE_IDLE
+
+# Pick up interrupted sessions from their journal
+RESUME_CAL = True
+CAL_JOURNAL = 'cal_journal_%s.jsonl'
+# Seconds since its last reading after which a journal is started over
+CAL_JOURNAL_MAX_AGE = 3600
+
+class CalJournal(object):
+    """Append-only record of the readings one module's cal session had accepted"""
+    def __init__(self, path):
+        self.path = path
+        self.readings = {}      # state id -> reading
+        self.updated = None
+        self._file = None
+        self.logger = logging.getLogger('CalJournal')
+
+    @classmethod
+    def for_device(cls, dev):
+        return cls(CAL_JOURNAL % dev['mac'].replace(':', '-'))
+
+    def load(self):
+        self.readings = {}
+        self.updated = None
+        try:
+            f = open(self.path, 'r')
+        except IOError:
+            return self
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; everything before it stands
+                    self.logger.warning("%s: skipping a torn record" % self.path)
+                    continue
+                state = rcss[str(record.get('state'))]
+                if(state is not None):
+                    self.readings[state] = record['reading']
+                    self.updated = record['time']
+        return self
+
+    def resume_point(self):
+        """The last state of the last channel block whose readings are all
+        in the journal, or None to start over"""
+        self.load()
+        if(not self.readings):
+            return None
+        if(time.time() - self.updated > CAL_JOURNAL_MAX_AGE):
+            self.logger.info("%s is too old to resume" % self.path)
+            return None
+        last = None
+        for block in rcss.blocks:
+            if(not all(state in self.readings for state in block)):
+                break
+            last = block[-1]
+        return last
+
+    def start(self, resumed):
+        """Open the journal for a session; a fresh session empties it"""
+        self._file = open(self.path, 'a' if resumed else 'w')
+
+    def record(self, state, reading):
+        self.readings[state] = reading
+        self._file.write(json.dumps({'time': time.time(), 'state': rcss[state],
+            'reading': reading}) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if(self._file is not None):
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """The session is over (or can't be resumed): remove the journal"""
+        self.close()
+        self.readings = {}
+        if(os.path.exists(self.path)):
+            os.remove(self.path)
+
+
+class ResumeRefused(Exception):
+    pass
+
+def run_cal(dev, readings, journal=None):
+    """Run a radio cal session on dev; returns (status, state, measurement)
+
+    The state machine is left where it stopped: on RADIOCAL_OK at IDLE,
+    otherwise the caller decides what to send (RADIOCALSTATE_FINISHED)
+    with the last measurement.
+    """
+    logger = logging.getLogger('run_cal')
+    resume = None
+    if(journal is not None and RESUME_CAL):
+        resume = journal.resume_point()
+    try:
+        return _session(dev, readings, journal, resume)
+    except ResumeRefused as info:
+        logger.warning("Firmware refused the replay up to %s (%s), starting over" %
+            (rcss[resume], info))
+        journal.discard()
+        return _session(dev, readings, journal, None)
+    finally:
+        if(journal is not None):
+            journal.close()
+
+def _replay(dev, journal, state, last):
+    """Invoke every state from state up to last with its journaled reading,
+    as the session that took them did; returns the state after last"""
+    measured = None
+    while(True):
+        if(rcss.info(state).takes_measurement):
+            if(measured not in journal.readings):
+                raise ResumeRefused("no reading for %s" % rcss[measured])
+            measurement = journal.readings[measured]
+        else:
+            measurement = None
+        (status, next_state) = dev.invoke_radio_cal_state(state, measurement)
+        if(status != RADIOCAL_OK):
+            raise ResumeRefused(status)
+        if(state == last):
+            return next_state
+        if(next_state == STATE_IDLE):
+            raise ResumeRefused("state machine finished before %s" % rcss[last])
+        measured = state
+        state = next_state
+
+def _session(dev, readings, journal, resume):
+    measurement = None
+    measured = None
+    (status, state) = dev.invoke_radio_cal_state(STATE_BEGIN, None)
+    if(status != RADIOCAL_OK):
+        return (status, state, measurement)
+    if(resume is not None):
+        state = _replay(dev, journal, state, resume)
+        measured = resume
+        measurement = journal.readings[resume]
+        print "  Replayed up to %s, resuming at %s" % (rcss[resume], rcss[state])
+    if(journal is not None):
+        journal.start(resume is not None)
+    while(True):
+        info = rcss.info(state)
+        if(not info.takes_measurement):
+            measurement = None
+        else:
+            print "  %s: %f" % (info.name, measurement)
+        # The meter samples while the device runs this state; its readings
+        # go to the device with the next one
+        readings.open(state)
+        (status, next_state) = dev.invoke_radio_cal_state(state, measurement)
+        stats = readings.close()
+        if(status != RADIOCAL_OK):
+            return (status, next_state, measurement)
+        if(journal is not None and measurement is not None):
+            journal.record(measured, measurement)
+        measurement = stats.trimmed_mean()
+        measured = state
+        state = next_state
+        if(state == STATE_IDLE):
+            break
+    if(journal is not None):
+        journal.discard()
+    return (status, state, measurement)
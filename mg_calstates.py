@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Radio cal state and status tables for the calibration scripts
+
+The firmware numbers the cal states and status codes by their position in
+RADIOCAL_STATES and RADIOCAL_STATUS. StateTable compiles such a list once
+into name->id and id->name dicts, so a lookup is one dict or tuple access
+instead of two scans of the list. For each state it also works out what
+the cal driver needs to know (CalState):
+
+    channel             RF channel index of the cal point (None for IDLE,
+                        BEGIN, FINISHED and MAX)
+    kind                'B' for a successive approximation step, 'P' for a
+                        point of the 3-point characterization, else None
+    step                the B or P number (B5 -> 5, P2 -> 2)
+    on_air              the module transmits while it runs this state
+    takes_measurement   the state is invoked with the reading taken during
+                        the state before it (every state after F0_B5, up to
+                        and including FINISHED)
+    block               index of the channel block the state belongs to: the
+                        run of states with the same channel and kind (F0 B5
+                        to B0, F0 P0 to P2, F1 P0 to P2, ...)
+
+    state = rcss.info(cal_sm_state)
+    if(state.takes_measurement):
+        ...
+"""
+
+import re
+import collections
+
+RADIOCAL_STATUS = [
+        "RADIOCAL_OK",
+        "RADIOCAL_INVALID_POINTER",
+        "RADIOCAL_INVALID_STATE_POINTER",
+        "RADIOCAL_INVALID_STATE_TRANSITION",
+        "RADIOCAL_FAILED_TO_READ_MFG_SECTION_DATA",
+        "RADIOCAL_FAILED_TO_ERASE_MFG_SECTION_DATA",
+        "RADIOCAL_FAILED_TO_WRITE_MFG_SECTION_DATA",
+        "RADIOCAL_FAILED_TO_INITIALIZE_STATIC_TX_PARAMETERS",
+        "RADIOCAL_FAILED_TO_ENABLE_POWER_COMPENSATION",
+        "RADIOCAL_FAILED_TO_DISABLE_POWER_COMPENSATION",
+        "RADIOCAL_INVALID_MEASUREMENT_POINTER",
+        "RADIOCAL_FAILED_TO_REGISTER_TX_PARAMETERS",
+        "RADIOCAL_FAILED_TO_SET_CAL_POINT",
+        "RADIOCAL_FAILED_TO_RETRIEVE_TEMPERATURE",
+        "RADIOCAL_INVALID_CAL_PARAMETERS",
+        "RADIOCAL_INVALID_CAL_POINT",
+        "RADIOCAL_INVALID_CAL_MEASUREMENT",
+        "RADIOCAL_INVALID_STATE_INFO_STATE",
+        "RADIOCAL_INVALID_STATE_FOR_TXGC_UPDATE",
+        "RADIOCAL_SLOPE_INTERCEPT_DIVIDE_BY_ZERO_ERROR",
+        "RADIOCAL_INVALID_CORRECTION_DATA",
+        "RADIOCAL_FAILED_TO_READ_REGISTER",
+        "RADIOCAL_FAILED_TO_WRITE_REGISTER",
+        "RADIOCAL_FAILED_WHILE_UPDATING_RADIO_CAL_BLOCK",
+        "RADIOCAL_UNDEFINED_FAILURE"
+    ]
+
+RADIOCAL_STATES = [
+        "RADIOCALSTATE_IDLE", "RADIOCALSTATE_BEGIN",
+
+            # Successive approximation @ RF Channel index 0 to determine
+            # nominal TXGC value
+        "RADIOCALSTATE_F0_B5", "RADIOCALSTATE_F0_B4", "RADIOCALSTATE_F0_B3",
+        "RADIOCALSTATE_F0_B2", "RADIOCALSTATE_F0_B1", "RADIOCALSTATE_F0_B0",
+            # 3-Point characterization performed at each RF Channel index in
+            # the range 0 to 6
+        "RADIOCALSTATE_F0_P0", "RADIOCALSTATE_F0_P1", "RADIOCALSTATE_F0_P2",
+        "RADIOCALSTATE_F1_P0", "RADIOCALSTATE_F1_P1", "RADIOCALSTATE_F1_P2",
+        "RADIOCALSTATE_F2_P0", "RADIOCALSTATE_F2_P1", "RADIOCALSTATE_F2_P2",
+        "RADIOCALSTATE_F3_P0", "RADIOCALSTATE_F3_P1", "RADIOCALSTATE_F3_P2",
+        "RADIOCALSTATE_F4_P0", "RADIOCALSTATE_F4_P1", "RADIOCALSTATE_F4_P2",
+        "RADIOCALSTATE_F5_P0", "RADIOCALSTATE_F5_P1", "RADIOCALSTATE_F5_P2",
+        "RADIOCALSTATE_F6_P0", "RADIOCALSTATE_F6_P1", "RADIOCALSTATE_F6_P2",
+            # Successive approximation @ RF Channel index 7 to determine
+            # nominal TXGC value
+        "RADIOCALSTATE_F7_B5", "RADIOCALSTATE_F7_B4", "RADIOCALSTATE_F7_B3",
+        "RADIOCALSTATE_F7_B2", "RADIOCALSTATE_F7_B1", "RADIOCALSTATE_F7_B0",
+            # 3-Point characterization performed at each RF Channel index in
+            # the range 7 to 18
+        "RADIOCALSTATE_F7_P0", "RADIOCALSTATE_F7_P1", "RADIOCALSTATE_F7_P2",
+        #els    "e
+            # Successive approximation @ RF Channel index 8 to determine
+            # nominal TXGC value
+        "RADIOCALSTATE_F8_B5", "RADIOCALSTATE_F8_B4", "RADIOCALSTATE_F8_B3",
+        "RADIOCALSTATE_F8_B2", "RADIOCALSTATE_F8_B1", "RADIOCALSTATE_F8_B0",
+        #end    "if
+            # 3-Point characterization performed at each RF Channel index in
+            # the range 8 to 18
+        "RADIOCALSTATE_F8_P0", "RADIOCALSTATE_F8_P1", "RADIOCALSTATE_F8_P2",
+        "RADIOCALSTATE_F9_P0", "RADIOCALSTATE_F9_P1", "RADIOCALSTATE_F9_P2",
+        "RADIOCALSTATE_F10_P0", "RADIOCALSTATE_F10_P1", "RADIOCALSTATE_F10_P2",
+        "RADIOCALSTATE_F11_P0", "RADIOCALSTATE_F11_P1", "RADIOCALSTATE_F11_P2",
+        "RADIOCALSTATE_F12_P0", "RADIOCALSTATE_F12_P1", "RADIOCALSTATE_F12_P2",
+        "RADIOCALSTATE_F13_P0", "RADIOCALSTATE_F13_P1", "RADIOCALSTATE_F13_P2",
+        "RADIOCALSTATE_F14_P0", "RADIOCALSTATE_F14_P1", "RADIOCALSTATE_F14_P2",
+        "RADIOCALSTATE_F15_P0", "RADIOCALSTATE_F15_P1", "RADIOCALSTATE_F15_P2",
+        "RADIOCALSTATE_F16_P0", "RADIOCALSTATE_F16_P1", "RADIOCALSTATE_F16_P2",
+        "RADIOCALSTATE_F17_P0", "RADIOCALSTATE_F17_P1", "RADIOCALSTATE_F17_P2",
+        "RADIOCALSTATE_F18_P0", "RADIOCALSTATE_F18_P1", "RADIOCALSTATE_F18_P2",
+            # Successive approximation @ RF Channel index 19 to determine
+            # nominal TXGC value
+        "RADIOCALSTATE_F19_B5", "RADIOCALSTATE_F19_B4", "RADIOCALSTATE_F19_B3",
+        "RADIOCALSTATE_F19_B2", "RADIOCALSTATE_F19_B1", "RADIOCALSTATE_F19_B0",
+            # 3-Point characterization performed at each RF Channel index in
+            # the range 19 to 34
+        "RADIOCALSTATE_F19_P0", "RADIOCALSTATE_F19_P1", "RADIOCALSTATE_F19_P2",
+        "RADIOCALSTATE_F20_P0", "RADIOCALSTATE_F20_P1", "RADIOCALSTATE_F20_P2",
+        "RADIOCALSTATE_F21_P0", "RADIOCALSTATE_F21_P1", "RADIOCALSTATE_F21_P2",
+        "RADIOCALSTATE_F22_P0", "RADIOCALSTATE_F22_P1", "RADIOCALSTATE_F22_P2",
+        "RADIOCALSTATE_F23_P0", "RADIOCALSTATE_F23_P1", "RADIOCALSTATE_F23_P2",
+        "RADIOCALSTATE_F24_P0", "RADIOCALSTATE_F24_P1", "RADIOCALSTATE_F24_P2",
+        "RADIOCALSTATE_F25_P0", "RADIOCALSTATE_F25_P1", "RADIOCALSTATE_F25_P2",
+        "RADIOCALSTATE_F26_P0", "RADIOCALSTATE_F26_P1", "RADIOCALSTATE_F26_P2",
+        "RADIOCALSTATE_F27_P0", "RADIOCALSTATE_F27_P1", "RADIOCALSTATE_F27_P2",
+        "RADIOCALSTATE_F28_P0", "RADIOCALSTATE_F28_P1", "RADIOCALSTATE_F28_P2",
+        "RADIOCALSTATE_F29_P0", "RADIOCALSTATE_F29_P1", "RADIOCALSTATE_F29_P2",
+        "RADIOCALSTATE_F30_P0", "RADIOCALSTATE_F30_P1", "RADIOCALSTATE_F30_P2",
+        "RADIOCALSTATE_F31_P0", "RADIOCALSTATE_F31_P1", "RADIOCALSTATE_F31_P2",
+        "RADIOCALSTATE_F32_P0", "RADIOCALSTATE_F32_P1", "RADIOCALSTATE_F32_P2",
+        "RADIOCALSTATE_F33_P0", "RADIOCALSTATE_F33_P1", "RADIOCALSTATE_F33_P2",
+        "RADIOCALSTATE_F34_P0", "RADIOCALSTATE_F34_P1", "RADIOCALSTATE_F34_P2",
+        "RADIOCALSTATE_FINISHED", "RADIOCALSTATE_MAX" ]
+
+
+CalState = collections.namedtuple('CalState',
+    'id name channel kind step on_air takes_measurement block')
+
+_CAL_POINT = re.compile(r"RADIOCALSTATE_F(\d+)_([BP])(\d)$")
+
+class StateTable(object):
+    """A compiled list of names: table["NAME"] -> id, table[id] -> name
+
+    Unknown names and ids give None, as the old Enumish lists did.
+    """
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.ids = dict((name, i) for (i, name) in enumerate(self.names))
+        states = []
+        on_air = False
+        block = -1
+        last = None
+        for (i, name) in enumerate(self.names):
+            match = _CAL_POINT.match(name)
+            (channel, kind, step) = (None, None, None)
+            if(match is not None):
+                (channel, kind, step) = (int(match.group(1)), match.group(2), int(match.group(3)))
+                if((channel, kind) != last):
+                    block += 1
+                    last = (channel, kind)
+            states.append(CalState(i, name, channel, kind, step, kind is not None, on_air,
+                block if kind is not None else None))
+            on_air = kind is not None
+        self.states = tuple(states)
+        # block -> ids of its states, in order
+        self.blocks = []
+        for state in self.states:
+            if(state.block is not None):
+                if(state.block == len(self.blocks)):
+                    self.blocks.append([])
+                self.blocks[state.block].append(state.id)
+
+    def __getitem__(self, key):
+        if(isinstance(key, basestring)):
+            return self.ids.get(key)
+        if(0 <= key < len(self.names)):
+            return self.names[key]
+        return None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __str__(self):
+        return str(list(self.names))
+
+    def info(self, state_id):
+        """The CalState of state_id (a bare one for ids not in the table)"""
+        if(0 <= state_id < len(self.states)):
+            return self.states[state_id]
+        return CalState(state_id, None, None, None, None, False, False, None)
+
+rcs = StateTable(RADIOCAL_STATUS)
+rcss = StateTable(RADIOCAL_STATES)
+
+RADIOCAL_OK = rcs["RADIOCAL_OK"]
+STATE_IDLE = rcss["RADIOCALSTATE_IDLE"]
+STATE_BEGIN = rcss["RADIOCALSTATE_BEGIN"]
+STATE_FIRST = rcss["RADIOCALSTATE_F0_B5"]
+STATE_FINISHED = rcss["RADIOCALSTATE_FINISHED"]
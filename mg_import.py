@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Import archived sweep result text files into the result database
+
+Walks the given files and directories for the text files the scripts write
+(txpo_*.txt, steptxgc_*.csv, get_pdout_parms_*.csv), in whichever layout
+they were written: txpo with or without pdout (DUMP_PDOUT) and the gc
+registers (DUMP_TXGC_REGS), steptxgc with or without pdout (the slave
+script), get_pdout_parms from mg_get_pdout_parms or from
+mg_pdout_timing_test (no temp, txgc or txpo). Each file's columns come from
+its header line and its sweep from its name and columns
+(mg_results.detect_kind); files whose header isn't the result schema's are
+reported and skipped.
+
+A pool of worker processes reads and parses the files, CHUNK_BYTES at a
+time; this process adds each one to the database (mg_resultdb) as a run of
+its own, committing every COMMIT_ROWS rows. The run's started and finished
+times are the file's first and last row datetimes. moduleID and firmware
+aren't in the files, so imported runs don't have them.
+
+Imports are incremental. Every imported file is recorded (imports table)
+with its size, mtime and SHA-1: a file whose size and mtime are as recorded
+isn't read again, and one whose content was imported before, under any
+path, isn't imported again. A file that has changed is imported as a new
+run, and the old run kept.
+
+A file a sweep already recorded in the database as it ran (mg_resultdb
+open_run) isn't imported either: one whose path is the run's (a script
+records its file name relative to where it ran, so that is taken as
+relative to the current directory), or whose MAC and sweep are the run's
+and whose first row is between the run's start and finish (or its last
+recorded row, for a run that never finished). Such files are recorded as
+belonging to that run.
+
+    python mg_import.py [--db FILE] [--workers N] FILE_OR_DIR ...
+"""
+
+import os
+import sys
+import time
+import fnmatch
+import hashlib
+import argparse
+import itertools
+import collections
+import multiprocessing
+import mg_resultdb
+from mg_results import SCHEMA, TEXT_PATTERNS, detect_kind, timestamp
+
+# Bytes read (and hashed) at a time
+CHUNK_BYTES = 1 << 20
+# Rows added between commits
+COMMIT_ROWS = 200000
+
+_TABLES = """
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    sha1 TEXT,
+    run_id INTEGER REFERENCES runs(id),
+    imported REAL
+);
+CREATE INDEX IF NOT EXISTS imports_sha1 ON imports(sha1);
+"""
+
+def find_files(paths):
+    """The result text files in paths (files, or directories searched all the
+    way down)"""
+    found = []
+    for path in paths:
+        if(os.path.isdir(path)):
+            for (dirpath, dirnames, filenames) in os.walk(path):
+                for name in filenames:
+                    if(any(fnmatch.fnmatch(name, pattern) for pattern in TEXT_PATTERNS)):
+                        found.append(os.path.join(dirpath, name))
+        else:
+            found.append(path)
+    return sorted(set(os.path.abspath(p) for p in found))
+
+def _int(field):
+    try:
+        return int(field)
+    except ValueError:
+        if(field.strip()):
+            raise
+        return None
+
+def _float(field):
+    try:
+        return float(field)
+    except ValueError:
+        if(field.strip()):
+            raise
+        return None
+
+class _Timestamps(dict):
+    """Epoch seconds of datetime fields, working each minute out once"""
+    def __init__(self):
+        dict.__init__(self)
+        self.minutes = {}
+
+    def __missing__(self, field):
+        text = field.strip()
+        # "MM/DD/YYYY HH:MM:SS"
+        if(len(text) == 19 and text[16] == ':' and text[17:].isdigit()):
+            minute = self.minutes.get(text[:16])
+            if(minute is None):
+                minute = self.minutes[text[:16]] = timestamp(text[:16] + ':00')
+            value = minute + int(text[17:])
+        else:
+            value = timestamp(text)
+        self[field] = value
+        return value
+
+def _converters(columns):
+    """(fast, safe) converters per column: the fast ones are builtins that
+    take the fields as the scripts write them; the safe ones also take an
+    empty field (None)"""
+    codes = dict((name, code) for (name, code, fmt) in SCHEMA)
+    fast = []
+    safe = []
+    for name in columns:
+        if(name not in codes):
+            raise ValueError("column %r is not in the result schema" % name)
+        if(name == 'datetime'):
+            fast.append(_Timestamps().__getitem__)
+            safe.append(fast[-1])
+        elif(name == 'MAC'):
+            fast.append(str.strip)
+            safe.append(str.strip)
+        elif(codes[name] == 'd'):
+            fast.append(float)
+            safe.append(_float)
+        else:
+            fast.append(int)
+            safe.append(_int)
+    return (fast, safe)
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(CHUNK_BYTES), ''):
+            digest.update(data)
+    return digest.hexdigest()
+
+def _parse_lines(lines, converters, width):
+    """(rows as tuples, bad lines) of a chunk's lines
+
+    Converts a column at a time (map() over each column is a C loop), and
+    only goes a row at a time when a column won't convert."""
+    (fast, safe) = converters
+    split = [line.split(',') for line in lines]
+    fields = [f for f in split if len(f) == width]
+    # A half-written last line, or noise
+    bad = sum(1 for f in split if len(f) != width and ''.join(f).strip())
+    if(not fields):
+        return ([], bad)
+    try:
+        return (zip(*[map(convert, column) for (convert, column) in
+            zip(fast, zip(*fields))]), bad)
+    except ValueError:
+        pass
+    rows = []
+    for f in fields:
+        try:
+            rows.append(tuple([convert(field) for (convert, field) in zip(safe, f)]))
+        except ValueError:
+            bad += 1
+    return (rows, bad)
+
+def parse_file(path):
+    """(kind, columns, MAC, rows, bad lines) of a result text file. The rows
+    are tuples of the columns' values less MAC, with datetime in epoch
+    seconds."""
+    with open(path, 'rb') as f:
+        header = f.readline()
+        columns = [c.strip() for c in header.split(',')]
+        if(columns[:2] != ['datetime', 'MAC']):
+            raise ValueError("not a result file (columns %s)" % ", ".join(columns))
+        kind = detect_kind(path, columns)
+        if(kind is None):
+            raise ValueError("not a sweep result file")
+        converters = _converters(columns)
+        rows = []
+        bad = 0
+        rest = ''
+        for data in iter(lambda: f.read(CHUNK_BYTES), ''):
+            lines = (rest + data).split('\n')
+            rest = lines.pop()
+            (chunk, chunk_bad) = _parse_lines(lines, converters, len(columns))
+            rows.extend(chunk)
+            bad += chunk_bad
+        (chunk, chunk_bad) = _parse_lines([rest], converters, len(columns))
+        rows.extend(chunk)
+        bad += chunk_bad
+    macs = set(row[1] for row in rows)
+    if(len(macs) > 1):
+        raise ValueError("rows for more than one MAC (%s)" % ", ".join(sorted(macs)))
+    rows = [row[:1] + row[2:] for row in rows]
+    return (kind, columns[:1] + columns[2:], macs.pop() if macs else None, rows, bad)
+
+
+_known = frozenset()
+
+def _init_worker(known):
+    global _known
+    _known = known
+
+def _load(task):
+    """A worker's part: hash the file, then parse it if its content is new"""
+    (path, size, mtime) = task
+    result = {'path': path, 'size': size, 'mtime': mtime}
+    try:
+        result['sha1'] = _sha1(path)
+        if(result['sha1'] not in _known):
+            (result['kind'], result['columns'], result['mac'], result['rows'],
+             result['bad']) = parse_file(path)
+    except (IOError, ValueError) as info:
+        result['error'] = str(info)
+    return result
+
+
+def _live_runs(conn):
+    """({absolute path: run id}, {(MAC, kind): [(first, last, run id)]}) of
+    the runs sweeps recorded themselves (an imported run has the path of its
+    imports row)"""
+    paths = {}
+    spans = {}
+    for (run_id, script, mac, started, last, path) in conn.execute(
+            "SELECT id, script, mac, started, coalesce(finished, (SELECT max(datetime) "
+            "FROM results WHERE run_id = runs.id), started), path FROM runs WHERE path IS NULL "
+            "OR path NOT IN (SELECT path FROM imports)"):
+        if(path):
+            paths[os.path.abspath(path)] = run_id
+        kind = detect_kind(path or '', [], script)
+        if(kind is not None and mac is not None and started is not None):
+            # Rows are stamped to the second
+            spans.setdefault((mac, kind), []).append((int(started), last, run_id))
+    return (paths, spans)
+
+def _live_run(spans, result):
+    """The id of the live run a parsed file's rows belong to, or None"""
+    first = result['rows'][0][0]
+    for (started, last, run_id) in spans.get((result['mac'], result['kind']), []):
+        if(started <= first <= last):
+            return run_id
+    return None
+
+def import_files(paths, db=None, workers=None, log=sys.stdout):
+    """Import the result text files in paths; returns a Counter of files
+    imported, unchanged (size and mtime as recorded), duplicate (content
+    already imported), live (recorded by the sweep as it ran), failed, and
+    of rows and bad lines"""
+    conn = mg_resultdb.connect(db)
+    conn.executescript(_TABLES)
+    recorded = dict((path, (size, mtime)) for (path, size, mtime) in
+        conn.execute("SELECT path, size, mtime FROM imports"))
+    known = dict(conn.execute("SELECT sha1, run_id FROM imports"))
+    (live_paths, live_spans) = _live_runs(conn)
+    counts = collections.Counter()
+    tasks = []
+    for path in find_files(paths):
+        st = os.stat(path)
+        if(path in live_paths):
+            counts['live'] += 1
+        elif(recorded.get(path) == (st.st_size, st.st_mtime)):
+            counts['unchanged'] += 1
+        else:
+            tasks.append((path, st.st_size, st.st_mtime))
+    workers = workers or multiprocessing.cpu_count()
+    pool = None
+    if(workers > 1 and len(tasks) > 1):
+        pool = multiprocessing.Pool(workers, _init_worker, (frozenset(known),))
+        results = pool.imap_unordered(_load, tasks, chunksize=8)
+    else:
+        _init_worker(frozenset(known))
+        results = itertools.imap(_load, tasks)
+    inserts = {}
+    pending = 0
+    try:
+        for result in results:
+            if('error' in result):
+                log.write("Skipping %s: %s\n" % (result['path'], result['error']))
+                counts['failed'] += 1
+                continue
+            sha1 = result['sha1']
+            run_id = known.get(sha1)
+            live = _live_run(live_spans, result) if result.get('rows') else None
+            if(sha1 in known or 'rows' not in result):
+                counts['duplicate'] += 1
+            elif(live is not None):
+                run_id = live
+                counts['live'] += 1
+            elif(result['rows']):
+                (columns, rows) = (result['columns'], result['rows'])
+                run_id = mg_resultdb.new_run(conn, result['kind'], result['mac'],
+                    path=result['path'], started=rows[0][0])
+                conn.execute("UPDATE runs SET finished = ?, rows = ? WHERE id = ?",
+                    (rows[-1][0], len(rows), run_id))
+                key = tuple(columns)
+                if(key not in inserts):
+                    inserts[key] = mg_resultdb.rows_insert(None, columns)[0]
+                conn.executemany(inserts[key], [(run_id,) + row for row in rows])
+                counts['imported'] += 1
+                counts['rows'] += len(rows)
+                counts['bad lines'] += result['bad']
+                pending += len(rows)
+            else:
+                counts['imported'] += 1
+            known[sha1] = run_id
+            conn.execute("INSERT OR REPLACE INTO imports (path, size, mtime, sha1, run_id, "
+                "imported) VALUES (?, ?, ?, ?, ?, ?)", (result['path'], result['size'],
+                result['mtime'], sha1, run_id, time.time()))
+            if(pending >= COMMIT_ROWS):
+                conn.commit()
+                pending = 0
+        conn.commit()
+    finally:
+        if(pool is not None):
+            pool.terminate()
+            pool.join()
+        conn.close()
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import sweep result text files "
+        "into the result database")
+    parser.add_argument('paths', nargs='+', metavar='FILE_OR_DIR')
+    parser.add_argument('--db', default=None,
+        help="result database (default %s)" % mg_resultdb.RESULT_DB)
+    parser.add_argument('--workers', type=int, default=None,
+        help="parsing processes (default: one per CPU)")
+    args = parser.parse_args()
+    t0 = time.time()
+    counts = import_files(args.paths, args.db, args.workers, log=sys.stderr)
+    print ("%d files imported (%d rows, %d bad lines), %d unchanged, %d duplicate, "
+           "%d recorded live, %d failed in %.1fs" % (counts['imported'], counts['rows'],
+           counts['bad lines'], counts['unchanged'], counts['duplicate'], counts['live'],
+           counts['failed'], time.time() - t0))
@@ -0,0 +1,607 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Transmit-and-measure helpers shared by the Summit TX power scripts
+
+You need two threads, one for the power meter to collect readings, and the
+other for the Summit device to transmit packets. Because the Summit API
+call to transmit packets is a blocking call (doesn't return until finished)
+you need simultaneous threads to do this.
+
+Both threads are long-lived workers (MeasurementWorkers) that take jobs from
+a queue, so a sweep doesn't pay for two new threads per point. Each job gets
+its own Handshake, and the two workers hand off through its events:
+
+    pm_ready    - set by the power meter worker once it is ready to sample
+    dev_running - set by the device worker while transmit_packets is running
+    tx_done     - set by the device worker once the transmission is over
+                  (or was never started), whatever the outcome
+    started     - set along with the first of dev_running and tx_done, so
+                  the power meter worker can wait for either
+
+Every wait is a blocking wait with a timeout, so neither thread spins on the
+GIL and a missing peer can't hang tx_measure forever. Results come back
+through Futures, as RunningStats: each reading is parsed as it arrives and
+only the running statistics are kept.
+
+With a mg_meter.BufferedReadout the power meter worker arms the meter once
+the device is transmitting and reads the whole burst back in one transfer
+after it is done, instead of polling with FETCH?.
+
+The cal scripts use CalReadings instead: one meter thread that samples for
+as long as the radio cal state machine runs, tagging each reading with the
+cal state it was taken in.
+
+Every meter reply goes through a ReadingParser on its way into the
+statistics. A reply that isn't a reading (garbled, the meter's 9.9E37
+overload value, or outside READING_RANGE) is counted and left out rather
+than averaged in.
+"""
+
+import sys
+import math
+import array
+import atexit
+import threading
+import Queue
+import logging
+from pysummit import decoders as dec
+
+# How long the device worker waits for the power meter to become ready
+PM_READY_TIMEOUT = 10.0
+# How long the power meter worker waits for the device to start transmitting
+DEV_START_TIMEOUT = 10.0
+# Serial timeout for each reading
+MEAS_TIMEOUT = 15
+# What the meter returns for a reading it couldn't make (SCPI overload)
+METER_OVERLOAD = 9.9e37
+# Readings (dBm) outside this range are rejected as bad replies
+READING_RANGE = (-100.0, 60.0)
+
+class Handshake(object):
+    """The start/stop events for one transmit-and-measure job"""
+    def __init__(self):
+        self.pm_ready = threading.Event()
+        self.dev_running = threading.Event()
+        self.tx_done = threading.Event()
+        # Set with dev_running or tx_done, whichever comes first: a device
+        # that fails (or finishes) before the meter wakes still ends the wait
+        self.started = threading.Event()
+        # Set by the power meter worker in adaptive mode once the reading
+        # has settled; the device worker stops after the current chunk
+        self.stop = threading.Event()
+
+class AdaptiveStop(object):
+    """Settings for adaptive (stop-early) measurement
+
+    Sampling stops once at least min_samples trimmed readings have been
+    taken and the standard error of their mean is within tolerance_db, or
+    after max_samples readings regardless. The device transmits in chunks
+    of chunk_packets (up to the usual packet_count in total) so it can stop
+    at the next chunk boundary instead of finishing the whole burst.
+    """
+    def __init__(self, tolerance_db=0.02, min_samples=10, max_samples=200,
+                 chunk_packets=500):
+        self.tolerance_db = tolerance_db
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.chunk_packets = chunk_packets
+
+    def settled(self, stats):
+        if(stats.count >= self.max_samples):
+            return True
+        return (stats.trimmed_count() >= self.min_samples and
+                stats.std_error() <= self.tolerance_db)
+
+class Future(object):
+    """The eventual result of a job run by one of the workers"""
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for fn in callbacks:
+            fn(self)
+
+    def add_done_callback(self, fn):
+        """Call fn(future) once the job is done (right away if it already is),
+        on whichever thread finishes it"""
+        with self._lock:
+            if(not self._done.is_set()):
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def exc_info(self):
+        """The (type, value, traceback) the job failed with, or None"""
+        return self._exc_info
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the job and return its result (or re-raise its exception)"""
+        if(not self._done.wait(timeout)):
+            raise RuntimeError("Timed out waiting for a measurement job")
+        if(self._exc_info is not None):
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+class ReadingParser(object):
+    """Converts meter replies to floats, once, and rejects the bad ones
+
+    parse() returns the reading, or None for a reply that isn't a number
+    ('malformed'), is the meter's overload value, NaN or infinite
+    ('overload'), or falls outside low..high ('range'). Rejects are counted
+    by reason in self.rejected; nothing else is kept.
+    """
+    def __init__(self, low=READING_RANGE[0], high=READING_RANGE[1]):
+        self.low = low
+        self.high = high
+        self.rejected = {'malformed': 0, 'overload': 0, 'range': 0}
+
+    def parse(self, reply):
+        try:
+            value = float(reply)
+        except (TypeError, ValueError):
+            self.rejected['malformed'] += 1
+            return None
+        if(not self.low <= value <= self.high):
+            # NaN fails both comparisons and lands here too
+            if(value != value or abs(value) >= METER_OVERLOAD):
+                self.rejected['overload'] += 1
+            else:
+                self.rejected['range'] += 1
+            return None
+        return value
+
+    def total_rejected(self):
+        return sum(self.rejected.values())
+
+class RunningStats(object):
+    """Running statistics over a stream of power readings
+
+    The averaging has always excluded the first and the last reading of a
+    burst, so the newest reading is held back until the next one arrives
+    and only then folded into the trimmed statistics. min/max and count
+    cover every accepted reading; replies the parser rejects are only
+    counted (rejected()). The readings themselves aren't kept unless keep is
+    set (readings()).
+    """
+    def __init__(self, parser=None, keep=False):
+        self.parser = parser if parser is not None else ReadingParser()
+        self.values = array.array('d') if keep else None
+        self.count = 0
+        self.first = None
+        self.min = None
+        self.max = None
+        self._pending = None
+        self._n = 0
+        self._sum = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        # Filled in by Measurement.result()
+        self.packets_sent = None
+
+    def add(self, reading):
+        """Add one reading (a float or the meter's ASCII reply); returns it as
+        a float, or None if it was rejected"""
+        value = self.parser.parse(reading)
+        if(value is None):
+            return None
+        if(self.values is not None):
+            self.values.append(value)
+        self.count += 1
+        if(self.min is None or value < self.min):
+            self.min = value
+        if(self.max is None or value > self.max):
+            self.max = value
+        if(self.count == 1):
+            self.first = value
+            return value
+        if(self._pending is not None):
+            self._push(self._pending)
+        self._pending = value
+        return value
+
+    def rejected(self):
+        """Number of replies rejected as bad readings"""
+        return self.parser.total_rejected()
+
+    def readings(self):
+        """Every accepted reading, as an array('d'); only with keep"""
+        if(self.values is None):
+            raise ValueError("RunningStats made without keep=True")
+        return self.values
+
+    def _push(self, value):
+        # Welford's update for the variance; the mean itself comes from a
+        # plain running sum so it matches sum(data[1:-1])/len(data[1:-1])
+        self._n += 1
+        self._sum += value
+        delta = value - self._mean
+        self._mean += delta / self._n
+        self._m2 += delta * (value - self._mean)
+
+    def trimmed_count(self):
+        """Number of readings in the trimmed mean"""
+        return self._n
+
+    def trimmed_mean(self):
+        """Average of all the readings but the first and the last"""
+        if(self.count > 2):
+            return self._sum/float(self._n)
+        elif(self.count > 1):
+            return self.first
+        else:
+            return 0
+
+    def variance(self):
+        """Sample variance of the trimmed readings"""
+        if(self._n < 2):
+            return 0.0
+        return self._m2 / (self._n - 1)
+
+    def std_error(self):
+        """Standard error of the trimmed mean"""
+        if(self._n < 2):
+            return float('inf')
+        return math.sqrt(self.variance() / self._n)
+
+    def ci95(self):
+        """Half-width of the 95% confidence interval of the trimmed mean"""
+        return 1.96 * self.std_error()
+
+class SummitDeviceThread(threading.Thread):
+    """A long-lived thread for transmitting packets
+
+    For each job, wait for the power meter to be ready, then transmit a fixed
+    number of packets. Set the dev_running event before starting the
+    transmission and clear it after the transmission is complete. tx_done is
+    always set on the way out so the power meter knows to stop sampling.
+    """
+    def __init__(self):
+        super(SummitDeviceThread, self).__init__(name='SummitDeviceThread')
+        self.daemon = True
+        self.jobs = Queue.Queue()
+        self.logger = logging.getLogger('SummitDeviceThread')
+
+    def run(self):
+        while(True):
+            job = self.jobs.get()
+            if(job is None):
+                break
+            (dev, packet_count, chunk_packets, hs, future) = job
+            try:
+                future.set_result(self.transmit(dev, packet_count, chunk_packets, hs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+                sys.exc_clear()
+            # Don't keep this job's device alive while waiting for the next
+            del job, dev, hs, future
+
+    def transmit(self, dev, packet_count, chunk_packets, hs):
+        """Returns the number of packets actually transmitted"""
+        self.logger.info("Transmitting %d packets" % packet_count)
+        sent = 0
+
+        try:
+            if(not hs.pm_ready.wait(PM_READY_TIMEOUT)):
+                self.logger.error("Power meter not ready after %.1fs, not transmitting" %
+                    PM_READY_TIMEOUT)
+                return sent
+
+            if(chunk_packets is None):
+                chunk_packets = packet_count
+            hs.dev_running.set()
+            hs.started.set()
+            while(sent < packet_count and not hs.stop.is_set()):
+                chunk = min(chunk_packets, packet_count - sent)
+                (status, null) = dev.transmit_packets(chunk)
+                if(status != 0x01):
+                    self.logger.error(dec.decode_error_status(status, 'transmit_packets'))
+                    break
+                sent += chunk
+            if(sent < packet_count):
+                self.logger.info("Stopped after %d packets" % sent)
+            return sent
+        finally:
+            hs.dev_running.clear()
+            hs.tx_done.set()
+            hs.started.set()
+
+class PMThread(threading.Thread):
+    """A long-lived power meter thread
+
+    For each job the power meter will take continuous measurements from the
+    moment the device starts transmitting until it stops.
+
+    """
+    def __init__(self):
+        super(PMThread, self).__init__(name='PMThread')
+        self.daemon = True
+        self.jobs = Queue.Queue()
+        self.logger = logging.getLogger('PMThread')
+
+    def run(self):
+        while(True):
+            job = self.jobs.get()
+            if(job is None):
+                break
+            (pm, meas_cmd, adaptive, buffered, hs, future) = job
+            try:
+                if(buffered is not None and adaptive is None and buffered.probe()):
+                    future.set_result(self.sample_buffered(pm, buffered, hs))
+                else:
+                    future.set_result(self.sample(pm, meas_cmd, adaptive, hs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+                sys.exc_clear()
+            finally:
+                end_lease = getattr(pm, 'end_lease', None)
+                if(end_lease is not None):
+                    end_lease()
+            # Don't keep this job's meter (and its lease) alive while waiting
+            # for the next
+            del job, pm, buffered, hs, future, end_lease
+
+    def sample(self, pm, meas_cmd, adaptive, hs):
+        stats = RunningStats()
+        total_runs = 0
+        self.logger.info("Taking power measurement...")
+        hs.pm_ready.set()
+
+        # Block (not spin) until the device is transmitting, or is already
+        # done: a transmission that failed, or started and finished before
+        # we woke up, ends the wait at once.
+        if(not hs.started.wait(DEV_START_TIMEOUT)):
+            self.logger.error("Device did not start transmitting after %.1fs" %
+                DEV_START_TIMEOUT)
+
+        while(hs.dev_running.is_set()):
+            # Using the FETCH? command is faster but may be less accurate;
+            # using MEAS? auto-ranges/averages and prevents disabling those.
+            # M. Greenwood (4/29/2016)
+            meas = pm.cmd(meas_cmd, timeout=MEAS_TIMEOUT)
+            if(stats.add(meas) is None):
+                self.logger.warning("%d: rejected reply %r" % (total_runs, meas))
+            else:
+                self.logger.info("%d: %s" % (total_runs, meas))
+            total_runs += 1
+            if(adaptive is not None and adaptive.settled(stats)):
+                self.logger.info("Settled after %d readings (+/-%.4f dB)" %
+                    (stats.count, stats.ci95()))
+                hs.stop.set()
+                break
+
+        self.report_rejected(stats)
+        pm.cmd("INIT:CONT ON")
+        return stats
+
+    def sample_buffered(self, pm, buffered, hs):
+        stats = RunningStats()
+        self.logger.info("Taking buffered power measurement...")
+        hs.pm_ready.set()
+
+        if(not hs.started.wait(DEV_START_TIMEOUT)):
+            self.logger.error("Device did not start transmitting after %.1fs" %
+                DEV_START_TIMEOUT)
+        elif(hs.dev_running.is_set()):
+            buffered.arm()
+            # Nothing to do until the burst is over
+            hs.tx_done.wait()
+            for meas in buffered.read(timeout=MEAS_TIMEOUT):
+                stats.add(meas)
+            self.logger.info("%d readings" % stats.count)
+
+        self.report_rejected(stats)
+        pm.cmd("INIT:CONT ON")
+        return stats
+
+    def report_rejected(self, stats):
+        rejected = stats.rejected()
+        if(rejected):
+            self.logger.warning("Rejected %d of %d replies (%s)" % (rejected,
+                rejected + stats.count, ", ".join("%s: %d" % item for item in
+                sorted(stats.parser.rejected.items()) if item[1])))
+
+
+class Measurement(object):
+    """A tx_measure in flight
+
+    wait_tx_done() returns as soon as the device has finished transmitting,
+    which frees the device for other register traffic while the power meter
+    is still finishing its last reading. result() waits for both workers.
+    """
+    def __init__(self, tx_future, meas_future):
+        self.tx_future = tx_future
+        self.meas_future = meas_future
+
+    def wait_tx_done(self, timeout=None):
+        self.tx_future.result(timeout)
+
+    def result(self, timeout=None):
+        """RunningStats of the readings, with packets_sent added"""
+        packets_sent = self.tx_future.result(timeout)
+        stats = self.meas_future.result(timeout)
+        stats.packets_sent = packets_sent
+        return stats
+
+
+class MeasurementWorkers(object):
+    """A persistent device worker and power meter worker
+
+    Jobs are queued to both workers and run one at a time in submission
+    order, so the next job can be submitted before the previous one's
+    result has been collected.
+    """
+    def __init__(self):
+        self.sdev_thread = SummitDeviceThread()
+        self.pm_thread = PMThread()
+        self.pm_thread.start()
+        self.sdev_thread.start()
+
+    def submit(self, dev, power_meter, packet_count, meas_cmd="FETCH?", adaptive=None,
+               buffered=None):
+        """Queue a transmit-and-measure job; returns a Measurement
+
+        With adaptive (an AdaptiveStop), the job stops early once the
+        reading has settled. With buffered (a mg_meter.BufferedReadout for
+        power_meter), the readings are read back in bulk when the meter
+        supports it; adaptive takes precedence.
+
+        A power meter shared with other DUTs (mg_shared_meter.VirtualMeter)
+        has begin_lease()/end_lease(): submit blocks until the meter is ours,
+        and the power meter worker gives it back once it is done sampling.
+        """
+        begin_lease = getattr(power_meter, 'begin_lease', None)
+        if(begin_lease is not None):
+            begin_lease()
+        hs = Handshake()
+        tx_future = Future()
+        meas_future = Future()
+        if(adaptive is not None):
+            chunk_packets = adaptive.chunk_packets
+        else:
+            chunk_packets = None
+        self.pm_thread.jobs.put((power_meter, meas_cmd, adaptive, buffered, hs, meas_future))
+        self.sdev_thread.jobs.put((dev, packet_count, chunk_packets, hs, tx_future))
+        return Measurement(tx_future, meas_future)
+
+    def shutdown(self):
+        self.sdev_thread.jobs.put(None)
+        self.pm_thread.jobs.put(None)
+        self.sdev_thread.join()
+        self.pm_thread.join()
+
+
+_workers = None
+_workers_lock = threading.Lock()
+
+def get_workers():
+    """The process-wide MeasurementWorkers, started on first use"""
+    global _workers
+    with _workers_lock:
+        if(_workers is None):
+            _workers = MeasurementWorkers()
+            atexit.register(_workers.shutdown)
+        return _workers
+
+def start_tx_measure(dev, power_meter, packet_count, meas_cmd="FETCH?", workers=None,
+                     adaptive=None, buffered=None):
+    """Start transmitting and sampling; returns a Measurement"""
+    if(workers is None):
+        workers = get_workers()
+    return workers.submit(dev, power_meter, packet_count, meas_cmd, adaptive, buffered)
+
+def tx_measure(dev, power_meter, packet_count, meas_cmd="FETCH?", workers=None,
+               adaptive=None, buffered=None):
+    """Transmit packet_count packets; returns RunningStats of the readings
+    taken meanwhile"""
+    return start_tx_measure(dev, power_meter, packet_count, meas_cmd, workers,
+        adaptive, buffered).result()
+
+class CalReadings(object):
+    """Continuous meter sampling for the radio cal state machine
+
+    The meter thread samples back to back while a cal state is open and
+    tags every reading with that state. The cal thread brackets each
+    invoke_radio_cal_state with open(state) and close(); close() returns the
+    state's readings at once, without waiting on the meter. A reading still
+    in flight when its state closes is dropped, so a reading that straddles
+    two states never lands in either. The exception is a state left with
+    fewer than two whole readings: close() then waits for the one in flight,
+    which still started inside the state. While the device runs the next
+    state, the meter settles on it and the first reading it takes there is
+    a clean one.
+    """
+    def __init__(self, pm, meas_cmd="MEAS?", timeout=MEAS_TIMEOUT):
+        self.pm = pm
+        self.meas_cmd = meas_cmd
+        self.timeout = timeout
+        self.logger = logging.getLogger('CalReadings')
+        self._cond = threading.Condition()
+        self._epoch = 0
+        self._open = False
+        self._readings = []
+        self._in_flight = None      # epoch of the reading being taken
+        self._late = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='CalReadings')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def open(self, state):
+        """Start tagging readings with state"""
+        with self._cond:
+            self.state = state
+            self._epoch += 1
+            self._readings = []
+            self._late = None
+            self._open = True
+            self._cond.notify_all()
+
+    def close(self):
+        """Stop sampling the open state; returns RunningStats of its readings"""
+        with self._cond:
+            self._open = False
+            epoch = self._epoch
+            readings = self._readings
+            if(len(readings) < 2 and self._in_flight == epoch):
+                while(self._in_flight == epoch):
+                    self._cond.wait()
+                if(self._late is not None):
+                    readings.append(self._late)
+        stats = RunningStats()
+        for value in readings:
+            stats.add(value)
+        if(stats.rejected()):
+            self.logger.warning("State %s: rejected %d of %d replies" % (self.state,
+                stats.rejected(), len(readings)))
+        return stats
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._open = False
+            self._cond.notify_all()
+        self._thread.join()
+        self.pm.cmd("INIT:CONT ON")
+
+    def _run(self):
+        while(True):
+            with self._cond:
+                while(self._running and not self._open):
+                    self._cond.wait()
+                if(not self._running):
+                    break
+                epoch = self._in_flight = self._epoch
+            value = None
+            try:
+                # Parsed (and checked) by close()'s RunningStats
+                value = self.pm.cmd(self.meas_cmd, timeout=self.timeout)
+            except IOError as info:
+                self.logger.error(info)
+            finally:
+                with self._cond:
+                    if(value is not None and epoch == self._epoch):
+                        if(self._open):
+                            self._readings.append(value)
+                        else:
+                            self._late = value
+                    self._in_flight = None
+                    self._cond.notify_all()
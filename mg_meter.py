@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""E4418B power meter connection helpers shared by the Summit TX power scripts"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import contextlib
+import rfmeter
+from rfmeter.agilent import E4418B
+
+METER_PORT = '/dev/ttyUSB0'
+
+# What setup_meter() last put on each meter, by port
+METER_STATE_FILE = 'meter_state.json'
+# Cached setup older than this gets the full bring-up again
+METER_STATE_MAX_AGE = 12 * 3600
+# Always do the full bring-up (reset, preset, all settings)
+FORCE_METER_RESET = False
+# host:port of a meter broker (mg_meter_broker) holding the meter ports open;
+# None opens the port directly
+METER_BROKER = os.environ.get('MG_METER_BROKER')
+
+_meter_factory = None
+
+def set_meter_factory(factory):
+    """Route connect_meter() through factory(port) (None restores the default)
+
+    Used to run the scripts against a simulated meter (see mg_sim).
+    """
+    global _meter_factory
+    _meter_factory = factory
+
+def connect_meter(port=METER_PORT):
+    """Instantiate a Power Meter and give it an open COM port
+
+    With METER_BROKER set, the meter is leased from the broker instead, which
+    keeps the port open between runs; close_meter() hands the lease back.
+    Waiting longer than mg_meter_broker.LEASE_TIMEOUT for a lease another
+    session holds raises MeterBrokerError. If the broker can't be reached the
+    port is opened directly.
+    """
+    if(_meter_factory is None and METER_BROKER):
+        import socket
+        import mg_meter_broker
+        try:
+            return mg_meter_broker.BrokerMeter(METER_BROKER, port,
+                timeout=mg_meter_broker.LEASE_TIMEOUT)
+        except socket.error as info:
+            logging.getLogger('connect_meter').warning(
+                "Meter broker %s unreachable (%s), opening %s directly" % (METER_BROKER, info, port))
+    return open_meter(port)
+
+def open_meter(port=METER_PORT):
+    """Open the meter on port directly"""
+    if(_meter_factory is not None):
+        return _meter_factory(port)
+    COM = rfmeter.comport.ComPort(port)
+    COM.connect()
+    return E4418B(COM)
+
+def close_meter(PM):
+    """Close the COM port under a meter from open_meter(), if it can be"""
+    for obj in (PM, getattr(PM, 'com', None), getattr(PM, 'port', None)):
+        for name in ('close', 'disconnect'):
+            fn = getattr(obj, name, None)
+            if(callable(fn)):
+                fn()
+                return True
+    return False
+
+@contextlib.contextmanager
+def meter_session(power_meter=None, port=METER_PORT):
+    """The meter a script's main() measures with
+
+    power_meter (e.g. a shared meter) is used as is. Otherwise the meter on
+    port is connected, and closed again on the way out, which hands a broker
+    lease back so the next session in the process can have it.
+    """
+    if(power_meter is not None):
+        yield power_meter
+        return
+    PM = connect_meter(port)
+    try:
+        yield PM
+    finally:
+        close_meter(PM)
+
+# Sensor types that can't do buffered readout ("A" is an 8480-series sensor)
+UNBUFFERED_SENSORS = ("A",)
+
+class BufferedReadout(object):
+    """Meter-side buffered acquisition: one bulk read per burst
+
+    arm() triggers the meter for up to `readings` readings into its buffer,
+    and read() collects whatever it has taken with a single FETCH?, as a
+    list of reading strings. That is one round trip per burst instead of
+    one per reading. Choose `readings` so they fit inside the burst. The
+    trigger count is only sent when it changes, so make a new
+    BufferedReadout after presetting the meter. With port, a count other
+    than the preset one is noted in setup_meter()'s cache for that port
+    (before it is sent), so the next setup_meter() puts it back.
+
+    probe() checks once whether the meter and sensor take the trigger count
+    command. If either doesn't, or a readback comes back as a single value,
+    `supported` is set False and callers go back to per-FETCH sampling.
+    """
+    def __init__(self, pm, readings=50, port=None, state_file=METER_STATE_FILE):
+        self.pm = pm
+        self.readings = readings
+        self.port = port
+        self.state_file = state_file
+        self.supported = None
+        self._trigger_count = None
+        self.logger = logging.getLogger('BufferedReadout')
+
+    def probe(self):
+        if(self.supported is None):
+            self.supported = self._probe()
+            if(not self.supported):
+                self.logger.warning("Meter has no buffered readout, using FETCH? per reading")
+        return self.supported
+
+    def _probe(self):
+        try:
+            if(self.pm.cmd("SERV:SENS1:TYPE?") in UNBUFFERED_SENSORS):
+                return False
+            self.pm.cmd("TRIG:COUN?", do_error_check=False)
+            error = self.pm.cmd("SYST:ERR?", do_error_check=False)
+        except Exception as info:
+            self.logger.info("Buffered readout probe failed: %s" % info)
+            return False
+        return error.startswith("+0")
+
+    def arm(self):
+        if(self._trigger_count != self.readings):
+            if(self.port is not None):
+                _note_state(self.state_file, self.port, 'trigger_count', self.readings)
+            self.pm.cmd("TRIG:COUN %d" % self.readings)
+            self._trigger_count = self.readings
+        self.pm.cmd("INIT:CONT OFF")
+        self.pm.cmd("INIT")
+
+    def read(self, timeout=None):
+        reply = self.pm.cmd("FETCH?", timeout=timeout)
+        values = [value for value in reply.split(",") if value.strip()]
+        if(len(values) < 2 and self.readings > 1):
+            self.logger.warning("Buffered readout returned %d reading(s), "
+                "falling back to FETCH? per reading" % len(values))
+            self.supported = False
+        return values
+
+
+class MeterConfig(object):
+    """The power meter settings a script measures with
+
+    averaging=N turns auto averaging off and averages N readings, and
+    ac_range selects a fixed range; None leaves either as preset.
+    check_dcyc=False sends CORR:DCYC without an error check whatever the
+    sensor (the E4412A/E4413A never get one).
+    """
+    def __init__(self, duty_factor, offset, freq="5.500GHZ", averaging=None, ac_range=None,
+                 check_dcyc=True):
+        self.duty_factor = duty_factor
+        self.offset = offset
+        self.freq = freq
+        self.averaging = averaging
+        self.ac_range = ac_range
+        self.check_dcyc = check_dcyc
+
+    def commands(self, sensor):
+        """The (command, kwargs) settings for sensor, in the order to send them"""
+        commands = []
+        dcyc = "CORR:DCYC " + str(self.duty_factor * 100) + "PCT"
+        unchecked = {} if self.check_dcyc else {'do_error_check': False}
+        #  "E4412A"=4412, "E4413A"=4413, "A"=HP8481A
+        if(sensor == "A"):
+            commands.append(("CORR:CSET1:SEL 'HP8481A'", {}))
+            commands.append(("CORR:CSET1:STAT ON", {}))
+            commands.append((dcyc, unchecked))
+        elif(sensor == "E4412A" or sensor == "E4413A"):
+            # These sensors flag an error on CORR:DCYC; cleared right after
+            # (setup_meter sends the two together)
+            commands.append((dcyc, {'do_error_check': False}))
+            commands.append(("*CLS", {}))
+        else:
+            commands.append((dcyc, unchecked))
+        commands.append(("CORR:GAIN2 " + str(self.offset), {}))
+        commands.append(("FREQ " + self.freq, {}))
+        if(self.averaging is not None):
+            commands.append(("SENS:AVER:COUN:AUTO OFF", {}))
+            commands.append(("SENS:AVER:COUN %d" % self.averaging, {}))
+        if(self.ac_range is not None):
+            commands.append(("SENS:POW:AC:RANGE %d" % self.ac_range, {}))
+        return commands
+
+    def fingerprint(self, sensor):
+        return hashlib.sha1(json.dumps([sensor, self.commands(sensor)],
+            sort_keys=True)).hexdigest()
+
+_state_lock = threading.Lock()
+
+def _load_state(state_file):
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def _note_state(state_file, port, key, value):
+    """Set key in the cached setup of port, if there is one"""
+    with _state_lock:
+        state = _load_state(state_file)
+        if(port not in state or state[port].get(key) == value):
+            return
+        state[port][key] = value
+        _write_state(state_file, state)
+
+def _save_state(state_file, port, entry):
+    with _state_lock:
+        state = _load_state(state_file)
+        if(entry is None):
+            state.pop(port, None)
+        else:
+            state[port] = entry
+        _write_state(state_file, state)
+
+def _write_state(state_file, state):
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.rename(tmp, state_file)
+
+def _send(PM, command, kwargs):
+    if(command == "*CLS"):
+        PM.clear_errors()
+    else:
+        PM.cmd(command, **kwargs)
+
+def _header(command):
+    return command.split(" ", 1)[0]
+
+def _units(commands):
+    """commands grouped as they must be sent: a *CLS goes with the command
+    before it (the unchecked CORR:DCYC whose error it clears)"""
+    units = []
+    for (command, kwargs) in commands:
+        if(command == "*CLS" and units):
+            units[-1].append((command, kwargs))
+        else:
+            units.append([(command, kwargs)])
+    return units
+
+def _leading_float(reply):
+    match = re.match(r"\s*([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)", reply or "")
+    return float(match.group(1)) if match else None
+
+def setup_meter(PM, config, port=METER_PORT, force_reset=None, state_file=METER_STATE_FILE):
+    """Bring the meter on port to config (a MeterConfig); returns the sensor type
+
+    The settings applied are cached in state_file. When the cache for this
+    port is recent, a single CORR:DCYC? query confirms the meter still holds
+    them, and then only the settings that differ are sent (a CORR:DCYC with
+    the *CLS after it), along with TRIG:COUN 1 if a BufferedReadout left
+    another trigger count. That is nothing at all when a script runs again
+    with the same config. Anything else gets
+    the full bring-up: reset, clear errors, preset, remote, sensor query and
+    every setting. So does force_reset (default FORCE_METER_RESET), and so
+    does a shared meter (mg_shared_meter), which has to see every setting.
+    """
+    logger = logging.getLogger('setup_meter')
+    if(force_reset is None):
+        force_reset = FORCE_METER_RESET
+    if(getattr(PM, 'begin_lease', None) is not None):
+        force_reset = True
+
+    entry = None if force_reset else _load_state(state_file).get(port)
+    if(entry is not None and time.time() - entry.get('time', 0) < METER_STATE_MAX_AGE):
+        sensor = entry['sensor']
+        wanted = config.commands(sensor)
+        current = dict((_header(c), (c, k)) for (c, k) in entry['settings'])
+        # Settings we'd have to undo can only go with a preset
+        undo = set(current) - set(_header(c) for (c, k) in wanted)
+        dcyc = _leading_float(PM.cmd("CORR:DCYC?"))
+        if(dcyc is not None and abs(dcyc - entry['dcyc']) < 1e-6 and not undo):
+            changed = []
+            if(entry.get('trigger_count', 1) != 1):
+                changed.append(("TRIG:COUN 1", {}))
+            if(config.fingerprint(sensor) == entry['fingerprint'] and not changed):
+                logger.info("Meter on %s already configured" % port)
+                return sensor
+            for unit in _units(wanted):
+                if(any(current.get(_header(c)) != (c, k) for (c, k) in unit)):
+                    changed.extend(unit)
+            for (command, kwargs) in changed:
+                _send(PM, command, kwargs)
+            logger.info("Meter on %s: %d setting(s) changed" % (port, len(changed)))
+            _save_state(state_file, port, _state_entry(config, sensor))
+            return sensor
+        logger.info("Meter on %s no longer matches its cached setup" % port)
+
+    # Full bring-up: reset/initialize, clear errors, remote operation
+    _save_state(state_file, port, None)
+    PM.meter_reset()
+    PM.clear_errors()
+    PM.cmd("SYST:PRES")
+    PM.cmd("SYST:REM")
+    sensor = PM.cmd("SERV:SENS1:TYPE?")
+    for (command, kwargs) in config.commands(sensor):
+        _send(PM, command, kwargs)
+    _save_state(state_file, port, _state_entry(config, sensor))
+    return sensor
+
+def _state_entry(config, sensor):
+    return {
+        'time': time.time(),
+        'sensor': sensor,
+        'fingerprint': config.fingerprint(sensor),
+        'dcyc': config.duty_factor * 100,
+        'settings': config.commands(sensor),
+    }
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Meter broker: keeps the power meter ports open across runs and DUTs
+
+Opening the COM port and getting the E4418B talking again costs every script
+run some time. The broker is a long-running process that opens each meter
+port once and lends it out. A test session connects, takes a lease on one
+meter port, and sends its commands through the broker. When the session
+ends, or its process exits, the lease goes back and the port stays open for
+the next session. A session asking for a port someone else holds waits its
+turn, for up to LEASE_TIMEOUT seconds (then MeterBrokerError).
+
+    python mg_meter_broker.py [--listen HOST:PORT] [METER_PORT ...]
+    python mg_meter_broker.py --status [--listen HOST:PORT]
+
+Meter ports on the command line are opened at start-up; any other port is
+opened when it is first leased. The scripts use the broker when METER_BROKER
+in mg_meter (or the MG_METER_BROKER environment variable) is set to its
+HOST:PORT. connect_meter() then returns a BrokerMeter in place of the
+E4418B.
+
+Health checks: a port that has sat idle for HEALTH_CHECK_IDLE seconds is
+asked *IDN? before it is lent out, and idle ports are checked every
+HEALTH_CHECK_IDLE seconds in the background. A port that fails the check is
+closed and opened again. If a command fails with an I/O error and the meter
+then fails the check, the port is reopened and the command sent once more.
+The meter's own settings survive a reconnect, so setup_meter() can still
+skip the bring-up.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import SocketServer
+from mg_meter import open_meter, close_meter
+
+BROKER_ADDRESS = '127.0.0.1:7418'
+# Seconds a port may sit unused before it is checked
+HEALTH_CHECK_IDLE = 60.0
+# Seconds a BrokerMeter waits for a port another session holds
+LEASE_TIMEOUT = 30.0
+
+# Calls a session may make on its meter
+METER_CALLS = ('cmd', 'meter_reset', 'clear_errors')
+
+class MeterBrokerError(RuntimeError):
+    """The broker refused a request (no lease, lease timed out, ...)"""
+
+def parse_address(address):
+    """"host:port" -> (host, port)"""
+    (host, port) = address.rsplit(':', 1)
+    return (host, int(port))
+
+
+class MeterPort(object):
+    """One meter port held open by the broker, leased to one session at a time"""
+    def __init__(self, port):
+        self.port = port
+        self.meter = None
+        self.owner = None
+        self._cond = threading.Condition()
+        self._io = threading.Lock()
+        self.last_used = 0.0
+        self.opens = 0
+        self.leases = 0
+        self.commands = 0
+        self.reconnects = 0
+        self.logger = logging.getLogger('MeterPort')
+
+    def acquire(self, session, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while(self.owner is not None):
+                remaining = deadline - time.time() if deadline is not None else None
+                if(remaining is not None and remaining <= 0):
+                    raise MeterBrokerError("%s is leased to %s" % (self.port, self.owner))
+                self._cond.wait(remaining)
+            self.owner = session
+        try:
+            with self._io:
+                if(self.meter is None):
+                    self._open()
+                elif(time.time() - self.last_used > HEALTH_CHECK_IDLE and not self._healthy()):
+                    self._reconnect()
+        except Exception:
+            self.release()
+            raise
+        self.leases += 1
+
+    def release(self):
+        with self._cond:
+            self.owner = None
+            self._cond.notify()
+
+    def call(self, name, args, kwargs):
+        """Run a meter call for the lease holder, reconnecting once if the
+        link has gone bad"""
+        with self._io:
+            self.commands += 1
+            try:
+                return self._call(name, args, kwargs)
+            except (IOError, OSError):
+                if(self._healthy()):
+                    raise       # the meter answered: the error was the command's
+                self._reconnect()
+                return self._call(name, args, kwargs)
+
+    def _call(self, name, args, kwargs):
+        try:
+            return getattr(self.meter, name)(*args, **kwargs)
+        finally:
+            self.last_used = time.time()
+
+    def check(self):
+        """Background check: reconnect if idle, unleased and not answering"""
+        with self._cond:
+            if(self.owner is not None or self.meter is None):
+                return
+            self.owner = '(health check)'
+        try:
+            with self._io:
+                if(time.time() - self.last_used > HEALTH_CHECK_IDLE and not self._healthy()):
+                    self._reconnect()
+        except Exception as info:
+            self.logger.error("%s: reconnect failed: %s" % (self.port, info))
+        finally:
+            self.release()
+
+    def _healthy(self):
+        try:
+            healthy = bool(self.meter.cmd("*IDN?"))
+        except Exception as info:
+            self.logger.info("%s: health check failed: %s" % (self.port, info))
+            healthy = False
+        self.last_used = time.time()
+        return healthy
+
+    def _open(self):
+        self.meter = open_meter(self.port)
+        self.opens += 1
+        self.last_used = time.time()
+        self.logger.info("%s: opened" % self.port)
+
+    def _reconnect(self):
+        self.logger.warning("%s: stale connection, reopening" % self.port)
+        old = self.meter
+        self.meter = None
+        try:
+            close_meter(old)
+        except Exception as info:
+            self.logger.info("%s: close failed: %s" % (self.port, info))
+        self.reconnects += 1
+        self._open()
+
+    def status(self):
+        return {
+            'open': self.meter is not None,
+            'owner': self.owner,
+            'idle_s': time.time() - self.last_used if self.last_used else None,
+            'opens': self.opens,
+            'leases': self.leases,
+            'commands': self.commands,
+            'reconnects': self.reconnects,
+        }
+
+
+class MeterBroker(object):
+    """The meter ports and their leases"""
+    def __init__(self):
+        self._ports = {}
+        self._lock = threading.Lock()
+
+    def meter_port(self, port):
+        with self._lock:
+            entry = self._ports.get(port)
+            if(entry is None):
+                entry = self._ports[port] = MeterPort(port)
+            return entry
+
+    def open(self, port):
+        """Open port now rather than at its first lease"""
+        entry = self.meter_port(port)
+        entry.acquire('(start-up)')
+        entry.release()
+
+    def lease(self, port, session, timeout=None):
+        entry = self.meter_port(port)
+        entry.acquire(session, timeout)
+        return entry
+
+    def check_idle(self):
+        with self._lock:
+            entries = self._ports.values()
+        for entry in entries:
+            entry.check()
+
+    def status(self):
+        with self._lock:
+            return dict((port, entry.status()) for (port, entry) in self._ports.items())
+
+    def serve(self, address=BROKER_ADDRESS):
+        """Serve sessions on address ("host:port") until interrupted"""
+        server = _Server(parse_address(address), _SessionHandler)
+        server.broker = self
+        checker = threading.Thread(target=self._check_loop, name='MeterBroker-check')
+        checker.daemon = True
+        checker.start()
+        logging.getLogger('MeterBroker').info("Listening on %s" % address)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    def _check_loop(self):
+        while(True):
+            time.sleep(HEALTH_CHECK_IDLE)
+            self.check_idle()
+
+
+class _Server(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _SessionHandler(SocketServer.StreamRequestHandler):
+    """One session: newline-delimited JSON requests and replies
+
+    {"op": "lease", "port": ..., "session": ..., "timeout": ...}
+    {"op": "cmd" | "meter_reset" | "clear_errors", "args": [...], "kwargs": {...}}
+    {"op": "release"}, {"op": "status"}
+
+    Replies are {"ok": true, "result": ...} or {"ok": false, "error": class
+    name, "message": ...}. A lease still held when the connection closes is
+    released.
+    """
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        broker = self.server.broker
+        self.entry = None
+        try:
+            for line in iter(self.rfile.readline, ''):
+                try:
+                    result = self._dispatch(broker, json.loads(line))
+                except Exception as info:
+                    reply = {'ok': False, 'error': type(info).__name__, 'message': str(info)}
+                else:
+                    reply = {'ok': True, 'result': result}
+                self.wfile.write(json.dumps(reply) + '\n')
+                self.wfile.flush()
+        finally:
+            if(self.entry is not None):
+                self.entry.release()
+
+    def _dispatch(self, broker, request):
+        op = request.get('op')
+        if(op == 'lease'):
+            if(self.entry is not None):
+                raise MeterBrokerError("Session already holds %s" % self.entry.port)
+            self.entry = broker.lease(request['port'], request.get('session'),
+                request.get('timeout'))
+            return self.entry.port
+        if(op == 'release'):
+            if(self.entry is not None):
+                self.entry.release()
+                self.entry = None
+            return None
+        if(op == 'status'):
+            return broker.status()
+        if(op in METER_CALLS):
+            if(self.entry is None):
+                raise MeterBrokerError("No meter leased")
+            kwargs = dict((str(k), v) for (k, v) in request.get('kwargs', {}).items())
+            return self.entry.call(op, request.get('args', []), kwargs)
+        raise MeterBrokerError("Unknown request %r" % op)
+
+
+class BrokerMeter(object):
+    """A power meter leased from the broker; stands in for the E4418B
+
+    The lease is held until close() or until the process exits. Waiting
+    longer than timeout for another session's lease raises MeterBrokerError
+    (None waits for good). Meter I/O errors are raised here as IOError, as
+    the E4418B would.
+    """
+    def __init__(self, address, port, session=None, timeout=LEASE_TIMEOUT):
+        self.address = address
+        self.port = port
+        self._lock = threading.Lock()
+        self._sock = socket.create_connection(parse_address(address))
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile('rb+')
+        if(session is None):
+            session = "%s:%d" % (socket.gethostname(), os.getpid())
+        try:
+            self._request({'op': 'lease', 'port': port, 'session': session,
+                'timeout': timeout})
+        except Exception:
+            self._file.close()
+            self._sock.close()
+            raise
+
+    def _request(self, request):
+        with self._lock:
+            self._file.write(json.dumps(request) + '\n')
+            self._file.flush()
+            line = self._file.readline()
+        if(not line):
+            raise IOError("Meter broker %s closed the connection" % self.address)
+        reply = json.loads(line)
+        if(reply['ok']):
+            return reply['result']
+        if(reply['error'] in ('IOError', 'OSError')):
+            raise IOError(reply['message'])
+        raise MeterBrokerError("%s: %s" % (reply['error'], reply['message']))
+
+    def cmd(self, command, timeout=None, do_error_check=True):
+        reply = self._request({'op': 'cmd', 'args': [command],
+            'kwargs': {'timeout': timeout, 'do_error_check': do_error_check}})
+        return str(reply) if isinstance(reply, unicode) else reply
+
+    def meter_reset(self):
+        return self._request({'op': 'meter_reset'})
+
+    def clear_errors(self):
+        return self._request({'op': 'clear_errors'})
+
+    def status(self):
+        return self._request({'op': 'status'})
+
+    def close(self):
+        """Hand the lease back and disconnect"""
+        try:
+            self._request({'op': 'release'})
+        finally:
+            self._file.close()
+            self._sock.close()
+
+def broker_status(address=BROKER_ADDRESS):
+    """The broker's per-port status, without taking a lease"""
+    sock = socket.create_connection(parse_address(address))
+    try:
+        f = sock.makefile('rb+')
+        f.write(json.dumps({'op': 'status'}) + '\n')
+        f.flush()
+        return json.loads(f.readline())['result']
+    finally:
+        sock.close()
+
+if __name__ == '__main__':
+    import argparse
+    import logging.config
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('meter_ports', nargs='*', help="meter ports to open at start-up")
+    parser.add_argument('--listen', default=BROKER_ADDRESS, metavar='HOST:PORT')
+    parser.add_argument('--status', action='store_true',
+        help="print the status of a running broker and exit")
+    args = parser.parse_args()
+
+    if(args.status):
+        for (port, s) in sorted(broker_status(args.listen).items()):
+            print "%-14s %-6s %-24s %6s leases %8s cmds %4s reconnects" % (port,
+                "open" if s['open'] else "closed", s['owner'] or "-", s['leases'],
+                s['commands'], s['reconnects'])
+    else:
+        # Set up logging according to logging.conf
+        logging.config.fileConfig('logging.conf')
+        broker = MeterBroker()
+        for port in args.meter_ports:
+            broker.open(port)
+        broker.serve(args.listen)
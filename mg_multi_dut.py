@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Run a sweep on several Summit modules at once
+
+Pairs the master (TX) and each slave in RX with its own meter port and runs
+the txpo or step-TXGC sweep for every pair in parallel. Each pair gets its
+own thread and its own MeasurementWorkers, so one module's transmit/measure
+never waits on another's. Results go to the usual per-MAC files.
+
+    python mg_multi_dut.py [--sweep txpo|steptxgc] [--no-master] PORT [PORT ...]
+
+The first port goes with the master (unless --no-master), the rest with
+RX[0], RX[1], ... in order. If the modules share one link and their API
+calls can't be interleaved, use --serialize-devices: every device API call,
+transmit_packets included, is then made under one lock, so no two modules'
+calls are ever on the link at once. The modules' bursts then take turns too;
+only the meter readings (and the host-side work between calls) still run in
+parallel.
+
+On a station with one meter behind an RF switch, the ports are switch ports
+instead and the modules take turns on the meter (see mg_shared_meter):
+
+    python mg_multi_dut.py --shared-meter /dev/ttyUSB0 --switch mydrivers.Switch
+        [--switch-arg ARG ...] SWITCH_PORT [SWITCH_PORT ...]
+
+With --coroutines the modules share one mg_async.AsyncWorkers instead: every
+module's bursts and meter readings are driven as coroutines from one loop
+thread, on a pool of two threads per module, rather than by a device thread
+and a meter thread of its own.
+"""
+
+import sys
+import time
+import inspect
+import logging
+import threading
+from mg_measure import MeasurementWorkers
+from mg_async import AsyncWorkers
+from mg_shared_meter import SharedMeter, load_switch
+import mg_txpo_test
+import mg_txpo_test_slave
+import mg_step_txgc_test
+import mg_step_txgc_test_slave
+
+# sweep name -> (master module, slave module)
+SWEEPS = {
+    'txpo': (mg_txpo_test, mg_txpo_test_slave),
+    'steptxgc': (mg_step_txgc_test, mg_step_txgc_test_slave),
+}
+
+def call_main(module, TX, RX, **kwargs):
+    """Call module.main(TX, RX, ...) passing None for the other required
+    positional arguments (iterations, test_profile, ...)"""
+    spec = inspect.getargspec(module.main)
+    n_required = len(spec.args) - len(spec.defaults or ())
+    args = (TX, RX) + (None,) * max(0, n_required - 2)
+    return module.main(*args, **kwargs)
+
+class LockedDevice(object):
+    """Serializes the API calls of devices that share one link
+
+    Every callable attribute is called with the lock held, transmit_packets
+    included: a blocking transmit is still a call on the link.
+    """
+    def __init__(self, dev, lock):
+        self.__dict__['_dev'] = dev
+        self.__dict__['_lock'] = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self._dev, name)
+        if(not callable(attr)):
+            return attr
+        lock = self._lock
+
+        def locked(*args, **kwargs):
+            with lock:
+                return attr(*args, **kwargs)
+        return locked
+
+    def __setattr__(self, name, value):
+        setattr(self._dev, name, value)
+
+    def __getitem__(self, key):
+        return self._dev[key]
+
+class DUTSession(threading.Thread):
+    """One module's sweep, run on its own thread
+
+    It measures on its own MeasurementWorkers unless it is given workers
+    shared with the other sessions (an AsyncWorkers).
+    """
+    def __init__(self, name, label, module, TX, RX, workers=None, **kwargs):
+        super(DUTSession, self).__init__(name=name)
+        self.label = label
+        self.module = module
+        self.TX = TX
+        self.RX = RX
+        self.workers = workers
+        self.kwargs = kwargs
+        self.exc_info = None
+        self.elapsed = None
+
+    def run(self):
+        workers = self.workers
+        if(workers is None):
+            workers = MeasurementWorkers()
+        t0 = time.time()
+        try:
+            call_main(self.module, self.TX, self.RX, workers=workers, **self.kwargs)
+        except Exception:
+            self.exc_info = sys.exc_info()
+            logging.getLogger('DUTSession').exception("%s failed" % self.name)
+        finally:
+            self.elapsed = time.time() - t0
+            if(self.workers is None):
+                workers.shutdown()
+
+def pair_sessions(TX, RX, meter_ports, sweep='txpo', include_master=True,
+                  serialize_devices=False, shared=None, workers=None):
+    """One DUTSession per (device, meter port) pair
+
+    With shared (a SharedMeter) the ports are its switch ports. With workers
+    (an AsyncWorkers) every session measures on them.
+    """
+    (master_module, slave_module) = SWEEPS[sweep]
+
+    def meter_kwargs(port):
+        if(shared is not None):
+            return {'power_meter': shared.virtual_meter(port)}
+        return {'meter_port': port}
+
+    ports = list(meter_ports)
+    lock = threading.RLock()
+    if(serialize_devices):
+        TX = LockedDevice(TX, lock)
+        RX = [LockedDevice(dev, lock) for dev in RX]
+    sessions = []
+    if(include_master):
+        if(not ports):
+            raise ValueError("No meter port left for the master")
+        port = ports.pop(0)
+        sessions.append(DUTSession('master', port, master_module, TX, RX,
+            workers, **meter_kwargs(port)))
+    if(len(ports) > len(RX)):
+        raise ValueError("%d meter ports for %d slaves" % (len(ports), len(RX)))
+    for (dut, port) in enumerate(ports):
+        sessions.append(DUTSession('slave%d' % dut, port, slave_module, TX, RX,
+            workers, dut=dut, **meter_kwargs(port)))
+    return sessions
+
+def run_all(TX, RX, meter_ports, sweep='txpo', include_master=True,
+            serialize_devices=False, shared=None, coroutines=False):
+    """Run the sweep on every paired module at once; returns the sessions
+    (check .exc_info for failures)
+
+    With coroutines every session measures on one AsyncWorkers.
+    """
+    workers = None
+    if(coroutines):
+        workers = AsyncWorkers(max_workers=2 * len(meter_ports))
+    try:
+        sessions = pair_sessions(TX, RX, meter_ports, sweep, include_master,
+            serialize_devices, shared, workers)
+        for session in sessions:
+            session.start()
+        for session in sessions:
+            session.join()
+    finally:
+        if(workers is not None):
+            workers.shutdown()
+    return sessions
+
+def report(sessions, elapsed):
+    for session in sessions:
+        print "%-8s %-14s %7.1fs  %s" % (session.name, session.label,
+            session.elapsed, "FAILED: %s" % session.exc_info[1] if session.exc_info else "ok")
+    print "%d modules in %.1fs" % (len(sessions), elapsed)
+
+if __name__ == '__main__':
+    import argparse
+    import logging.config
+    from pysummit.devices import TxAPI
+    from pysummit.devices import RxAPI
+    from pysummit.bsp.pi_bsp import PiBSP
+    from mg_meter import connect_meter
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('meter_ports', nargs='+',
+        help="meter serial ports (or switch ports with --shared-meter), master first")
+    parser.add_argument('--sweep', choices=sorted(SWEEPS.keys()), default='txpo')
+    parser.add_argument('--no-master', dest='include_master', action='store_false',
+        help="only sweep the slaves")
+    parser.add_argument('--serialize-devices', action='store_true',
+        help="take turns on the device link for every API call, transmits included")
+    parser.add_argument('--shared-meter', metavar='PORT',
+        help="serial port of the one meter shared through an RF switch")
+    parser.add_argument('--switch', metavar='MODULE.CLASS',
+        help="RF switch driver (an mg_shared_meter.RFSwitch)")
+    parser.add_argument('--switch-arg', action='append', default=[],
+        help="argument for the switch driver (repeatable)")
+    parser.add_argument('--coroutines', action='store_true',
+        help="drive every module's measurements from one thread (mg_async)")
+    args = parser.parse_args()
+    if(args.shared_meter and not args.switch):
+        parser.error("--shared-meter needs --switch")
+
+    # Set up logging according to logging.conf
+    logging.config.fileConfig('logging.conf')
+
+    # Set up devices
+    pi_bsp = PiBSP()
+    Tx = TxAPI(bsp=pi_bsp) # Instantiate a master
+    Rx = RxAPI() # Instantiate a collection of slaves
+
+    shared = None
+    if(args.shared_meter):
+        shared = SharedMeter(connect_meter(args.shared_meter),
+            load_switch(args.switch, *args.switch_arg))
+
+    t0 = time.time()
+    sessions = run_all(Tx, Rx, args.meter_ports, args.sweep, args.include_master,
+        args.serialize_devices, shared, args.coroutines)
+    report(sessions, time.time() - t0)
+    if(shared is not None):
+        print shared
+    if(any(session.exc_info for session in sessions)):
+        sys.exit(1)
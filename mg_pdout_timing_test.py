@@ -11,6 +11,10 @@ from pysummit.devices import TxAPI
 from pysummit.devices import RxAPI
 import rfmeter
 from rfmeter.agilent import E4418B
+from mg_regs import wr_batch, GC_ADDRS
+from mg_results import ResultWriter, results_path
+from mg_resultdb import open_run
+from mg_writer import QueuedResultWriter, print_line, queue_log_handlers
 import logging
 
 def main(TX, RX=None, tp=None, pc=None, args=[]):
@@ -35,28 +39,21 @@ def main(TX, RX=None, tp=None, pc=None, args=[]):
         print TX.decode_error_status(status)
     print "  DataRate regr 401004: 0x%X" % DataRate
 
-    gc_addrs = [0x4089A0,
-                0x4089A4,
-                0x4089A8,
-                0x4089AC,
-                0x4089B0,
-                0x4089B4,
-                0x4089B8,
-                0x4089BC]
+    gc_addrs = GC_ADDRS
 
     filename = 'get_pdout_parms_%s.csv' % (TX['mac'].replace(':','-'))
 
     # Disable power compensation
     (status, null) = TX.set_power_comp_enable(0)
 
-    with open(filename, 'w') as f:
-        out_str = "datetime, MAC, channel, pdout, delay, nsamples"
-        print out_str
-        f.write("%s\n" % out_str)
+    headings = "datetime, MAC, channel, pdout, delay, nsamples"
+    run = open_run('pdout_timing', TX['mac'], path=filename)
+    with QueuedResultWriter(ResultWriter(results_path(filename), headings.split(", "),
+                                         script='pdout_timing', csv_path=filename, run=run)) as results:
+        print_line(headings)
 
         txgcval = 0x2D
-        for regaddr in gc_addrs:
-            TX.wr(regaddr, txgcval)
+        wr_batch(TX, [(regaddr, txgcval) for regaddr in gc_addrs])
 
         delay = 4000 
         for nsamples in [4,8,16,32,64]:
@@ -68,11 +65,8 @@ def main(TX, RX=None, tp=None, pc=None, args=[]):
                     (status, pdout) = TX.get_pdout(delay, nsamples)
 
                     time_now = strftime("%m/%d/%Y %H:%M:%S",localtime())
-                    out_str = "%s, %s, %d, %d, %d, %d" % \
-                        (time_now, TX['mac'], ch, pdout, delay, nsamples)
-                    print out_str
-                    f.write("%s\n" % out_str)
-                    f.flush()
+                    outputs = (time_now, TX['mac'], ch, pdout, delay, nsamples)
+                    results.add(outputs, echo="%s, %s, %d, %d, %d, %d" % outputs)
 
     # Reenable power compensation
     (status, null) = TX.set_power_comp_enable(1)
@@ -89,6 +83,8 @@ if __name__ == '__main__':
     formatter = logging.Formatter("%(name)-8s: %(levelname)-8s %(message)s")
     console.setFormatter(formatter)
     logging.getLogger('').addHandler(console)
+    # Log from the background writer thread, not the measurement threads
+    queue_log_handlers()
 
     Tx = TxAPI() # Instantiate a master
 
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Batched register access for Summit devices (TxAPI/RxAPI)
+
+rd_batch() and wr_batch() take a list of addresses (or address/value pairs)
+and return the (status, value) of every access in the same order, so the
+scripts don't have to hand-roll a loop of TX.rd/TX.wr calls.
+
+The TxAPI/RxAPI have no block transfer, so on the hardware a batch still
+costs one rd/wr round trip per register; batching there only saves the
+scripts' repeat reads (mg_txpo_test takes txgc from the gain table read it
+already makes). Runs of contiguous 32-bit registers are coalesced into one
+round trip only for a device object that provides
+
+    dev.rd_block(addr, count)  -> (status, [value, ...])
+    dev.wr_block(addr, values) -> (status, None)
+
+which today is just the simulator (mg_sim, block_ops=True), standing in
+for a firmware burst command that doesn't exist yet. A CachedDevice has
+them when the device it wraps does.
+
+CachedDevice is an optional wrapper that keeps a shadow copy of registers
+the host wrote itself (and, per register class, ones it read back), so
+repeat reads don't go over the serial link. Each device call drops the
+register classes it can change (CALL_INVALIDATES); transmitting and the
+temperature and pdout reads drop none. A read that checks what a write did
+must see the device, not the shadow: pass fresh=True (to rd_batch, or to
+CachedDevice.rd).
+"""
+
+import threading
+
+# TXGC gain table: eight consecutive 32-bit registers
+GC_ADDRS = [0x4089A0,
+            0x4089A4,
+            0x4089A8,
+            0x4089AC,
+            0x4089B0,
+            0x4089B4,
+            0x4089B8,
+            0x4089BC]
+
+REG_STRIDE = 4
+
+def contiguous_runs(addrs):
+    """Split addrs (kept in order) into runs of consecutive registers
+
+    Returns a list of (start_addr, count).
+    """
+    runs = []
+    for addr in addrs:
+        if(runs and addr == runs[-1][0] + runs[-1][1] * REG_STRIDE):
+            runs[-1][1] += 1
+        else:
+            runs.append([addr, 1])
+    return [(start, count) for (start, count) in runs]
+
+def rd_batch(dev, addrs, fresh=False):
+    """Read every register in addrs; returns a list of (status, value)
+
+    With fresh, a CachedDevice reads them from the device rather than its
+    shadow (for read-back checks); other devices always do."""
+    kwargs = {'fresh': True} if(fresh and isinstance(dev, CachedDevice)) else {}
+    results = []
+    if(hasattr(dev, 'rd_block')):
+        # A CachedDevice has rd_block only if the device under it does
+        for (start, count) in contiguous_runs(addrs):
+            if(count == 1):
+                results.append(dev.rd(start, **kwargs))
+                continue
+            (status, values) = dev.rd_block(start, count, **kwargs)
+            if(status != 0x01 or values is None):
+                values = [None] * count
+            results.extend([(status, val) for val in values])
+    else:
+        for addr in addrs:
+            results.append(dev.rd(addr, **kwargs))
+    return results
+
+def wr_batch(dev, pairs):
+    """Write every (addr, value) in pairs; returns a list of (status, None)"""
+    pairs = list(pairs)
+    results = []
+    if(hasattr(dev, 'wr_block')):
+        i = 0
+        for (start, count) in contiguous_runs([addr for (addr, val) in pairs]):
+            if(count == 1):
+                results.append(dev.wr(start, pairs[i][1]))
+            else:
+                values = [val for (addr, val) in pairs[i:i + count]]
+                (status, null) = dev.wr_block(start, values)
+                results.extend([(status, None)] * count)
+            i += count
+    else:
+        for (addr, val) in pairs:
+            results.append(dev.wr(addr, val))
+    return results
+
+def first_error(results):
+    """The first status in results that isn't 0x01, or None if all are OK"""
+    for (status, val) in results:
+        if(status != 0x01):
+            return status
+    return None
+
+
+# Register shadow cache ------------------------------------------------------
+
+# Cache policies
+VOLATILE = 'volatile'   # always read from the device
+SHADOW = 'shadow'       # remember what the host wrote; serve reads from it
+CACHED = 'cached'       # like SHADOW, and remember what was read back too
+
+IRQ_EN_REG = 0x406004
+BASEBAND_CCA_CTL_REG = 0x408840
+TXVECTOR_RATE_REG = 0x401004
+TXVECTOR_POWER_REG = 0x40100C
+RF_PWR_CNTL_REG = 0x401018
+
+# Register classes: name -> (addresses, policy). Anything not listed here is
+# VOLATILE.
+DEFAULT_REG_CLASSES = {
+    'config': ([IRQ_EN_REG, BASEBAND_CCA_CTL_REG, TXVECTOR_RATE_REG, RF_PWR_CNTL_REG], SHADOW),
+    'txgc': (GC_ADDRS, CACHED),
+    'txvector_power': ([TXVECTOR_POWER_REG], VOLATILE),
+}
+
+# Device calls -> the register classes they can change. A call not listed
+# here may change anything, so it drops the whole shadow.
+CALL_INVALIDATES = {
+    'temperature': [],
+    'get_pdout': [],
+    'decode_error_status': [],
+    # Power compensation moves the gain index (TXVECTOR_POWER, never
+    # cached), not the gain table
+    'transmit_packets': [],
+    # Loads the channel's gain table
+    'set_radio_channel': ['txgc'],
+    'invoke_radio_cal_state': ['config', 'txgc'],
+}
+
+class CachedDevice(object):
+    """Wraps a Summit device with a write-through register shadow
+
+    rd/wr (and rd_block/wr_block, if the device has them) go through the
+    cache according to each register's class policy (rd/rd_block with
+    fresh=True always go to the device); every other attribute is passed
+    through to the wrapped device. Calling a device method invalidates the
+    register classes call_invalidates lists for it; a method it doesn't list
+    invalidates everything, to be safe.
+    """
+    def __init__(self, dev, reg_classes=None, call_invalidates=None):
+        self.dev = dev
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._shadow = {}
+        self._policy = {}
+        self._class_addrs = {}
+        if(reg_classes is None):
+            reg_classes = DEFAULT_REG_CLASSES
+        if(call_invalidates is None):
+            call_invalidates = CALL_INVALIDATES
+        self._invalidates = call_invalidates
+        for (name, (addrs, policy)) in reg_classes.items():
+            self._class_addrs[name] = list(addrs)
+            for addr in addrs:
+                self._policy[addr] = policy
+        if(hasattr(dev, 'rd_block')):
+            self.rd_block = self._rd_block
+        if(hasattr(dev, 'wr_block')):
+            self.wr_block = self._wr_block
+
+    def __getitem__(self, key):
+        return self.dev[key]
+
+    def __getattr__(self, name):
+        attr = getattr(self.dev, name)
+        if(not callable(attr) or self._invalidates.get(name) == []):
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                if(name in self._invalidates):
+                    for reg_class in self._invalidates[name]:
+                        self.invalidate_class(reg_class)
+                else:
+                    self.invalidate()
+        return call
+
+    def invalidate(self, addrs=None):
+        """Forget the shadow copy of addrs (default: every register)"""
+        with self._lock:
+            if(addrs is None):
+                self._shadow.clear()
+            else:
+                for addr in addrs:
+                    self._shadow.pop(addr, None)
+
+    def invalidate_class(self, name):
+        self.invalidate(self._class_addrs[name])
+
+    def _lookup(self, addr):
+        with self._lock:
+            if(addr in self._shadow):
+                self.hits += 1
+                return self._shadow[addr]
+            self.misses += 1
+            return None
+
+    def _store(self, addr, value, written):
+        policy = self._policy.get(addr, VOLATILE)
+        if(policy == CACHED or (written and policy == SHADOW)):
+            with self._lock:
+                self._shadow[addr] = value
+
+    def rd(self, addr, fresh=False):
+        if(self._policy.get(addr, VOLATILE) != VOLATILE and not fresh):
+            value = self._lookup(addr)
+            if(value is not None):
+                return (0x01, value)
+        else:
+            with self._lock:
+                self.misses += 1
+        (status, value) = self.dev.rd(addr)
+        if(status == 0x01):
+            # A fresh read replaces a SHADOW copy too: the device is right
+            self._store(addr, value, fresh)
+        return (status, value)
+
+    def wr(self, addr, value):
+        (status, null) = self.dev.wr(addr, value)
+        if(status == 0x01):
+            self._store(addr, value, True)
+        else:
+            self.invalidate([addr])
+        return (status, null)
+
+    def _rd_block(self, addr, count, fresh=False):
+        addrs = [addr + REG_STRIDE * i for i in range(count)]
+        with self._lock:
+            values = [self._shadow.get(a) for a in addrs]
+            if(None not in values and not fresh):
+                self.hits += count
+                return (0x01, values)
+            self.misses += count
+        (status, values) = self.dev.rd_block(addr, count)
+        if(status == 0x01):
+            for (a, val) in zip(addrs, values):
+                self._store(a, val, fresh)
+        return (status, values)
+
+    def _wr_block(self, addr, values):
+        addrs = [addr + REG_STRIDE * i for i in range(len(values))]
+        (status, null) = self.dev.wr_block(addr, values)
+        if(status == 0x01):
+            for (a, val) in zip(addrs, values):
+                self._store(a, val, True)
+        else:
+            self.invalidate(addrs)
+        return (status, null)
+
+    def stats(self):
+        """A one-line summary of the cache hit rate"""
+        total = self.hits + self.misses
+        return "register cache: %d hits, %d misses (%.0f%% of reads served from cache)" % \
+            (self.hits, self.misses, 100.0 * self.hits / total if total else 0.0)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Result database: every sweep's rows, across MACs, channels and runs
+
+The per-MAC result files are replaced by each rerun; the database keeps
+every run. It is one SQLite file (RESULT_DB) with two tables:
+
+    runs     - one row per sweep: script, MAC, moduleID, firmware (raw, and
+               as major/minor), started/finished time, result file and the
+               rows committed. finished is NULL for a sweep that never
+               closed (crashed or was stopped).
+    results  - the rows, keyed by run_id, with the mg_results.SCHEMA
+               columns (datetime in epoch seconds; MAC is the run's)
+
+and a view, readings, joining the two, so that
+
+    SELECT mac, temp, txpo FROM readings
+     WHERE script = 'txpo' AND channel = 24 AND firmware_major >= 198
+       AND temp > 60
+
+uses the indexes (runs by MAC, moduleID, firmware, started and script;
+results by channel and temp, and by run) and comes back in milliseconds
+over millions of rows.
+
+A script passes open_run() to its ResultWriter, which adds each batch of
+rows to the run as it commits them and finishes the run on close():
+
+    run = open_run('txpo', TX['mac'], modID, fwver, path=filename)
+    results = ResultWriter(results_path(filename), columns, script='txpo',
+                           csv_path=filename, run=run)
+
+The result files stay the durable copy: the database is written with
+synchronous=NORMAL in WAL mode, so readers never block a sweep.
+
+    python mg_resultdb.py runs [MAC]
+    python mg_resultdb.py query "SELECT ..."
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+from mg_results import SCHEMA
+
+# The database every sweep writes to (None: don't record runs)
+RESULT_DB = os.environ.get('MG_RESULT_DB', 'results.db')
+# How long a writer waits for another one's transaction
+BUSY_TIMEOUT = 30.0
+
+# The results columns: the result schema less MAC, which is the run's
+COLUMNS = [name for (name, code, fmt) in SCHEMA if name != 'MAC']
+_TYPES = dict((name, 'REAL' if code == 'd' else 'INTEGER') for (name, code, fmt) in SCHEMA)
+
+_TABLES = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    script TEXT,
+    mac TEXT,
+    module_id INTEGER,
+    firmware INTEGER,
+    firmware_major INTEGER,
+    firmware_minor INTEGER,
+    started REAL,
+    finished REAL,
+    path TEXT,
+    rows INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    %s
+);
+CREATE INDEX IF NOT EXISTS runs_mac ON runs(mac, started);
+CREATE INDEX IF NOT EXISTS runs_module_id ON runs(module_id);
+CREATE INDEX IF NOT EXISTS runs_firmware ON runs(firmware_major, firmware_minor);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started);
+CREATE INDEX IF NOT EXISTS runs_script ON runs(script, started);
+CREATE INDEX IF NOT EXISTS results_run ON results(run_id);
+CREATE INDEX IF NOT EXISTS results_channel ON results(channel, temp);
+CREATE VIEW IF NOT EXISTS readings AS
+    SELECT runs.script, runs.mac, runs.module_id, runs.firmware, runs.firmware_major,
+           runs.firmware_minor, runs.started, results.*
+      FROM results JOIN runs ON runs.id = results.run_id;
+""" % ",\n    ".join("%s %s" % (name, _TYPES[name]) for name in COLUMNS)
+
+def connect(path=None):
+    """Open (creating if need be) a result database"""
+    conn = sqlite3.connect(path or RESULT_DB, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if(conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'readings'").fetchone() is None):
+        # Several sweeps may start on a new database at once: take the write
+        # lock before looking at the schema, not after
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in _TABLES.split(';'):
+            conn.execute(statement)
+        conn.execute("COMMIT")
+        conn.isolation_level = ''
+    return conn
+
+
+def new_run(conn, script, mac=None, module_id=None, firmware=None, path=None, started=None):
+    """Add a run (in the caller's transaction) and return its id. firmware
+    is the raw firmwareVersion from the module descriptor (major << 5 |
+    minor)."""
+    if(firmware is None):
+        (major, minor) = (None, None)
+    else:
+        (major, minor) = (firmware >> 5, firmware & 0x1F)
+    return conn.execute("INSERT INTO runs (script, mac, module_id, firmware, firmware_major, "
+        "firmware_minor, started, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (script, mac, module_id, firmware, major, minor,
+         time.time() if started is None else started, path)).lastrowid
+
+def rows_insert(run_id, columns):
+    """(INSERT statement, indexes of the values it takes, index of MAC or
+    None) for a run's rows of these columns. With run_id None, the statement
+    takes the run id as its first value."""
+    for name in columns:
+        if(name != 'MAC' and name not in _TYPES):
+            raise ValueError("Column %r is not in the result schema" % name)
+    keep = [i for (i, name) in enumerate(columns) if name != 'MAC']
+    mac = columns.index('MAC') if 'MAC' in columns else None
+    sql = "INSERT INTO results (run_id, %s) VALUES (%s%s)" % (
+        ", ".join(columns[i] for i in keep), '?' if run_id is None else int(run_id),
+        ", ?" * len(keep))
+    return (sql, keep, mac)
+
+
+class Run(object):
+    """One sweep's rows going into the database
+
+    add() and finish() may be called from another thread than the one that
+    opened the run (the writer thread).
+    """
+    def __init__(self, conn, script, mac=None, module_id=None, firmware=None, path=None,
+                 started=None):
+        self.conn = conn
+        self.mac = mac
+        self.rows = 0
+        self._inserts = {}
+        self._lock = threading.Lock()
+        with conn:
+            self.id = new_run(conn, script, mac, module_id, firmware, path, started)
+
+    def add(self, columns, rows):
+        """Add rows (sequences of the columns' values, datetime in epoch
+        seconds) in one transaction"""
+        key = tuple(columns)
+        if(key not in self._inserts):
+            self._inserts[key] = rows_insert(self.id, columns)
+        (sql, keep, mac) = self._inserts[key]
+        with self._lock:
+            with self.conn:
+                if(self.mac is None and mac is not None and rows):
+                    self.mac = rows[0][mac]
+                    self.conn.execute("UPDATE runs SET mac = ? WHERE id = ?", (self.mac, self.id))
+                self.conn.executemany(sql, [[row[i] for i in keep] for row in rows])
+                self.rows += len(rows)
+                self.conn.execute("UPDATE runs SET rows = ? WHERE id = ?", (self.rows, self.id))
+
+    def finish(self):
+        """Mark the run finished and close its connection"""
+        with self._lock:
+            if(self.conn is None):
+                return
+            with self.conn:
+                self.conn.execute("UPDATE runs SET finished = ? WHERE id = ?",
+                    (time.time(), self.id))
+            self.conn.close()
+            self.conn = None
+
+def open_run(script, mac=None, module_id=None, firmware=None, path=None, db=None):
+    """A Run in the result database (None with RESULT_DB unset)"""
+    db = db or RESULT_DB
+    if(not db):
+        return None
+    return Run(connect(db), script, mac, module_id, firmware, path)
+
+def query(sql, params=(), db=None):
+    """The rows of a query on the result database"""
+    conn = connect(db)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+def _print_rows(cursor):
+    print ", ".join(d[0] for d in cursor.description)
+    for row in cursor:
+        print ", ".join('' if v is None else str(v) for v in row)
+
+if __name__ == '__main__':
+    if(len(sys.argv) < 2 or sys.argv[1] not in ('runs', 'query') or
+       (sys.argv[1] == 'query' and len(sys.argv) < 3)):
+        print 'usage: python mg_resultdb.py runs [MAC] | query "SELECT ..."'
+        sys.exit(2)
+    conn = connect()
+    if(sys.argv[1] == 'runs'):
+        sql = ("SELECT id, script, mac, "
+               "CASE WHEN module_id IS NOT NULL THEN printf('0x%X', module_id) END AS module_id, "
+               "firmware_major || '.' || firmware_minor AS firmware, "
+               "datetime(started, 'unixepoch', 'localtime') AS started, "
+               "finished IS NOT NULL AS finished, rows, path FROM runs")
+        if(len(sys.argv) > 2):
+            _print_rows(conn.execute(sql + " WHERE mac = ? ORDER BY started", (sys.argv[2],)))
+        else:
+            _print_rows(conn.execute(sql + " ORDER BY started"))
+    else:
+        _print_rows(conn.execute(sys.argv[2]))
+    conn.close()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Binary result files for the Summit TX power scripts
+
+Every script's rows fit one schema (SCHEMA): datetime, MAC, channel, temp,
+txgc, txpo, pdout, gc_index, gc0..gc7, delay, nsamples and the adaptive
+measurement columns. A result file stores each row as one fixed-size
+little-endian record: a bitmask of the columns present, then each of the
+file's columns at its schema width. datetime is kept as epoch seconds and
+MAC as an index into the file's MAC table, so a row takes 38-64 bytes
+against 60-110 as text. That is a packed, typed record layout that numpy
+can map directly (ResultFile.to_numpy()). The writer itself only needs the
+struct module, so the scripts don't depend on numpy. A JSON header names
+the script, the columns it wrote, in order, and the MACs seen.
+
+    results = ResultWriter('txpo_00-11-22-33-44-55.mgr', columns, script='txpo',
+                           csv_path='txpo_00-11-22-33-44-55.txt')
+    results.add((time_now, mac, ch, temp, txgc, avg))
+    ...
+    results.close()
+
+Rows are written in batches. A batch is committed by writing its records,
+fsyncing them, then updating the committed row count in the header and
+fsyncing again. A crash loses at most the rows not yet committed, never a
+committed one, and a half-written record is never read back: readers stop
+at the committed count. The commit happens every batch_rows rows or every
+commit_interval seconds, whichever comes first, and on close().
+
+With csv_path, each committed batch is also appended to the CSV text the
+scripts used to write (same headings and number formats), for the tools
+that read those, so a crash leaves the CSV with the committed rows as well.
+Any result file can be exported later:
+
+    python mg_results.py export FILE.mgr [OUT.csv]
+    python mg_results.py info FILE.mgr
+
+With run (an mg_resultdb.open_run()), each committed batch also goes into
+the result database, which keeps every run rather than the latest.
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+
+MAGIC = 'MGRS'
+VERSION = 1
+# magic, version, committed rows, record size
+_PREAMBLE = struct.Struct('<4sHQI')
+_COUNT_OFFSET = 6
+# Room for the JSON header, which is rewritten as new MACs turn up
+HEADER_SPACE = 4096
+
+# CSV datetime format, as the scripts print it
+DATETIME_FORMAT = "%m/%d/%Y %H:%M:%S"
+
+# (column, struct code, CSV format). datetime is in whole seconds since the
+# epoch, as the CSV has it; MAC is an index into the file's MAC table.
+SCHEMA = [
+    ('datetime', 'I', None),
+    ('MAC', 'H', '%s'),
+    ('channel', 'h', '%d'),
+    ('temp', 'h', '%d'),
+    ('txgc', 'i', '%d'),
+    ('txpo', 'd', '%r'),
+    ('pdout', 'i', '%d'),
+    ('gc_index', 'h', '%d'),
+    ('gc0', 'I', '%d'),
+    ('gc1', 'I', '%d'),
+    ('gc2', 'I', '%d'),
+    ('gc3', 'I', '%d'),
+    ('gc4', 'I', '%d'),
+    ('gc5', 'I', '%d'),
+    ('gc6', 'I', '%d'),
+    ('gc7', 'I', '%d'),
+    ('delay', 'i', '%d'),
+    ('nsamples', 'i', '%d'),
+    ('nreadings', 'i', '%d'),
+    ('ci95', 'd', '%.4f'),
+    ('packets', 'i', '%d'),
+]
+
+COLUMNS = [name for (name, code, fmt) in SCHEMA]
+_CODES = dict((name, code) for (name, code, fmt) in SCHEMA)
+_FORMATS = dict((name, fmt) for (name, code, fmt) in SCHEMA)
+
+# The sweeps (by result file script name, less any '_slave')
+KINDS = ['txpo', 'steptxgc', 'pdout_parms', 'pdout_timing']
+# Text files the scripts write, by file name
+TEXT_PATTERNS = ['txpo_*.txt', 'steptxgc_*.csv', 'get_pdout_parms_*.csv']
+
+def detect_kind(path, columns, script=None):
+    """Which sweep wrote a file: one of KINDS, or None"""
+    if(script):
+        kind = script[:-len('_slave')] if script.endswith('_slave') else script
+        if(kind in KINDS):
+            return kind
+    name = os.path.basename(path)
+    if(name.startswith('txpo_')):
+        return 'txpo'
+    if(name.startswith('steptxgc_')):
+        return 'steptxgc'
+    if('nsamples' in columns):
+        return 'pdout_parms' if 'txpo' in columns else 'pdout_timing'
+    return None
+
+def results_path(csv_path):
+    """The result file that goes with a script's CSV file name"""
+    return os.path.splitext(csv_path)[0] + '.mgr'
+
+def record_layout(columns):
+    """The record struct of a file with these columns: a bitmask of the
+    columns present, then each column"""
+    return struct.Struct('<I' + ''.join(_CODES[name] for name in columns))
+
+def timestamp(value):
+    """Epoch seconds of a DATETIME_FORMAT string (local time) or a number"""
+    if(not isinstance(value, basestring)):
+        return int(value)
+    try:
+        # Sliced by hand: strptime costs more than the rest of add()
+        return int(time.mktime((int(value[6:10]), int(value[0:2]), int(value[3:5]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19]), 0, 0, -1)))
+    except ValueError:
+        return int(time.mktime(time.strptime(value, DATETIME_FORMAT)))
+
+def format_csv(columns, row):
+    """A row as the scripts' CSV text"""
+    out = []
+    for (name, value) in zip(columns, row):
+        if(value is None):
+            out.append('')
+        elif(name == 'datetime'):
+            out.append(time.strftime(DATETIME_FORMAT, time.localtime(value)))
+        else:
+            out.append(_FORMATS[name] % value)
+    return ", ".join(out)
+
+
+class ResultWriter(object):
+    """Writes one result file (replacing any there), in committed batches
+
+    Only the given columns are stored, each at its schema width. With run,
+    committed rows are added to it too, and close() finishes it.
+    """
+    def __init__(self, path, columns, script=None, csv_path=None, batch_rows=64,
+                 commit_interval=5.0, run=None):
+        for name in columns:
+            if(name not in _CODES):
+                raise ValueError("Column %r is not in the result schema" % name)
+        self.path = path
+        self.columns = list(columns)
+        self.layout = record_layout(self.columns)
+        self.csv_path = csv_path
+        self.batch_rows = batch_rows
+        self.commit_interval = commit_interval
+        self.rows = 0
+        self._pending = []
+        self.run = run
+        self._run_rows = []
+        self._csv = None
+        self._csv_rows = []
+        self._last_commit = time.time()
+        self._datetime = self.columns.index('datetime') if 'datetime' in self.columns else None
+        self._mac = self.columns.index('MAC') if 'MAC' in self.columns else None
+        self.macs = []
+        self._mac_ids = {}
+        self._header = {'script': script, 'columns': self.columns, 'macs': self.macs,
+            'created': time.time()}
+        self._header_dirty = False
+        self._f = open(path, 'wb')
+        self._f.write(_PREAMBLE.pack(MAGIC, VERSION, 0, self.layout.size))
+        self._write_header()
+        self._commit_count()
+        if(csv_path is not None):
+            self._csv = open(csv_path, 'w')
+            self._csv.write("%s\n" % ", ".join(self.columns))
+            self._csv.flush()
+
+    def add(self, values):
+        """Queue one row (values of the writer's columns, in order; None for
+        a missing value)"""
+        values = list(values)
+        if(self._datetime is not None and values[self._datetime] is not None):
+            values[self._datetime] = timestamp(values[self._datetime])
+        if(self.run is not None):
+            self._run_rows.append(tuple(values))
+        if(self._csv is not None):
+            self._csv_rows.append(tuple(values))
+        mask = 0
+        for (i, value) in enumerate(values):
+            if(value is None):
+                values[i] = 0
+            else:
+                mask |= 1 << i
+        if(self._mac is not None and mask & (1 << self._mac)):
+            values[self._mac] = self._mac_id(values[self._mac])
+        self._pending.append(self.layout.pack(mask, *values))
+        if(len(self._pending) >= self.batch_rows or
+           time.time() - self._last_commit >= self.commit_interval):
+            self.commit()
+
+    def _mac_id(self, mac):
+        mac_id = self._mac_ids.get(mac)
+        if(mac_id is None):
+            mac_id = self._mac_ids[mac] = len(self.macs)
+            self.macs.append(mac)
+            self._header_dirty = True
+        return mac_id
+
+    def commit(self):
+        """Make the queued rows durable"""
+        if(self._pending):
+            if(self._header_dirty):
+                self._write_header()
+            self._f.seek(0, os.SEEK_END)
+            self._f.write(''.join(self._pending))
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self.rows += len(self._pending)
+            self._pending = []
+            self._commit_count()
+        if(self._csv_rows):
+            (rows, self._csv_rows) = (self._csv_rows, [])
+            self._csv.write(''.join("%s\n" % format_csv(self.columns, row) for row in rows))
+            self._csv.flush()
+        if(self._run_rows):
+            # After the file: the result file is the durable copy
+            (rows, self._run_rows) = (self._run_rows, [])
+            self.run.add(self.columns, rows)
+        self._last_commit = time.time()
+
+    def _write_header(self):
+        header = json.dumps(self._header)
+        if(len(header) > HEADER_SPACE):
+            raise ValueError("%s: result file header is full" % self.path)
+        self._f.seek(_PREAMBLE.size)
+        self._f.write(header.ljust(HEADER_SPACE))
+        self._header_dirty = False
+
+    def _commit_count(self):
+        self._f.seek(_COUNT_OFFSET)
+        self._f.write(struct.pack('<Q', self.rows))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        if(self._f is None):
+            return
+        self.commit()
+        self._f.close()
+        self._f = None
+        if(self._csv is not None):
+            self._csv.close()
+            self._csv = None
+        if(self.run is not None):
+            self.run.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ResultFile(object):
+    """A result file opened for reading (committed rows only)"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            (magic, version, self.count, record_size) = \
+                _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if(magic != MAGIC):
+                raise ValueError("%s is not a result file" % path)
+            if(version != VERSION):
+                raise ValueError("%s: unsupported result file version %d" % (path, version))
+            header = json.loads(f.read(HEADER_SPACE))
+        self.script = header['script']
+        self.columns = [str(name) for name in header['columns']]
+        self.macs = [str(mac) for mac in header['macs']]
+        self.created = header['created']
+        self.layout = record_layout(self.columns)
+        if(self.layout.size != record_size):
+            raise ValueError("%s: record size %d doesn't match its columns" % (path, record_size))
+        self.data_offset = _PREAMBLE.size + HEADER_SPACE
+
+    def __len__(self):
+        return self.count
+
+    def records(self, chunk_rows=4096):
+        """The raw records, read in chunks"""
+        size = self.layout.size
+        with open(self.path, 'rb') as f:
+            f.seek(self.data_offset)
+            remaining = self.count
+            while(remaining > 0):
+                n = min(chunk_rows, remaining)
+                data = f.read(n * size)
+                if(len(data) < n * size):
+                    raise IOError("%s is truncated" % self.path)
+                for i in range(n):
+                    yield data[i * size:(i + 1) * size]
+                remaining -= n
+
+    def rows(self):
+        """Each row as a list of the file's column values (None where missing)"""
+        unpack = self.layout.unpack
+        mac = self.columns.index('MAC') if 'MAC' in self.columns else None
+        for data in self.records():
+            fields = unpack(data)
+            mask = fields[0]
+            row = list(fields[1:])
+            if(mask != (1 << len(row)) - 1):
+                for i in range(len(row)):
+                    if(not mask & (1 << i)):
+                        row[i] = None
+            if(mac is not None and row[mac] is not None):
+                row[mac] = self.macs[row[mac]]
+            yield row
+
+    def export_csv(self, out_path):
+        """Write the rows as the CSV text the script used to write"""
+        with open(out_path, 'w') as f:
+            f.write("%s\n" % ", ".join(self.columns))
+            for row in self.rows():
+                f.write("%s\n" % format_csv(self.columns, row))
+
+    def to_numpy(self):
+        """The committed records as a numpy structured array (needs numpy).
+        'present' is the bitmask of the columns each row has, and MAC holds
+        indexes into self.macs."""
+        import numpy
+        dtype = numpy.dtype([('present', '<u4')] +
+            [(name, '<' + _CODES[name]) for name in self.columns])
+        with open(self.path, 'rb') as f:
+            f.seek(self.data_offset)
+            return numpy.fromfile(f, dtype=dtype, count=self.count)
+
+if __name__ == '__main__':
+    if(len(sys.argv) < 3 or sys.argv[1] not in ('export', 'info')):
+        print "usage: python mg_results.py export FILE.mgr [OUT.csv] | info FILE.mgr"
+        sys.exit(2)
+    results = ResultFile(sys.argv[2])
+    if(sys.argv[1] == 'info'):
+        print "%s: %s, %d rows, columns: %s" % (results.path, results.script,
+            len(results), ", ".join(results.columns))
+    else:
+        out = sys.argv[3] if len(sys.argv) > 3 else os.path.splitext(results.path)[0] + '.csv'
+        results.export_csv(out)
+        print "Wrote %d rows to %s" % (len(results), out)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""One E4418B shared by several DUTs through an RF switch
+
+The switch routes one DUT at a time to the meter. SharedMeter hands the
+meter out in leases, first come first served. A lease covers a whole
+transmit-and-measure (see MeasurementWorkers.submit), so while one DUT is
+being measured the others carry on with their register, channel and pdout
+work and queue up for the next lease. With enough DUTs there is always one
+waiting and the meter stays busy.
+
+Each DUT's script gets a VirtualMeter in place of the E4418B. It remembers
+the settings that script sent (duty cycle, offset, frequency, averaging, ...).
+When a lease moves to another DUT, only the settings that differ from what
+is on the meter are sent (usually just the duty cycle and offset). A setting
+the new DUT never made is put back to its preset state, with the command in
+RESTORE_COMMANDS if there is one, or else by presetting the meter and sending
+all of the DUT's settings. This way masters and slaves with different duty
+factors can share a meter. A setting the DUT sent unchecked and then
+cleared the meter's errors after (CORR:DCYC on the E4412A/E4413A) is
+replayed the same way, with the clear.
+
+RFSwitch is abstract: a switch driver subclasses it and implements
+_route(port). The only one in the tree is the simulator's (mg_sim
+SimRFSwitch); --switch loads a station's own driver.
+"""
+
+import abc
+import time
+import threading
+import importlib
+import collections
+
+# Meter commands that wipe its configuration
+RESET_COMMANDS = ("SYST:PRES", "*RST")
+
+# setting header -> command putting it back as after SYST:PRES (None: the
+# setting can be left as it is)
+RESTORE_COMMANDS = {
+    "SYST:REM": None,
+    "INIT:CONT": "INIT:CONT ON",
+    "FREQ": "FREQ 50MHZ",
+    "CORR:GAIN2": "CORR:GAIN2 0",
+    "CORR:DCYC": "CORR:DCYC:STAT OFF",
+    "CORR:CSET1:SEL": None,
+    "CORR:CSET1:STAT": "CORR:CSET1:STAT OFF",
+    "SENS:AVER:COUN": "SENS:AVER:COUN:AUTO ON",
+    "SENS:AVER:COUN:AUTO": "SENS:AVER:COUN:AUTO ON",
+    "SENS:POW:AC:RANGE": "SENS:POW:AC:RANGE:AUTO ON",
+    "TRIG:COUN": "TRIG:COUN 1",
+}
+
+def _setting(command):
+    """The header of a setting command, or None for queries and resets"""
+    command = command.strip()
+    if(command.endswith("?") or command in RESET_COMMANDS):
+        return None
+    return command.split(" ", 1)[0]
+
+class RFSwitch(object):
+    """Base class for RF switch drivers
+
+    select() routes port to the meter and waits settle_time for the path to
+    settle. It does nothing if port is already selected.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, settle_time=0.0):
+        self.settle_time = settle_time
+        self.selected = None
+        self.switches = 0
+
+    def select(self, port):
+        if(port == self.selected):
+            return
+        self._route(port)
+        self.selected = port
+        self.switches += 1
+        if(self.settle_time):
+            time.sleep(self.settle_time)
+
+    @abc.abstractmethod
+    def _route(self, port):
+        """Switch the meter's input to port"""
+
+def load_switch(spec, *args):
+    """Instantiate a switch driver from "module.Class" """
+    (module_name, class_name) = spec.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)(*args)
+
+
+class SharedMeter(object):
+    """Schedules leases on one power meter behind an RF switch
+
+    stats() reports how much of the wall time since the first lease the
+    meter was leased, i.e. its utilization.
+    """
+    def __init__(self, meter, switch):
+        self.meter = meter
+        self.switch = switch
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self.owner = None
+        # header -> command of the settings currently on the meter, in the
+        # order first sent
+        self.meter_settings = collections.OrderedDict()
+        self.leases = 0
+        self.replays = 0
+        self.presets = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self._t_first = None
+        self._t_last = None
+        self._t_acquired = None
+
+    def virtual_meter(self, switch_port):
+        """A VirtualMeter for the DUT on switch_port"""
+        return VirtualMeter(self, switch_port)
+
+    def acquire(self, vmeter):
+        """Block until vmeter's turn, then route and configure the meter for it"""
+        t0 = time.time()
+        with self._cond:
+            self._queue.append(vmeter)
+            while(self.owner is not None or self._queue[0] is not vmeter):
+                self._cond.wait()
+            self._queue.popleft()
+            self.owner = vmeter
+        now = time.time()
+        self.wait_time += now - t0
+        self._t_acquired = now
+        if(self._t_first is None):
+            self._t_first = now
+        self.leases += 1
+        self.switch.select(vmeter.switch_port)
+        self._configure(vmeter)
+
+    def _configure(self, vmeter):
+        wanted = vmeter.settings
+        extra = [header for header in self.meter_settings if header not in wanted]
+        if(any(header not in RESTORE_COMMANDS for header in extra)):
+            self.presets += 1
+            self.cmd("SYST:PRES")
+        elif(extra):
+            # In the order the settings were made (a CSET select goes
+            # before its state), each restore command once
+            restored = set()
+            for header in extra:
+                command = RESTORE_COMMANDS[header]
+                if(command is not None and command not in restored):
+                    restored.add(command)
+                    self.replays += 1
+                    self.meter.cmd(command)
+            for header in extra:
+                del self.meter_settings[header]
+        for (header, (command, kwargs)) in wanted.items():
+            if(self.meter_settings.get(header) != command):
+                self.replays += 1
+                self.cmd(command, **kwargs)
+                if(header in vmeter.cleared_after):
+                    self.meter.clear_errors()
+
+    def cmd(self, command, **kwargs):
+        """Send command to the meter, tracking its settings (lease holder only)"""
+        header = _setting(command)
+        if(header is not None):
+            self.meter_settings[header] = command
+        elif(command.strip() in RESET_COMMANDS):
+            self.meter_settings.clear()
+        return self.meter.cmd(command, **kwargs)
+
+    def meter_reset(self):
+        self.meter_settings.clear()
+        return self.meter.meter_reset()
+
+    def release(self, vmeter):
+        with self._cond:
+            if(self.owner is not vmeter):
+                raise RuntimeError("Meter lease released by a DUT that doesn't hold it")
+            now = time.time()
+            self.busy_time += now - self._t_acquired
+            self._t_last = now
+            self.owner = None
+            self._cond.notify_all()
+
+    def stats(self):
+        wall = (self._t_last - self._t_first) if self._t_first is not None else 0.0
+        return {
+            'leases': self.leases,
+            'switches': self.switch.switches,
+            'config_replays': self.replays,
+            'config_presets': self.presets,
+            'busy_s': self.busy_time,
+            'wall_s': wall,
+            'utilization': self.busy_time / wall if wall else 0.0,
+            'wait_s': self.wait_time,
+        }
+
+    def __str__(self):
+        s = self.stats()
+        return ("shared meter: %d leases, %d switches, %d settings replayed, "
+                "%d presets, %.1f%% busy over %.1fs" % (s['leases'], s['switches'],
+                s['config_replays'], s['config_presets'], 100 * s['utilization'],
+                s['wall_s']))
+
+
+class VirtualMeter(object):
+    """One DUT's view of a SharedMeter; stands in for the E4418B
+
+    Commands sent outside a lease take a short lease of their own.
+    """
+    def __init__(self, shared, switch_port):
+        self.shared = shared
+        self.switch_port = switch_port
+        # header -> (command, kwargs), in the order first sent
+        self.settings = collections.OrderedDict()
+        # Headers of settings sent unchecked and followed by clear_errors()
+        self.cleared_after = set()
+        self._unchecked = None
+
+    # Lease protocol used by MeasurementWorkers.submit
+    def begin_lease(self):
+        self.shared.acquire(self)
+
+    def end_lease(self):
+        self.shared.release(self)
+
+    def _send(self, fn, *args, **kwargs):
+        if(self.shared.owner is self):
+            return fn(*args, **kwargs)
+        self.begin_lease()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.end_lease()
+
+    def cmd(self, command, **kwargs):
+        header = _setting(command)
+        if(command.strip() in RESET_COMMANDS):
+            self.settings.clear()
+            self.cleared_after.clear()
+        reply = self._send(self.shared.cmd, command, **kwargs)
+        self._unchecked = None
+        if(header is not None):
+            self.settings[header] = (command,
+                dict((k, v) for (k, v) in kwargs.items() if k != 'timeout'))
+            self.cleared_after.discard(header)
+            if(kwargs.get('do_error_check', True) is False):
+                self._unchecked = header
+        return reply
+
+    def meter_reset(self):
+        self.settings.clear()
+        self.cleared_after.clear()
+        self._unchecked = None
+        return self._send(self.shared.meter_reset)
+
+    def clear_errors(self):
+        if(self._unchecked is not None):
+            self.cleared_after.add(self._unchecked)
+            self._unchecked = None
+        return self._send(self.shared.meter.clear_errors)
@@ -0,0 +1,541 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Hardware-free simulator for the Summit module and the E4418B power meter
+
+Stands in for the objects the scripts talk to:
+
+    SimSummitDevice - TxAPI/RxAPI device: rd, wr, transmit_packets,
+                      temperature, get_pdout, set_radio_channel,
+                      invoke_radio_cal_state, target.SWM_Diag_GetFlashData, ...
+    SimRxAPI        - the "collection of slaves"
+    SimE4418B       - cmd, meter_reset, clear_errors
+    SimRFSwitch     - an RF switch in front of the meter (mg_shared_meter)
+
+Every call sleeps for a modelled serial round trip (bytes on the wire at the
+link's baud rate plus a turnaround) and any on-air or settling time, with
+some jitter, so the scripts see realistic timing. SimTiming holds all of it;
+scale=0 runs as fast as possible. The meter reads whatever device is on the
+air of its SimStation, plus noise, so readings follow the device's TXGC,
+channel and temperature.
+
+Each device and meter keeps per-category call counts and busy time (see
+busy()) for benchmarking.
+
+To run a script end to end against the simulator:
+
+    python mg_sim.py mg_txpo_test [scale]
+"""
+
+import sys
+import math
+import time
+import random
+import inspect
+import threading
+import mg_meter
+from mg_shared_meter import RFSwitch
+from mg_calstates import rcs, RADIOCAL_OK
+from mg_calstates import STATE_IDLE as CAL_STATE_IDLE
+from mg_calstates import STATE_BEGIN as CAL_STATE_BEGIN
+from mg_calstates import STATE_FIRST as CAL_STATE_FIRST
+from mg_calstates import STATE_FINISHED as CAL_STATE_FINISHED
+
+RADIOCAL_INVALID_STATE_TRANSITION = rcs["RADIOCAL_INVALID_STATE_TRANSITION"]
+
+TXVECTOR_POWER_REG = 0x40100C
+GC_BASE = 0x4089A0
+
+class SimTiming(object):
+    """Latencies (seconds, unless noted) used by the simulated hardware"""
+    def __init__(self, **kwargs):
+        self.summit_baud = 115200
+        self.summit_turnaround = 0.002
+        self.meter_baud = 9600
+        self.meter_turnaround = 0.005
+        self.packet_time = 0.00005      # on air per packet (5000 -> 250 ms)
+        self.channel_time = 0.020       # PLL settling in set_radio_channel
+        self.temperature_time = 0.005
+        self.pdout_sample_time = 0.00002
+        self.flash_read_time = 0.050
+        self.cal_state_time = 0.600     # on air per invoke_radio_cal_state
+        self.meas_time = 0.100          # MEAS? averaging on top of FETCH?
+        self.reading_interval = 0.005   # between buffered readings (TRIG:COUN)
+        self.reset_time = 1.0           # meter_reset
+        self.preset_time = 0.5          # SYST:PRES
+        self.switch_time = 0.010        # RF switch actuation and settling
+        self.jitter = 0.1               # +/- fraction applied to every delay
+        self.scale = 1.0                # multiplies every delay
+        for (name, value) in kwargs.items():
+            if(not hasattr(self, name)):
+                raise AttributeError("SimTiming has no setting %r" % name)
+            setattr(self, name, value)
+
+    def serial(self, baud, turnaround, nbytes):
+        # 10 bits per byte on an 8N1 link
+        return turnaround + nbytes * 10.0 / baud
+
+    def sleep(self, seconds, rng):
+        seconds *= self.scale
+        if(seconds <= 0):
+            return
+        if(self.jitter):
+            seconds *= 1.0 + rng.uniform(-self.jitter, self.jitter)
+        time.sleep(seconds)
+
+class _Busy(object):
+    """Per-category call counts and busy time"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.seconds = {}
+
+    def add(self, category, seconds):
+        with self._lock:
+            self.calls[category] = self.calls.get(category, 0) + 1
+            self.seconds[category] = self.seconds.get(category, 0.0) + seconds
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.seconds.clear()
+
+class SimAir(object):
+    """The RF path between the devices and a meter: who is transmitting"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = []
+
+    def key_up(self, dev):
+        with self._lock:
+            self._active.append(dev)
+
+    def key_down(self, dev):
+        with self._lock:
+            if(dev in self._active):
+                self._active.remove(dev)
+
+    def power(self):
+        """Output power (dBm) of the device on the air, or None"""
+        with self._lock:
+            if(not self._active):
+                return None
+            return self._active[-1].output_power()
+
+class SimRFSwitch(RFSwitch):
+    """An RF switch in front of one meter: the meter sees the selected path
+
+    An mg_shared_meter.RFSwitch; pass it as the meter's air.
+    """
+    def __init__(self, airs, timing=None, seed=None):
+        RFSwitch.__init__(self)
+        self.airs = airs
+        self.timing = timing if timing is not None else SimTiming()
+        self.rng = random.Random(seed)
+        self.busy = _Busy()
+
+    def _route(self, port):
+        t0 = time.time()
+        self.timing.sleep(self.timing.switch_time, self.rng)
+        self.busy.add('switch', time.time() - t0)
+
+    def power(self):
+        if(self.selected is None):
+            return None
+        return self.airs[self.selected].power()
+
+class _SimTarget(object):
+    """The target.SWM_Diag_* API of a device"""
+    def __init__(self, dev):
+        self.dev = dev
+
+    def SWM_Diag_GetFlashData(self, addr, size, ref):
+        self.dev._io('flash', 16, 16 + size, self.dev.timing.flash_read_time)
+        data = ref._obj
+        if(hasattr(data, 'masterMfgData')):
+            desc = data.masterMfgData.masterDescriptor.moduleDescriptor
+            data.radioCalData.defaultPwr = self.dev.default_pwr
+        else:
+            desc = data.speakerMfgData.moduleDescriptor
+        desc.moduleID = self.dev.module_id
+        desc.firmwareVersion = self.dev.firmware
+        return 0x01
+
+class SimSummitDevice(object):
+    """A simulated Summit module
+
+    block_ops adds rd_block/wr_block, which the real TxAPI/RxAPI don't have.
+    """
+    def __init__(self, mac, module_id=0xFD, firmware=(198 << 5) | 3, default_pwr=20,
+                 air=None, timing=None, seed=None, block_ops=False):
+        self.mac = mac
+        self.module_id = module_id
+        self.firmware = firmware
+        self.default_pwr = default_pwr
+        self.air = air if air is not None else SimAir()
+        self.timing = timing if timing is not None else SimTiming()
+        self.rng = random.Random(seed if seed is not None else mac)
+        self.busy = _Busy()
+        self.target = _SimTarget(self)
+        self.channel = 8
+        self.temp = 35.0
+        self.ambient = 35.0
+        self.power_comp = 1
+        self.regs = {TXVECTOR_POWER_REG: 3}
+        self._last_temp_update = time.time()
+        self._link = threading.Lock()
+        # Per-channel cal: gain table loaded by set_radio_channel, and a
+        # fixed tilt of the output power across the band
+        self._cal_gc = dict((ch, 0x28 + self.rng.randint(-3, 3)) for ch in range(8, 35))
+        self._tilt = dict((ch, self.rng.gauss(0.0, 0.3) - 0.04 * (ch - 8)) for ch in range(8, 35))
+        self._load_gain_table()
+        self.cal_state = CAL_STATE_IDLE
+        self.cal_log = []
+        if(block_ops):
+            self.rd_block = self._rd_block
+            self.wr_block = self._wr_block
+
+    def __getitem__(self, key):
+        if(key == 'mac'):
+            return self.mac
+        raise KeyError(key)
+
+    def _io(self, category, nbytes_out, nbytes_in, extra=0.0):
+        """One serial transaction on the device link"""
+        t = self.timing
+        with self._link:
+            t0 = time.time()
+            t.sleep(t.serial(t.summit_baud, t.summit_turnaround, nbytes_out + nbytes_in) + extra,
+                self.rng)
+            self.busy.add(category, time.time() - t0)
+
+    def _load_gain_table(self):
+        for i in range(8):
+            self.regs[GC_BASE + 4 * i] = self._cal_gc[self.channel]
+
+    def _heat(self, seconds_on_air):
+        now = time.time()
+        self.temp = self.ambient + (self.temp - self.ambient) * math.exp(
+            -0.02 * (now - self._last_temp_update))
+        self.temp += 4.0 * seconds_on_air
+        self._last_temp_update = now
+
+    def output_power(self):
+        """Output power in dBm for the current channel, TXGC and temperature"""
+        gc_index = self.regs.get(TXVECTOR_POWER_REG, 0) & 0x7
+        gc = self.regs.get(GC_BASE + 4 * gc_index, 0)
+        power = -2.0 + 0.25 * gc + self._tilt.get(self.channel, 0.0)
+        if(not self.power_comp):
+            power -= 0.015 * (self.temp - self.ambient)
+        return power
+
+    def decode_error_status(self, status, cmd=None):
+        return "status 0x%02X from %s" % (status, cmd)
+
+    def rd(self, addr):
+        self._io('reg', 8, 8)
+        return (0x01, self.regs.get(addr, 0))
+
+    def wr(self, addr, value):
+        self._io('reg', 12, 4)
+        self.regs[addr] = value
+        return (0x01, None)
+
+    def _rd_block(self, addr, count):
+        self._io('reg', 8, 4 + 4 * count)
+        return (0x01, [self.regs.get(addr + 4 * i, 0) for i in range(count)])
+
+    def _wr_block(self, addr, values):
+        self._io('reg', 8 + 4 * len(values), 4)
+        for (i, value) in enumerate(values):
+            self.regs[addr + 4 * i] = value
+        return (0x01, None)
+
+    def set_radio_channel(self, idx, ch):
+        self._io('channel', 8, 4, self.timing.channel_time)
+        self.channel = ch
+        self._load_gain_table()
+        return (0x01, None)
+
+    def temperature(self):
+        self._io('temperature', 4, 8, self.timing.temperature_time)
+        self._heat(0.0)
+        return (0x01, int(round(self.temp)))
+
+    def get_pdout(self, delay, nsamples):
+        self._io('pdout', 8, 8, delay * 1e-6 + nsamples * self.timing.pdout_sample_time)
+        mw = math.pow(10.0, self.output_power() / 10.0)
+        pdout = 1500.0 + 60.0 * mw + self.rng.gauss(0.0, 24.0 / math.sqrt(nsamples))
+        return (0x01, int(pdout))
+
+    def transmit_packets(self, packet_count):
+        on_air = packet_count * self.timing.packet_time
+        self.air.key_up(self)
+        try:
+            self._io('transmit', 8, 4, on_air)
+        finally:
+            self.air.key_down(self)
+        self._heat(on_air * self.timing.scale)
+        return (0x01, None)
+
+    def set_power_comp_enable(self, enable):
+        self._io('reg', 8, 4)
+        self.power_comp = enable
+        return (0x01, None)
+
+    def dfs_override(self, mode):
+        self._io('reg', 8, 4)
+        return (0x01, None)
+
+    def set_transmit_power(self, power):
+        self._io('reg', 8, 4)
+        return (0x01, None)
+
+    def invoke_radio_cal_state(self, state, measurement):
+        # Like the firmware, take the states in order only; cal_log has what
+        # the session was given since BEGIN
+        if(state not in (CAL_STATE_BEGIN, CAL_STATE_FINISHED, self.cal_state)):
+            self._io('cal', 16, 8)
+            return (RADIOCAL_INVALID_STATE_TRANSITION, self.cal_state)
+        if(state != CAL_STATE_BEGIN):
+            self.cal_log.append((state, measurement))
+        if(state == CAL_STATE_BEGIN):
+            self.cal_log = []
+            next_state = CAL_STATE_FIRST
+        elif(state == CAL_STATE_FINISHED):
+            next_state = CAL_STATE_IDLE
+        elif(state + 1 >= CAL_STATE_FINISHED):
+            next_state = CAL_STATE_FINISHED
+        else:
+            next_state = state + 1
+        # The module transmits at the next cal point while it works
+        self.air.key_up(self)
+        try:
+            self._io('cal', 16, 8, self.timing.cal_state_time)
+        finally:
+            self.air.key_down(self)
+        self.cal_state = next_state
+        return (RADIOCAL_OK, next_state)
+
+class SimRxAPI(list):
+    """A collection of simulated slaves"""
+    pass
+
+class SimE4418B(object):
+    """A simulated E4418B power meter
+
+    Settings written with cmd() are kept and echoed back by the matching
+    query, so the scripts' setup and read-back work as on the real meter.
+
+    Like the real meter, an E4412A or E4413A sensor flags an error on
+    CORR:DCYC (the scripts send it unchecked and clear the errors after).
+
+    With buffered, INIT starts taking up to TRIG:COUN readings (one every
+    reading_interval) into a buffer, and FETCH? stops and returns them all,
+    comma separated. Without it the trigger commands are rejected with an
+    "Undefined header" error, like a meter without buffered readout.
+    """
+    def __init__(self, air=None, timing=None, sensor="E4412A", noise=0.05,
+                 floor=-60.0, seed=None, buffered=False):
+        self.air = air if air is not None else SimAir()
+        self.timing = timing if timing is not None else SimTiming()
+        self.sensor = sensor
+        self.noise = noise
+        self.floor = floor
+        self.rng = random.Random(seed)
+        self.busy = _Busy()
+        self.settings = {}
+        self.errors = []
+        self._link = threading.Lock()
+        self.buffered = buffered
+        self._capture = None
+
+    def _io(self, category, command, reply, extra=0.0):
+        t = self.timing
+        with self._link:
+            t0 = time.time()
+            t.sleep(t.serial(t.meter_baud, t.meter_turnaround, len(command) + len(reply) + 2)
+                + extra, self.rng)
+            self.busy.add(category, time.time() - t0)
+        return reply
+
+    def _reading(self):
+        power = self.air.power()
+        if(power is None):
+            power = self.floor
+        try:
+            power += float(self.settings.get("CORR:GAIN2", 0.0))
+        except ValueError:
+            pass
+        return "%+.5E" % (power + self.rng.gauss(0.0, self.noise))
+
+    def _start_capture(self):
+        self._stop_capture()
+        count = int(self.settings.get("TRIG:COUN", 1))
+        stop = threading.Event()
+        readings = []
+
+        def take():
+            while(len(readings) < count and not stop.is_set()):
+                readings.append(self._reading())
+                stop.wait(self.timing.reading_interval * self.timing.scale)
+        thread = threading.Thread(target=take, name='SimE4418B-capture')
+        thread.daemon = True
+        thread.start()
+        self._capture = (stop, thread, readings)
+
+    def _stop_capture(self):
+        if(self._capture is None):
+            return []
+        (stop, thread, readings) = self._capture
+        stop.set()
+        thread.join()
+        self._capture = None
+        return readings
+
+    def meter_reset(self):
+        self._stop_capture()
+        self.settings.clear()
+        self._io('meter_setup', "*RST", "", self.timing.reset_time)
+
+    def clear_errors(self):
+        self.errors = []
+        self._io('meter_setup', "*CLS", "")
+
+    def cmd(self, command, timeout=None, do_error_check=True):
+        command = command.strip()
+        if(command.startswith("TRIG:") or command == "INIT"):
+            if(not self.buffered):
+                self.errors.append('-113,"Undefined header"')
+                return self._io('meter_cmd', command, "")
+            if(command == "INIT"):
+                reply = self._io('meter_cmd', command, "")
+                self._start_capture()
+                return reply
+        if(command == "FETCH?" and self._capture is not None):
+            readings = self._stop_capture()
+            return self._io('meter_fetch', command, ",".join(readings))
+        if(command.startswith("INIT:CONT")):
+            self._stop_capture()
+        if(command in ("FETCH?", "MEAS?")):
+            # The reading reflects the air at the end of the round trip
+            extra = self.timing.meas_time if command == "MEAS?" else 0.0
+            self._io('meter_fetch', command, "+1.00000E+01", extra)
+            return self._reading()
+        if(command == "SYST:PRES"):
+            self.settings.clear()
+            return self._io('meter_setup', command, "", self.timing.preset_time)
+        if(command == "SERV:SENS1:TYPE?"):
+            return self._io('meter_cmd', command, self.sensor)
+        if(command == "*IDN?"):
+            return self._io('meter_cmd', command, "Agilent Technologies,E4418B,SIM,A2.10.00")
+        if(command == "SYST:ERR?"):
+            reply = self.errors.pop(0) if self.errors else '+0,"No error"'
+            return self._io('meter_cmd', command, reply)
+        if(command.endswith("?")):
+            return self._io('meter_cmd', command, self.settings.get(command[:-1], "0"))
+        if(" " in command):
+            (name, value) = command.split(" ", 1)
+            self.settings[name] = value.strip("'\"")
+            if(name == "CORR:DCYC" and self.sensor in ("E4412A", "E4413A")):
+                self.errors.append('-221,"Settings conflict"')
+        return self._io('meter_cmd', command, "")
+
+class SimComPort(object):
+    """Stand-in for rfmeter.comport.ComPort"""
+    def __init__(self, port):
+        self.port = port
+        self.connected = False
+
+    def connect(self):
+        self.connected = True
+
+class SimStation(object):
+    """A simulated test station: one master, some slaves and one meter
+
+    With meter_ports (one port per device, master first) every device gets
+    its own shielded path to its own meter instead, as on a multi-DUT bench;
+    connect_meter(port) then returns the meter on that port.
+
+    With rf_switch every device gets its own path to switch port 0 (master),
+    1, 2, ... of self.switch, a SimRFSwitch in front of the one meter.
+    """
+    def __init__(self, n_slaves=1, timing=None, seed=0, block_ops=False, sensor="E4412A",
+                 meter_ports=None, rf_switch=False):
+        self.timing = timing if timing is not None else SimTiming()
+        self.air = SimAir()
+        self.switch = None
+        if(meter_ports is not None):
+            if(len(meter_ports) != n_slaves + 1):
+                raise ValueError("Need one meter port per device (%d), got %d" %
+                    (n_slaves + 1, len(meter_ports)))
+            airs = [SimAir() for port in meter_ports]
+        elif(rf_switch):
+            airs = [SimAir() for i in range(n_slaves + 1)]
+            self.switch = SimRFSwitch(airs, timing=self.timing, seed=seed)
+        else:
+            airs = [self.air] * (n_slaves + 1)
+        self.TX = SimSummitDevice('00:25:1d:00:00:%02x' % seed, air=airs[0],
+            timing=self.timing, seed=seed, block_ops=block_ops)
+        self.RX = SimRxAPI()
+        for i in range(n_slaves):
+            self.RX.append(SimSummitDevice('00:25:1d:00:%02x:%02x' % (i + 1, seed),
+                module_id=0xCD, firmware=(197 << 5) | 3, air=airs[i + 1],
+                timing=self.timing, seed=seed * 100 + i + 1, block_ops=block_ops))
+        self.meters = {}
+        if(meter_ports is not None):
+            for (i, port) in enumerate(meter_ports):
+                self.meters[port] = SimE4418B(air=airs[i], timing=self.timing,
+                    sensor=sensor, seed=seed * 100 + i)
+            self.meter = self.meters[meter_ports[0]]
+        else:
+            self.meter = SimE4418B(air=self.switch or self.air, timing=self.timing,
+                sensor=sensor, seed=seed)
+
+    def devices(self):
+        return [self.TX] + list(self.RX)
+
+    def _connect(self, port):
+        if(not self.meters):
+            return self.meter
+        return self.meters[port]
+
+    def install(self):
+        """Make mg_meter.connect_meter() return this station's meter(s)"""
+        mg_meter.set_meter_factory(self._connect)
+
+    def uninstall(self):
+        mg_meter.set_meter_factory(None)
+
+    def busy(self):
+        """Total busy time per category across the station"""
+        seconds = {}
+        calls = {}
+        for obj in self.devices() + (self.meters.values() or [self.meter]) + \
+                ([self.switch] if self.switch else []):
+            for (category, value) in obj.busy.seconds.items():
+                seconds[category] = seconds.get(category, 0.0) + value
+                calls[category] = calls.get(category, 0) + obj.busy.calls[category]
+        return (calls, seconds)
+
+def run_main(module, station, *args):
+    """Call module.main against station; missing positional arguments
+    (iterations, test_profile, ...) are passed as None"""
+    spec = inspect.getargspec(module.main)
+    n_required = len(spec.args) - len(spec.defaults or ())
+    args = (station.TX, station.RX) + args
+    args = args + (None,) * max(0, n_required - len(args))
+    station.install()
+    try:
+        return module.main(*args)
+    finally:
+        station.uninstall()
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    module = __import__(sys.argv[1].replace('.py', ''))
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    station = SimStation(timing=SimTiming(scale=scale))
+    t0 = time.time()
+    run_main(module, station)
+    print "Finished in %.1fs" % (time.time() - t0)
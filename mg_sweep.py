@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Channel sweep engine for the Summit TX power scripts
+
+A sweep point is split into three stages:
+
+    setup(ch)                   - device register traffic before transmitting
+                                  (set channel, temperature, TXGC reads/writes);
+                                  returns whatever the later stages need
+    post_tx(ch, state)          - device reads that have to happen on the same
+                                  channel after transmitting (pdout); returns
+                                  the updated state
+    make_rows(ch, state, data)  - builds the output rows from the state and the
+                                  RunningStats of the power meter
+                                  readings; no device I/O
+
+In sequential mode each point runs setup -> tx_measure -> post_tx -> rows,
+exactly like the original loops. In pipelined mode the device is released as
+soon as it finishes transmitting, so post_tx for channel N and setup for
+channel N+1 run while the power meter is still finishing channel N's trailing
+reading. The rows come out in the same order either way.
+"""
+
+import time
+from mg_measure import start_tx_measure
+
+class ChannelSweep(object):
+    """Runs the setup/measure/post_tx stages over a list of channels"""
+    def __init__(self, dev, power_meter, setup, post_tx, make_rows,
+                 packet_count=5000, meas_cmd="FETCH?", pipelined=True, adaptive=None,
+                 workers=None, buffered=None):
+        self.dev = dev
+        self.power_meter = power_meter
+        self.setup = setup
+        self.post_tx = post_tx
+        self.make_rows = make_rows
+        self.packet_count = packet_count
+        self.meas_cmd = meas_cmd
+        self.pipelined = pipelined
+        self.adaptive = adaptive
+        self.workers = workers
+        self.buffered = buffered
+        self.elapsed = None
+
+    def _start(self):
+        return start_tx_measure(self.dev, self.power_meter, self.packet_count,
+            self.meas_cmd, workers=self.workers, adaptive=self.adaptive,
+            buffered=self.buffered)
+
+    def run(self, channels):
+        """Generator yielding the output rows of each channel in order"""
+        channels = list(channels)
+        t0 = time.time()
+        if(self.pipelined):
+            rows = self._run_pipelined(channels)
+        else:
+            rows = self._run_sequential(channels)
+        for row in rows:
+            yield row
+        self.elapsed = time.time() - t0
+
+    def _run_sequential(self, channels):
+        for ch in channels:
+            state = self.setup(ch)
+            data = self._start().result()
+            state = self.post_tx(ch, state)
+            for row in self.make_rows(ch, state, data):
+                yield row
+
+    def _run_pipelined(self, channels):
+        if(not channels):
+            return
+        state = self.setup(channels[0])
+        for (i, ch) in enumerate(channels):
+            meas = self._start()
+            meas.wait_tx_done()
+
+            # The device is free again; the meter is still wrapping up
+            state = self.post_tx(ch, state)
+            if(i + 1 < len(channels)):
+                next_state = self.setup(channels[i + 1])
+            else:
+                next_state = None
+
+            data = meas.result()
+            for row in self.make_rows(ch, state, data):
+                yield row
+            state = next_state
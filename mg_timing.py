@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Per-phase timing instrumentation for the Summit TX power scripts
+
+Spans are timed with a monotonic, high-resolution clock, tagged with a phase
+name ('register', 'channel', 'transmit', 'fetch', ...) and the thread they
+ran on. Every span is folded into a per-phase histogram, and the raw spans
+can be written out as a Chrome trace (load it in chrome://tracing or
+https://ui.perfetto.dev) to see the device and power meter threads overlap.
+
+    timer = Timer()
+    dev = timer.instrument(dev, DEVICE_PHASES)
+    pm = timer.instrument(pm, METER_PHASES)
+    with timer.span('file_write'):
+        ...
+    print timer.report()
+    timer.write_chrome_trace('trace.json')
+
+A disabled Timer (Timer(enabled=False)) records nothing, and instrument()
+hands back the object it was given, so the scripts can leave the calls in.
+"""
+
+import os
+import json
+import time
+import ctypes
+import ctypes.util
+import threading
+
+# -------------------------------------------------------
+# Monotonic clock
+# -------------------------------------------------------
+CLOCK_MONOTONIC = 1
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _clock_gettime():
+    for name in ('rt', 'c'):
+        path = ctypes.util.find_library(name)
+        if(path is None):
+            continue
+        try:
+            lib = ctypes.CDLL(path, use_errno=True)
+            fn = lib.clock_gettime
+        except (OSError, AttributeError):
+            continue
+        fn.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+        return fn
+    return None
+
+_gettime = _clock_gettime()
+
+if(_gettime is not None):
+    def monotonic():
+        """Seconds from an arbitrary start, never going backwards"""
+        ts = _timespec()
+        if(_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+else:
+    # No clock_gettime (not Linux): fall back to the wall clock
+    monotonic = time.time
+
+# -------------------------------------------------------
+# Phases of the instrumented objects
+# -------------------------------------------------------
+# Summit device (TxAPI/RxAPI) method -> phase
+DEVICE_PHASES = {
+    'rd': 'register',
+    'wr': 'register',
+    'rd_block': 'register',
+    'wr_block': 'register',
+    'set_radio_channel': 'channel',
+    'temperature': 'temperature',
+    'transmit_packets': 'transmit',
+    'get_pdout': 'pdout',
+    'set_power_comp_enable': 'device_cfg',
+    'dfs_override': 'device_cfg',
+    'set_transmit_power': 'device_cfg',
+}
+
+# Power meter (E4418B) method -> phase. cmd() is split by command below.
+METER_PHASES = {
+    'cmd': 'meter_cmd',
+    'meter_reset': 'meter_cmd',
+    'clear_errors': 'meter_cmd',
+}
+
+# Power meter commands that take a reading
+READING_COMMANDS = ('FETCH?', 'MEAS?', 'READ?')
+
+# Histogram bucket upper bounds, seconds (100us .. 10s, then overflow)
+BUCKETS = [1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2,
+           0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0]
+
+
+class Histogram(object):
+    """Count, total, min/max and a bucketed distribution of one phase"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if(self.min is None or seconds < self.min):
+            self.min = seconds
+        if(self.max is None or seconds > self.max):
+            self.max = seconds
+        for (i, bound) in enumerate(BUCKETS):
+            if(seconds <= bound):
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def mean(self):
+        if(self.count == 0):
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile"""
+        if(self.count == 0):
+            return 0.0
+        want = pct / 100.0 * self.count
+        seen = 0
+        for (i, n) in enumerate(self.buckets):
+            seen += n
+            if(seen >= want):
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+
+class _Span(object):
+    def __init__(self, timer, phase, name):
+        self.timer = timer
+        self.phase = phase
+        self.name = name
+
+    def begin(self):
+        self.start = monotonic()
+        return self
+
+    def end(self):
+        self.timer.record(self.phase, self.start, monotonic() - self.start, self.name)
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end()
+        return False
+
+class _NoSpan(object):
+    def begin(self):
+        return self
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+
+class Timer(object):
+    """Collects timed spans and per-phase histograms
+
+    keep_spans=False keeps only the histograms, for long runs where the raw
+    spans (and a trace file) aren't wanted.
+    """
+    def __init__(self, enabled=True, keep_spans=True):
+        self.enabled = enabled
+        self.keep_spans = keep_spans
+        self.t0 = monotonic()
+        self.spans = []
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def span(self, phase, name=None):
+        """Context manager timing the enclosed block as phase"""
+        if(not self.enabled):
+            return _NO_SPAN
+        return _Span(self, phase, name)
+
+    def begin(self, phase, name=None):
+        """Start timing a phase that doesn't fit a with block; call end() on
+        the returned span"""
+        return self.span(phase, name).begin()
+
+    def record(self, phase, start, duration, name=None):
+        thread = threading.current_thread().name
+        with self._lock:
+            hist = self.histograms.get(phase)
+            if(hist is None):
+                hist = self.histograms[phase] = Histogram()
+            hist.add(duration)
+            if(self.keep_spans):
+                self.spans.append((phase, name, start, duration, thread))
+
+    def instrument(self, obj, phases):
+        """Wrap obj so the methods named in phases are timed"""
+        if(not self.enabled or obj is None):
+            return obj
+        return Instrumented(obj, self, phases)
+
+    def report(self):
+        """Per-phase summary table, longest total first"""
+        lines = ["%-14s %7s %9s %9s %9s %9s %9s" %
+                 ("phase", "count", "total_s", "mean_ms", "p90_ms", "min_ms", "max_ms")]
+        for (phase, hist) in sorted(self.histograms.items(),
+                                    key=lambda item: -item[1].total):
+            lines.append("%-14s %7d %9.3f %9.3f %9.3f %9.3f %9.3f" %
+                (phase, hist.count, hist.total, 1000 * hist.mean(),
+                 1000 * hist.percentile(90), 1000 * hist.min, 1000 * hist.max))
+        return "\n".join(lines)
+
+    def summary(self):
+        """The histograms as a dict, for JSON output"""
+        return dict((phase, {
+            'count': hist.count,
+            'total_s': hist.total,
+            'mean_s': hist.mean(),
+            'min_s': hist.min,
+            'max_s': hist.max,
+            'buckets': zip(BUCKETS + [None], hist.buckets),
+        }) for (phase, hist) in self.histograms.items())
+
+    def write_chrome_trace(self, path):
+        """Write the spans in Chrome trace event format (one complete event each)"""
+        with self._lock:
+            spans = list(self.spans)
+        pid = os.getpid()
+        events = []
+        tids = {}
+        for (phase, name, start, duration, thread) in spans:
+            if(thread not in tids):
+                # The viewers want numeric thread ids; name them in metadata
+                tids[thread] = len(tids) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                    'tid': tids[thread], 'args': {'name': thread}})
+            events.append({
+                'name': name or phase,
+                'cat': phase,
+                'ph': 'X',
+                'ts': (start - self.t0) * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': tids[thread],
+            })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class Instrumented(object):
+    """A proxy that times the listed methods of the wrapped object
+
+    Anything else (attributes, other methods, dev['mac']) passes straight
+    through. Power meter commands that take a reading are recorded as
+    'fetch' rather than 'meter_cmd'.
+    """
+    def __init__(self, obj, timer, phases):
+        self.__dict__['_obj'] = obj
+        self.__dict__['_timer'] = timer
+        self.__dict__['_phases'] = phases
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        phase = self._phases.get(name)
+        if(phase is None or not callable(attr)):
+            return attr
+        timer = self._timer
+
+        def timed(*args, **kwargs):
+            span_phase = phase
+            span_name = name
+            if(name == 'cmd' and args):
+                span_name = args[0]
+                if(args[0] in READING_COMMANDS):
+                    span_phase = 'fetch'
+            start = monotonic()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                timer.record(span_phase, start, monotonic() - start, span_name)
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._obj, name, value)
+
+    def __getitem__(self, key):
+        return self._obj[key]
@@ -4,7 +4,6 @@
 import math
 import time
 from time import localtime, strftime
-import threading
 from pysummit import comport
 from pysummit import decoders as dec
 from pysummit import descriptors as desc
@@ -12,6 +11,14 @@ from pysummit.devices import TxAPI
 from pysummit.devices import RxAPI
 import rfmeter
 from rfmeter.agilent import E4418B
+from mg_meter import meter_session, METER_PORT, BufferedReadout, MeterConfig, setup_meter
+from mg_sweep import ChannelSweep
+from mg_measure import AdaptiveStop
+from mg_regs import rd_batch, GC_ADDRS, CachedDevice
+from mg_results import ResultWriter, results_path
+from mg_resultdb import open_run
+from mg_writer import QueuedResultWriter, print_line, queue_log_handlers
+from mg_timing import Timer, DEVICE_PHASES, METER_PHASES
 import logging
 import logging.config
 import ctypes
@@ -30,95 +37,40 @@ RF_PWR_CNTL_REG = 0x401018
 # Flags to toggle features on and off
 DUMP_PDOUT = True
 DUMP_TXGC_REGS = True
+# Time every phase (register I/O, channel change, transmit, FETCH?, ...);
+# prints per-phase totals and writes txpo_<MAC>_trace.json (Chrome trace)
 TIMING_INFO = False
-
-dev_running = threading.Event()
-pm_ready = threading.Event()
-
-# You need two threads, one for the power meter to collect readings, and the
-# other for the Summit device to transmit packets. Because the Summit API
-# call to transmit packets is a blocking call (doesn't return until finished)
-# you need simultaneous threads to do this.
-
-class SummitDeviceThread(threading.Thread):
-    """A thread for transmitting packets
-
-    Transmit a fixed number of packets. Set the dev_running event before
-    starting the transmission and clear the dev_running event after the
-    transmission is complete.
-    """
-    def __init__(self, dev, packet_count):
-        super(SummitDeviceThread, self).__init__()
-        self.daemon = True
-        self.dev = dev
-        self.packet_count = packet_count
-        self.logger = logging.getLogger('SummitDeviceThread')
-
-    def run(self):
-        self.logger.info("Transmitting %d packets" % self.packet_count)
-
-        if(pm_ready.is_set()):
-            dev_running.set()
-            (status, null) = self.dev.transmit_packets(self.packet_count)
-            if(status != 0x01):
-                print dec.decode_error_status(status, 'transmit_packets')
-            dev_running.clear()
-
-class PMThread(threading.Thread):
-    """A power meter thread
-
-    The power meter will take continuous measurements as long as the dev_running
-    event is set.
-
-    """
-    def __init__(self, pm):
-        super(PMThread, self).__init__()
-        self.daemon = True
-        self.pm = pm
-        self.logger = logging.getLogger('PMThread')
-        self.measurements = []
-
-    def run(self):
-        total_runs = 0
-        self.logger.info("Taking power measurement...")
-        pm_ready.set()
-        while(not dev_running.is_set()):
-            pass
-        while(dev_running.is_set()):
-            # Using the FETCH? command is faster but may be less accurate;
-            # using MEAS? auto-ranges/averages and prevents disabling those.
-            # M. Greenwood (4/29/2016)
-            meas = self.pm.cmd("FETCH?", timeout=15)
-            #meas = self.pm.cmd("MEAS?", timeout=15)
-            self.logger.info("%d: %s" % (total_runs, meas))
-            self.measurements.append(meas)
-            total_runs += 1
-
-        self.pm.cmd("INIT:CONT ON")
-        pm_ready.clear()
-
-
-def tx_measure(dev, power_meter, packet_count):
-    sdev_thread = SummitDeviceThread(dev, packet_count)
-    pm_thread = PMThread(power_meter)
-
-    pm_thread.start()
-    sdev_thread.start()
-    pm_thread.join()
-    return pm_thread.measurements
-
-def main(TX, RX, tp=None, pc=None, args=[]):
+# Overlap device setup for the next channel with the meter finishing this one
+PIPELINED_SWEEP = True
+# Serve repeat register reads from a shadow copy (mg_regs.CachedDevice).
+# Off: this sweep reads each channel's gain table once, right after
+# set_radio_channel has loaded it, so there is nothing to serve
+USE_REG_CACHE = False
+# Stop each channel early once the reading has settled, e.g.
+# AdaptiveStop(tolerance_db=0.02, min_samples=10, max_samples=200); None
+# transmits the full 5000 packets. Adds nreadings/ci95/packets columns.
+ADAPTIVE_MEASURE = None
+# Arm the meter for up to this many readings per burst and read them back
+# in one transfer (falls back to FETCH? per reading if unsupported); 0 polls
+BUFFERED_READINGS = 0
+
+def main(TX, RX, tp=None, pc=None, args=[], meter_port=METER_PORT, workers=None,
+         power_meter=None):
     # -------------------------------------------------------
     # Main program flow
     # -------------------------------------------------------
 
+    timer = Timer(enabled=TIMING_INFO)
+    TX = timer.instrument(TX, DEVICE_PHASES)
+
     # Read MFG data from flash
     tx_mfg_data = desc.FLASH_MASTER_MFG_DATA_SECTION()
-    status = TX.target.SWM_Diag_GetFlashData(
-        FLASH_MAP_MFG_DATA_START_ADDR,
-        ctypes.sizeof(desc.FLASH_MASTER_MFG_DATA_SECTION),
-        ctypes.byref(tx_mfg_data)
-        )
+    with timer.span('flash_read'):
+        status = TX.target.SWM_Diag_GetFlashData(
+            FLASH_MAP_MFG_DATA_START_ADDR,
+            ctypes.sizeof(desc.FLASH_MASTER_MFG_DATA_SECTION),
+            ctypes.byref(tx_mfg_data)
+            )
 
     # Determine if module supports TPM (moduleID is Sherwood XD or Athena 4XD, firmware is 198.x or greater)
     # and get default (cal) power level
@@ -136,203 +88,200 @@ def main(TX, RX, tp=None, pc=None, args=[]):
     # -------------------------------------------------------
     # Set up power meter (one-time)
     # -------------------------------------------------------
-    # Instantiate PM
-    COM = rfmeter.comport.ComPort('/dev/ttyUSB0')
-    COM.connect()
-    PM = E4418B(COM)
-
-    # Read offset file
-    pm_offset_file = open('pm_offset.dat', 'r')
-    pm_offset = float(pm_offset_file.read(6))
-    pm_offset_file.close()
-
-    # Get duty factor for power meter correction
-    duty_factor = sdf.getSummitDutyFactor(modID, fwver)
-
-    # Reset/initialize: clear errors, remote operation
-    print ("========================================================")
-    print ("Power Meter ============================================")
-
-    PM.meter_reset()
-    PM.clear_errors()
-    PM.cmd("SYST:PRES")
-    PM.cmd("SYST:REM")
-
-    # Check sensor type: load duty factor and offset (unless channel-specific)
-    pm_sensor = PM.cmd("SERV:SENS1:TYPE?")
-    print "Sensor identifies as:", pm_sensor
-    #  "E4412A"=4412, "E4413A"=4413, "A"=HP8481A
-    if (pm_sensor == "A"):
-        PM.cmd("CORR:CSET1:SEL 'HP8481A'")
-        PM.cmd("CORR:CSET1:STAT ON")
+    # Instantiate PM (unless we were handed one, e.g. a shared meter); it is
+    # closed again when we are done
+    with meter_session(power_meter, meter_port) as power_meter:
+        PM = timer.instrument(power_meter, METER_PHASES)
+        meter_setup = timer.begin('meter_setup')
+
+        # Read offset file
+        pm_offset_file = open('pm_offset.dat', 'r')
+        pm_offset = float(pm_offset_file.read(6))
+        pm_offset_file.close()
+
+        # Get duty factor for power meter correction
+        duty_factor = sdf.getSummitDutyFactor(modID, fwver)
+
         print ("========================================================")
-        print (" Using Sensor Cal Table", PM.cmd("CORR:CSET1:SEL?"))
-        PM.cmd("CORR:DCYC " + str(duty_factor * 100) + "PCT")
-        PM.cmd("CORR:GAIN2 " + str(pm_offset))
+        print ("Power Meter ============================================")
 
-    elif(pm_sensor == "E4412A" or pm_sensor == "E4413A"):
-        PM.cmd("CORR:DCYC " + str(duty_factor * 100) + "PCT", do_error_check=False)
-        PM.clear_errors()
-        PM.cmd("CORR:GAIN2 " + str(pm_offset))
+        # Reset/configure the meter, or just apply what changed since the last run
+        pm_sensor = setup_meter(PM, MeterConfig(duty_factor, pm_offset, averaging=1, ac_range=1), meter_port)
+        print "Sensor identifies as:", pm_sensor
+        #  "E4412A"=4412, "E4413A"=4413, "A"=HP8481A
+        if (pm_sensor == "A"):
+            print ("========================================================")
+            print (" Using Sensor Cal Table", PM.cmd("CORR:CSET1:SEL?"))
+        meter_setup.end()
 
-    else:
-        PM.cmd("CORR:DCYC " + str(duty_factor * 100) + "PCT")
-        PM.cmd("CORR:GAIN2 " + str(pm_offset))
-
-    PM.cmd("FREQ " + "5.500GHZ")
-    PM.cmd("SENS:AVER:COUN:AUTO OFF")
-    PM.cmd("SENS:AVER:COUN 1")
-    PM.cmd("SENS:POW:AC:RANGE 1")
-
-    print ("========================================================")
-    print (" Duty Factor = " + str(duty_factor * 100) + "%")
-    print (" Correction  = " + str( round( (-10.0) * math.log10(duty_factor), 2) ) + "dB")
-    print ("========================================================")
-    print (" Applying Offset Data from file <pm_offset.dat>")
-    print (" Offset = " + str(pm_offset) + "dB")
-    print ("========================================================")
-    print ("")
+        print ("========================================================")
+        print (" Duty Factor = " + str(duty_factor * 100) + "%")
+        print (" Correction  = " + str( round( (-10.0) * math.log10(duty_factor), 2) ) + "dB")
+        print ("========================================================")
+        print (" Applying Offset Data from file <pm_offset.dat>")
+        print (" Offset = " + str(pm_offset) + "dB")
+        print ("========================================================")
+        print ("")
+
+        # -------------------------------------------------------
+        # Set up Summit device (one-time)
+        # -------------------------------------------------------
+        if (USE_REG_CACHE):
+            TX = CachedDevice(TX)
+
+        gc_addrs = GC_ADDRS
+
+        filename = 'txpo_%s.txt' % (TX['mac'].replace(':','-'))
+
+        # For both masters and slaves...
+        TX.wr(IRQ_EN_REG, 0x00) # IRQ enable reg - disable interrupts
+        TX.wr(BASEBAND_CCA_CTL_REG, 0x00) # CCA level reg - set CCA level
+
+        if (modID in sdf.olympus_modules): # if it's a Master
+            TX.wr(TXVECTOR_RATE_REG, 0x07) # Set data rate to 18Mb/s
+        else: # it's a Slave
+            TX.wr(TXVECTOR_RATE_REG, 0x0D) # Set data rate to 6Mb/s
+
+        # Read back (from the device, not the register cache) and report the
+        # settings of the Summit device
+        settings = rd_batch(TX, [BASEBAND_CCA_CTL_REG, IRQ_EN_REG, TXVECTOR_RATE_REG], fresh=True)
+        for (status, val) in settings:
+            if(status != 0x01):
+                print dec.decode_error_status(status)
+        ((status, CCAlevel), (status, IRQenables), (status, DataRate)) = settings
+        print "  CCA Level regr 408840: 0x%X" % CCAlevel
+        print "  IRQ Enable regr 406004: 0x%X" % IRQenables
+        print "  DataRate regr 401004: 0x%X" % DataRate
+
+        # Ensure enabling power compensation
+        (status, null) = TX.set_power_comp_enable(1)
+
+        # Disable DFS and TPM
+        if (module_supports_tpm):
+            (status, null) = TX.dfs_override(5)
+            (status, null) = TX.set_transmit_power(defpwr)
+        else: # no TPM, just disable DFS engine
+            (status, null) = TX.dfs_override(1)
 
-    # -------------------------------------------------------
-    # Set up Summit device (one-time)
-    # -------------------------------------------------------
-    gc_addrs = [0x4089A0,
-                0x4089A4,
-                0x4089A8,
-                0x4089AC,
-                0x4089B0,
-                0x4089B4,
-                0x4089B8,
-                0x4089BC]
-
-    filename = 'txpo_%s.txt' % (TX['mac'].replace(':','-'))
-
-    if (TIMING_INFO):
-        print("Initiating comm with the Summit module at %s" % strftime("%m/%d/%Y %H:%M:%S",localtime()))
-
-    # For both masters and slaves...
-    TX.wr(IRQ_EN_REG, 0x00) # IRQ enable reg - disable interrupts
-    TX.wr(BASEBAND_CCA_CTL_REG, 0x00) # CCA level reg - set CCA level
-
-    if (modID in sdf.olympus_modules): # if it's a Master
-        TX.wr(TXVECTOR_RATE_REG, 0x07) # Set data rate to 18Mb/s
-    else: # it's a Slave
-        TX.wr(TXVECTOR_RATE_REG, 0x0D) # Set data rate to 6Mb/s
-
-    # Read and report the settings of the Summit device
-    (status, CCAlevel) = TX.rd(BASEBAND_CCA_CTL_REG)
-    if(status != 0x01):
-        print dec.decode_error_status(status)
-    print "  CCA Level regr 408840: 0x%X" % CCAlevel
-
-    (status, IRQenables) = TX.rd(IRQ_EN_REG)
-    if(status != 0x01):
-        print dec.decode_error_status(status)
-    print "  IRQ Enable regr 406004: 0x%X" % IRQenables
-
-    (status, DataRate) = TX.rd(TXVECTOR_RATE_REG)
-    if(status != 0x01):
-        print dec.decode_error_status(status)
-    print "  DataRate regr 401004: 0x%X" % DataRate
-
-    # Ensure enabling power compensation
-    (status, null) = TX.set_power_comp_enable(1)
-
-    # Disable DFS and TPM
-    if (module_supports_tpm):
-        (status, null) = TX.dfs_override(5)
-        (status, null) = TX.set_transmit_power(defpwr)
-    else: # no TPM, just disable DFS engine
-        (status, null) = TX.dfs_override(1)
-
-    with open(filename, 'w') as f:
         headings = "datetime, MAC, channel, temp, txgc, txpo"
         if (DUMP_PDOUT):
             headings = headings + ", pdout"
         if (DUMP_TXGC_REGS):
             headings = headings + ", gc_index, gc0, gc1, gc2, gc3, gc4, gc5, gc6, gc7"
+        if (ADAPTIVE_MEASURE):
+            headings = headings + ", nreadings, ci95, packets"
 
-        print headings
-        f.write("%s\n" % headings)
-
-        for ch in range(8,35):
-            # Channel-dependent power meter setup
-            # Not implemented yet...
+        run = open_run('txpo', TX['mac'], modID, fwver, path=filename)
+        with QueuedResultWriter(ResultWriter(results_path(filename), headings.split(", "),
+                                             script='txpo', csv_path=filename, run=run)) as results:
+            print_line(headings)
 
-            # Channel-dependent Summit device setup
-            TX.set_radio_channel(0, ch)
+            # Stage 1: channel-dependent Summit device setup and register reads
+            def setup(ch):
+                # Channel-dependent power meter setup
+                # Not implemented yet...
 
-            # Get temp, power, txgc, and pdout; report values
-            # Get the temperature
-            (status, temp) = TX.temperature()
+                TX.set_radio_channel(0, ch)
 
-            # Get TXGC value
-            (status, gc_index) = TX.rd(TXVECTOR_POWER_REG)
-            if(status == 0x01):
-                (status, txgc) = TX.rd(gc_addrs[gc_index])
-                if(status != 0x01):
-                    print dec.decode_error_status(status)
-            else:
-                print dec.decode_error_status(status)
+                # Get temp, power, txgc, and pdout; report values
+                # Get the temperature
+                (status, temp) = TX.temperature()
 
-            # Get values from the TX_PWR registers if applicable
-            if (DUMP_TXGC_REGS):
+                # Get TXGC value, and the values from the TX_PWR registers if
+                # applicable (in the same batch; txgc is one of them)
+                txgc = None
                 gc_val = []
-                for reg_idx in range(8):
-                    (status, val) = TX.rd(gc_addrs[reg_idx])
-                    gc_val.append(val)
+                if (DUMP_TXGC_REGS):
+                    regs = rd_batch(TX, [TXVECTOR_POWER_REG] + gc_addrs)
+                    (status, gc_index) = regs[0]
+                    gc_val = [val for (st, val) in regs[1:]]
+                    if(status == 0x01):
+                        (status, txgc) = regs[1 + gc_index]
+                        if(status != 0x01):
+                            print dec.decode_error_status(status)
+                    else:
+                        print dec.decode_error_status(status)
+                else:
+                    (status, gc_index) = TX.rd(TXVECTOR_POWER_REG)
+                    if(status == 0x01):
+                        (status, txgc) = TX.rd(gc_addrs[gc_index])
+                        if(status != 0x01):
+                            print dec.decode_error_status(status)
+                    else:
+                        print dec.decode_error_status(status)
+
+                return {'temp': temp, 'gc_index': gc_index, 'txgc': txgc, 'gc_val': gc_val}
+
+            # Stage 2: device reads after transmitting, still on the same channel
+            def post_tx(ch, state):
+                # Get the pdout value
+                if (DUMP_PDOUT):
+                    (status, pdout) = TX.get_pdout(9000, 32)
+                    #print "  pdout: 0x%X" % pdout
+                    state['pdout'] = pdout
+                return state
+
+            # Stage 3: average the power readings and format the row
+            def make_rows(ch, state, data):
+                avg = data.trimmed_mean()
+
+                time_now = strftime("%m/%d/%Y %H:%M:%S",localtime())
+
+                # Let the part cool down?
+                #time.sleep(5)
+
+                outputs = (time_now, TX['mac'], ch, state['temp'], state['txgc'], avg)
+                fmt_str = "%s, %s, %d, %d, %d, %r"
+
+                if (DUMP_PDOUT):
+                    outputs = outputs + (state['pdout'],)
+                    fmt_str = fmt_str + ", %d"
+
+                if (DUMP_TXGC_REGS):
+                    outputs = outputs + (state['gc_index'],) + tuple(state['gc_val'][0:8])
+                    fmt_str = fmt_str + ", %d, %d, %d, %d, %d, %d, %d, %d, %d"
+
+                if (ADAPTIVE_MEASURE):
+                    outputs = outputs + (data.count, data.ci95(), data.packets_sent)
+                    fmt_str = fmt_str + ", %d, %.4f, %d"
+
+                return [(fmt_str % outputs, outputs)]
 
             # Transmit and take power measurements
-
-            if (TIMING_INFO):
-                print("Starting tx_measure at %s" % strftime("%m/%d/%Y %H:%M:%S",localtime()))
-            data = tx_measure(dev=TX, power_meter=PM, packet_count=5000)
-            if (TIMING_INFO):
-                print("Finished tx_measure at %s" % strftime("%m/%d/%Y %H:%M:%S",localtime()))
-            data = map(float, data)
-            if(len(data) > 2):
-                avg = sum(data[1:-1])/float(len(data[1:-1]))
-            elif(len(data) > 1):
-                avg = float(data[0])
-            else:
-                avg = 0
-
-            # Get the pdout value
-            if (DUMP_PDOUT):
-                (status, pdout) = TX.get_pdout(9000, 32)
-                #print "  pdout: 0x%X" % pdout
-
-            time_now = strftime("%m/%d/%Y %H:%M:%S",localtime())
-
-            # Let the part cool down?
-            #time.sleep(5)
-
-            outputs = (time_now, TX['mac'], ch, temp, txgc, avg)
-            fmt_str = "%s, %s, %d, %d, %d, %r"
-
-            if (DUMP_PDOUT):
-                outputs = outputs + (pdout,)
-                fmt_str = fmt_str + ", %d"
-
-            if (DUMP_TXGC_REGS):
-                outputs = outputs + (gc_index,) + tuple(gc_val[0:8])
-                fmt_str = fmt_str + ", %d, %d, %d, %d, %d, %d, %d, %d, %d"
-
-            out_str = fmt_str % outputs
-            print out_str
-            f.write("%s\n" % out_str)
-            f.flush()
-
-    # Reenable power compensation
-    (status, null) = TX.set_power_comp_enable(1)
-    # -------------------------------------------------------
-    # End main program flow description
-    # -------------------------------------------------------
+            buffered = None
+            if (BUFFERED_READINGS):
+                buffered = BufferedReadout(PM, readings=BUFFERED_READINGS, port=meter_port)
+            sweep = ChannelSweep(TX, PM, setup, post_tx, make_rows,
+                packet_count=5000, pipelined=PIPELINED_SWEEP, adaptive=ADAPTIVE_MEASURE,
+                workers=workers, buffered=buffered)
+
+            for (out_str, outputs) in sweep.run(range(8,35)):
+                with timer.span('file_write'):
+                    results.add(outputs, echo=out_str)
+
+        # Reenable power compensation
+        (status, null) = TX.set_power_comp_enable(1)
+
+        if (USE_REG_CACHE):
+            print "  %s" % TX.stats()
+
+        if (TIMING_INFO):
+            print("Sweep took %.1fs (%s)" % (sweep.elapsed,
+                "pipelined" if PIPELINED_SWEEP else "sequential"))
+            print timer.report()
+            trace_file = 'txpo_%s_trace.json' % (TX['mac'].replace(':','-'))
+            timer.write_chrome_trace(trace_file)
+            print "Trace written to %s" % trace_file
+        # -------------------------------------------------------
+        # End main program flow description
+        # -------------------------------------------------------
 
 if __name__ == '__main__':
 
     # Set up logging according to logging.conf
     logging.config.fileConfig('logging.conf')
+    # Log from the background writer thread, not the measurement threads
+    queue_log_handlers()
 
     # Set up devices
     pi_bsp = PiBSP()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Background writer: file and console output off the measurement threads
+
+One daemon thread (BackgroundWriter) does the writing for everything queued
+to it. Callers only put an item on a queue and carry on, so the power meter
+and device threads never wait on the disk or the console.
+
+    QueueHandler(target)     - logging handler passing records to target
+                               (any handler) from the writer thread
+    QueuedFileHandler(file)  - logging handler writing records to file; for
+                               logging.conf (class=mg_writer.QueuedFileHandler)
+    queue_log_handlers()     - swap a logger's handlers for QueueHandlers
+    QueuedResultWriter(rw)   - feeds an mg_results.ResultWriter, and echoes
+                               each row to the console
+    print_line(line)         - print a line from the writer thread
+
+The writer takes whatever has queued up in one go and writes it, then
+flushes what it wrote, so a burst of records costs one write per file. Every
+SYNC_INTERVAL seconds it also makes the files durable: log files are
+fsynced and result writers commit. drain() (and closing a handler or result
+writer) waits until everything queued so far is written and synced. The
+process-wide writer is stopped at exit, after writing out its queue; from
+then on anything submitted is written on the caller's thread.
+
+A sink that fails keeps its first error. The error is printed to stderr,
+and QueuedResultWriter.close() raises it.
+"""
+
+import os
+import abc
+import sys
+import time
+import atexit
+import logging
+import threading
+import traceback
+import Queue
+
+# Seconds between fsyncs/commits of what has been written
+SYNC_INTERVAL = 1.0
+# Most items written between two flushes
+MAX_BATCH = 512
+
+class Sink(object):
+    """Somewhere the writer thread writes to (abstract)
+
+    write() takes one queued item; flush() runs after each batch that wrote
+    to the sink, sync() every SYNC_INTERVAL and on drain. A subclass must
+    implement write(); the others do nothing by default.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    error = None
+
+    @abc.abstractmethod
+    def write(self, item):
+        """Write one queued item"""
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+class _Drain(object):
+    def __init__(self):
+        self.done = threading.Event()
+
+class _Close(object):
+    def __init__(self, sink):
+        self.sink = sink
+
+_STOP = (None, None)
+
+
+class BackgroundWriter(threading.Thread):
+    """The thread writing queued items to their sinks"""
+    def __init__(self, sync_interval=None, max_batch=MAX_BATCH):
+        super(BackgroundWriter, self).__init__(name='BackgroundWriter')
+        self.daemon = True
+        self.sync_interval = SYNC_INTERVAL if sync_interval is None else sync_interval
+        self.max_batch = max_batch
+        self.queue = Queue.Queue()
+        self.items = 0
+        self.batches = 0
+        self.syncs = 0
+        self._unsynced = set()
+        self._stopped = False
+        self._stop_lock = threading.Lock()
+
+    def submit(self, sink, item):
+        """Queue item for sink; never blocks. Once the writer has stopped the
+        item is written on the caller's thread instead."""
+        with self._stop_lock:
+            if(not self._stopped):
+                self.queue.put((sink, item))
+                return
+        self._write([(sink, item)])
+        self._sync()
+
+    def close_sink(self, sink):
+        """Queue closing sink, after what is already queued for it"""
+        self.submit(_Close(sink), None)
+
+    def drain(self, timeout=None):
+        """Wait until everything queued so far is written and synced"""
+        marker = _Drain()
+        with self._stop_lock:
+            if(self._stopped or not self.is_alive()):
+                return True
+            self.queue.put((marker, None))
+        return marker.done.wait(timeout)
+
+    def stop(self):
+        """Write out everything queued and end the thread"""
+        if(self.is_alive()):
+            self.queue.put(_STOP)
+            self.join()
+
+    def run(self):
+        # Bound here: at interpreter shutdown the module globals go to None
+        empty = Queue.Empty
+        next_sync = time.time() + self.sync_interval
+        stop = False
+        while(not stop):
+            try:
+                first = self.queue.get(timeout=max(0.0, next_sync - time.time()))
+            except empty:
+                first = None
+            batch = [first] if first is not None else []
+            while(batch and len(batch) < self.max_batch):
+                try:
+                    batch.append(self.queue.get_nowait())
+                except empty:
+                    break
+            if(_STOP in batch):
+                batch.remove(_STOP)
+                with self._stop_lock:
+                    self._stopped = stop = True
+                # Whatever got queued before submit() saw the flag
+                while(True):
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except empty:
+                        break
+            if(batch):
+                self.batches += 1
+            drains = self._write(batch)
+            if(drains or stop or time.time() >= next_sync):
+                self._sync()
+                next_sync = time.time() + self.sync_interval
+            for marker in drains:
+                marker.done.set()
+
+    def _write(self, batch):
+        written = []
+        drains = []
+        for (sink, item) in batch:
+            if(isinstance(sink, _Drain)):
+                drains.append(sink)
+                continue
+            if(isinstance(sink, _Close)):
+                self._flush(written)
+                written = []
+                self._call(sink.sink, sink.sink.sync)
+                self._call(sink.sink, sink.sink.close)
+                self._unsynced.discard(sink.sink)
+                continue
+            self.items += 1
+            if(self._call(sink, sink.write, item) and sink not in written):
+                written.append(sink)
+        self._flush(written)
+        return drains
+
+    def _flush(self, sinks):
+        for sink in sinks:
+            self._call(sink, sink.flush)
+            self._unsynced.add(sink)
+
+    def _sync(self):
+        if(self._unsynced):
+            self.syncs += 1
+        for sink in self._unsynced:
+            self._call(sink, sink.sync)
+        self._unsynced = set()
+
+    def _call(self, sink, fn, *args):
+        try:
+            fn(*args)
+            return True
+        except Exception:
+            if(sink.error is None):
+                sink.error = sys.exc_info()
+            try:
+                sys.stderr.write("BackgroundWriter: %s failed\n" % type(sink).__name__)
+                traceback.print_exc(file=sys.stderr)
+            except Exception:
+                pass
+            return False
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """The process-wide BackgroundWriter, started on first use"""
+    global _writer
+    with _writer_lock:
+        if(_writer is None):
+            _writer = BackgroundWriter()
+            _writer.start()
+            atexit.register(_writer.stop)
+        return _writer
+
+
+class ConsoleSink(Sink):
+    """Lines to sys.stdout (looked up at write time)"""
+    def write(self, line):
+        sys.stdout.write("%s\n" % line)
+
+    def flush(self):
+        sys.stdout.flush()
+
+_console = ConsoleSink()
+
+def print_line(line, writer=None):
+    """print line, from the writer thread"""
+    (writer or get_writer()).submit(_console, line)
+
+
+def _prepare(record):
+    """Resolve a record's message and traceback now, so it can be formatted
+    later on another thread"""
+    record.msg = record.getMessage()
+    record.args = None
+    if(record.exc_info):
+        record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+        record.exc_info = None
+    return record
+
+class _HandlerSink(Sink):
+    def __init__(self, target):
+        self.target = target
+
+    def write(self, record):
+        if(record.levelno >= self.target.level):
+            self.target.handle(record)
+
+    def flush(self):
+        self.target.flush()
+
+    def sync(self):
+        if(isinstance(self.target, logging.FileHandler) and self.target.stream is not None):
+            os.fsync(self.target.stream.fileno())
+
+    def close(self):
+        self.target.close()
+
+class QueueHandler(logging.Handler):
+    """Logging handler that hands records to target on the writer thread"""
+    def __init__(self, target, writer=None):
+        logging.Handler.__init__(self)
+        self.writer = writer or get_writer()
+        self._sink = _HandlerSink(target)
+        self._closed = False
+
+    def emit(self, record):
+        try:
+            self.writer.submit(self._sink, _prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.writer.drain()
+
+    def close(self):
+        # logging.shutdown() closes handlers a script already closed
+        if(not self._closed):
+            self._closed = True
+            self.writer.close_sink(self._sink)
+            self.writer.drain()
+        logging.Handler.close(self)
+
+class _LogFileSink(Sink):
+    def __init__(self, handler, filename, mode):
+        self.handler = handler
+        self.stream = open(filename, mode)
+
+    def write(self, record):
+        self.stream.write("%s\n" % self.handler.format(record))
+
+    def flush(self):
+        self.stream.flush()
+
+    def sync(self):
+        os.fsync(self.stream.fileno())
+
+    def close(self):
+        self.stream.close()
+
+class QueuedFileHandler(QueueHandler):
+    """FileHandler whose writes, flushes and fsyncs happen on the writer thread
+
+    Formatting is done there too, with this handler's formatter.
+    """
+    def __init__(self, filename, mode='a', writer=None):
+        logging.Handler.__init__(self)
+        self.baseFilename = os.path.abspath(filename)
+        self.writer = writer or get_writer()
+        self._sink = _LogFileSink(self, filename, mode)
+        self._closed = False
+
+def queue_log_handlers(logger=None, writer=None):
+    """Move a logger's handlers (the root logger's by default) onto the
+    writer thread"""
+    if(logger is None or isinstance(logger, basestring)):
+        logger = logging.getLogger(logger)
+    for handler in list(logger.handlers):
+        if(isinstance(handler, QueueHandler)):
+            continue
+        logger.removeHandler(handler)
+        logger.addHandler(QueueHandler(handler, writer))
+
+
+class _ResultSink(Sink):
+    def __init__(self, results):
+        self.results = results
+
+    def write(self, values):
+        self.results.add(values)
+
+    def sync(self):
+        self.results.commit()
+
+class QueuedResultWriter(object):
+    """An mg_results.ResultWriter written to from the writer thread
+
+    add() queues a row and, with echo, the line to print for it. close()
+    waits for the queued rows, closes the ResultWriter (and its CSV) and
+    raises the first error the writer thread had with it, if any.
+    """
+    def __init__(self, results, writer=None):
+        self.results = results
+        self.writer = writer or get_writer()
+        self._sink = _ResultSink(results)
+        self._closed = False
+
+    def add(self, values, echo=None):
+        if(echo is not None):
+            self.writer.submit(_console, echo)
+        self.writer.submit(self._sink, values)
+
+    def close(self):
+        if(self._closed):
+            return
+        self._closed = True
+        self.writer.drain()
+        self.results.close()
+        if(self._sink.error is not None):
+            (exc_type, exc, tb) = self._sink.error
+            raise exc_type, exc, tb
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if(exc_type is None):
+            self.close()
+        else:
+            # Keep the exception in flight; still save what was measured
+            try:
+                self.close()
+            except Exception:
+                pass
+        return False
@@ -0,0 +1,7 @@
+"""Tests for the Summit TX power scripts, run against the simulator (mg_sim)
+
+    python -m unittest discover tests
+
+Tests of modules that import pysummit or rfmeter are skipped where those
+aren't installed.
+"""
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mg_results import ResultWriter
+try:
+    import numpy
+    import mg_analysis
+except ImportError:
+    numpy = None
+
+MACS = ["00:25:1d:00:00:01", "00:25:1d:00:00:02"]
+CHANNELS = [8, 9, 10, 11, 12]
+WHEN = "10/17/2026 12:00:%02d"
+
+def name(mac):
+    return mac.replace(':', '-')
+
+def txpo_of(pdout):
+    # Every module's detector on the same line
+    return 0.025 * pdout - 20.0
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class AnalysisTest(unittest.TestCase):
+    """The fits on files whose numbers lie on known lines"""
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        # txpo sweeps at 25C and 85C; pdout, and so txpo, rises 1 count per C
+        for temp in [25, 85]:
+            run_dir = os.path.join(self.tmp, 'run_%dC' % temp)
+            os.makedirs(run_dir)
+            for (m, mac) in enumerate(MACS):
+                with open(os.path.join(run_dir, 'txpo_%s.txt' % name(mac)), 'w') as f:
+                    f.write("datetime, MAC, channel, temp, txgc, txpo, pdout\n")
+                    for (i, ch) in enumerate(CHANNELS):
+                        pdout = 1000 + 10 * ch + 40 * m + (temp - 25)
+                        f.write("%s, %s, %d, %d, %d, %r, %d\n" % (WHEN % i, mac, ch, temp, 42,
+                            txpo_of(pdout), pdout))
+        # A steptxgc sweep as an .mgr file: 0.25 dB per step, and a TXGC
+        # outside TXGC_RANGE that is off the line
+        columns = ['datetime', 'MAC', 'channel', 'temp', 'txgc', 'txpo', 'pdout']
+        path = os.path.join(self.tmp, 'steptxgc_%s.mgr' % name(MACS[0]))
+        with ResultWriter(path, columns, script='steptxgc') as results:
+            for ch in CHANNELS:
+                for txgc in [9, 30, 56, 60]:
+                    txpo = 0.25 * txgc + 0.1 * ch if txgc <= 56 else 99.0
+                    results.add((WHEN % 0, MACS[0], ch, 25, txgc, txpo, None))
+        # Repeated pdout reads: variance 4 with nsamples 4, 1 with 8
+        with open(os.path.join(self.tmp, 'get_pdout_parms_%s.csv' % name(MACS[1])), 'w') as f:
+            f.write("datetime, MAC, channel, pdout, delay, nsamples\n")
+            for (nsamples, reads) in [(4, [10, 12, 14]), (8, [10, 11, 12])]:
+                for pdout in reads:
+                    f.write("%s, %s, %d, %d, %d, %d\n" % (WHEN % 0, MACS[1], 8, pdout, 4000,
+                        nsamples))
+        self.table = mg_analysis.ResultTable.load([os.path.join(self.tmp, 'run_25C'),
+            os.path.join(self.tmp, 'run_85C'), self.tmp])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_load(self):
+        self.assertEqual(len(self.table.files), 6)
+        self.assertEqual(self.table.macs, MACS)
+        self.assertEqual(len(self.table), 2 * 2 * 5 + 5 * 4 + 6)
+        self.assertEqual(int(self.table.kind_mask('steptxgc').sum()), 20)
+        self.assertEqual(int(self.table.kind_mask('pdout_timing').sum()), 6)
+
+    def test_txpo_pdout_fits(self):
+        fits = mg_analysis.txpo_pdout_fits(self.table)
+        # pdout is empty in the steptxgc rows: only the txpo sweep is fitted
+        self.assertEqual(list(fits['kind']), ['txpo'] * len(CHANNELS))
+        self.assertEqual(list(fits['channel']), CHANNELS)
+        self.assertEqual(list(fits['modules']), [2] * len(CHANNELS))
+        self.assertEqual(list(fits['n']), [4] * len(CHANNELS))
+        for i in range(len(CHANNELS)):
+            self.assertAlmostEqual(fits['slope_db_per_count'][i], 0.025, places=9)
+            self.assertAlmostEqual(fits['intercept_dbm'][i], -20.0, places=6)
+            self.assertAlmostEqual(fits['r2'][i], 1.0, places=9)
+            self.assertAlmostEqual(fits['rms_db'][i], 0.0, places=6)
+
+    def test_txgc_slopes(self):
+        slopes = mg_analysis.txgc_slopes(self.table)
+        steptxgc = slopes['kind'] == 'steptxgc'
+        self.assertEqual(list(slopes['channel'][steptxgc]), CHANNELS)
+        self.assertEqual(set(slopes['MAC'][steptxgc]), set([MACS[0]]))
+        self.assertEqual(list(slopes['n'][steptxgc]), [3] * len(CHANNELS))
+        self.assertEqual(list(slopes['txgc_hi'][steptxgc]), [56] * len(CHANNELS))
+        for (ch, slope, intercept) in zip(CHANNELS, slopes['slope_db_per_step'][steptxgc],
+                                          slopes['intercept_dbm'][steptxgc]):
+            self.assertAlmostEqual(slope, 0.25, places=9)
+            self.assertAlmostEqual(intercept, 0.1 * ch, places=6)
+        # The txpo sweep keeps one TXGC: there is no slope to fit
+        self.assertFalse((slopes['kind'] == 'txpo').any())
+
+    def test_temp_drift(self):
+        drift = mg_analysis.temp_drift(self.table)
+        self.assertEqual(set(drift['kind']), set(['txpo']))
+        self.assertEqual(len(drift['MAC']), len(MACS) * len(CHANNELS))
+        for i in range(len(drift['MAC'])):
+            self.assertEqual(drift['n'][i], 2)
+            self.assertEqual((drift['temp_lo'][i], drift['temp_hi'][i]), (25, 85))
+            self.assertEqual(drift['txgc'][i], 42)
+            self.assertAlmostEqual(drift['drift_db_per_c'][i], 0.025, places=9)
+
+    def test_pdout_variance(self):
+        (detail, summary) = mg_analysis.pdout_variance(self.table)
+        self.assertEqual(list(detail['nsamples']), [4, 8])
+        self.assertEqual(list(detail['n']), [3, 3])
+        self.assertEqual(list(detail['pdout_mean']), [12.0, 11.0])
+        self.assertEqual(list(detail['pdout_var']), [4.0, 1.0])
+        self.assertEqual(list(summary['delay']), [4000, 4000])
+        self.assertEqual(list(summary['nsamples']), [4, 8])
+        self.assertEqual(list(summary['mean_var']), [4.0, 1.0])
+        self.assertEqual(list(summary['median_var']), [4.0, 1.0])
+
+    def test_write_table(self):
+        path = os.path.join(self.tmp, 'fits.csv')
+        mg_analysis.write_table(path, mg_analysis.txpo_pdout_fits(self.table))
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "kind, channel, modules, n, slope_db_per_count, "
+            "intercept_dbm, r2, rms_db")
+        self.assertEqual(lines[1].split(", ")[:5], ['txpo', '8', '2', '4', '0.025'])
+
+if __name__ == '__main__':
+    unittest.main()
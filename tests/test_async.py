@@ -0,0 +1,152 @@
+import os
+import sys
+import shutil
+import logging
+import StringIO
+import tempfile
+import unittest
+import mg_resultdb
+from mg_results import ResultFile
+try:
+    import mg_txpo_test
+    from mg_async import AsyncWorkers
+    from mg_meter import BufferedReadout
+    from mg_measure import MeasurementWorkers, AdaptiveStop, tx_measure, start_tx_measure
+    from mg_sim import SimStation, SimSummitDevice, SimE4418B, SimTiming, run_main
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+class FailingDevice(object):
+    """A device whose transmit_packets raises, or returns status"""
+    def __init__(self, dev, status=None):
+        self.dev = dev
+        self.status = status
+
+    def __getattr__(self, name):
+        return getattr(self.dev, name)
+
+    def transmit_packets(self, packet_count):
+        if(self.status is None):
+            raise IOError("serial timeout")
+        return (self.status, None)
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class AsyncWorkersTest(unittest.TestCase):
+    def setUp(self):
+        self.timing = SimTiming(scale=0.02, jitter=0)
+        self.dev = SimSummitDevice('00:25:1d:00:00:01', timing=self.timing)
+        self.workers = AsyncWorkers(max_workers=2)
+
+    def tearDown(self):
+        self.workers.shutdown()
+
+    def meter(self, **kwargs):
+        return SimE4418B(air=self.dev.air, timing=self.timing, **kwargs)
+
+    def test_reads_while_transmitting(self):
+        stats = tx_measure(self.dev, self.meter(noise=0.0), 5000, workers=self.workers)
+        self.assertEqual(stats.packets_sent, 5000)
+        self.assertGreater(stats.count, 1)
+        self.assertEqual(stats.rejected(), 0)
+
+    def test_adaptive_stops_early(self):
+        stats = tx_measure(self.dev, self.meter(noise=0.0), 5000, workers=self.workers,
+            adaptive=AdaptiveStop(min_samples=2, chunk_packets=500))
+        self.assertLess(stats.packets_sent, 5000)
+        self.assertEqual(stats.packets_sent % 500, 0)
+
+    def test_buffered(self):
+        meter = self.meter(buffered=True)
+        buffered = BufferedReadout(meter, readings=5)
+        stats = tx_measure(self.dev, meter, 5000, workers=self.workers, buffered=buffered)
+        self.assertTrue(buffered.supported)
+        self.assertEqual(stats.packets_sent, 5000)
+        self.assertEqual(stats.count, 5)
+
+    def test_unbuffered_meter_falls_back(self):
+        meter = self.meter()
+        buffered = BufferedReadout(meter, readings=5)
+        handler = ListHandler()
+        buffered.logger.addHandler(handler)
+        try:
+            stats = tx_measure(self.dev, meter, 5000, workers=self.workers,
+                buffered=buffered)
+        finally:
+            buffered.logger.removeHandler(handler)
+        self.assertFalse(buffered.supported)
+        self.assertEqual(len(handler.messages), 1)
+        # Sampled with FETCH? per reading instead
+        self.assertGreater(stats.count, 1)
+        self.assertEqual(stats.packets_sent, 5000)
+
+    def test_device_error_comes_out(self):
+        meas = start_tx_measure(FailingDevice(self.dev), self.meter(), 5000,
+            workers=self.workers)
+        self.assertRaises(IOError, meas.wait_tx_done, 5.0)
+        self.assertRaises(IOError, meas.result, 5.0)
+        # The workers are still good for the next job
+        stats = tx_measure(self.dev, self.meter(), 500, workers=self.workers)
+        self.assertEqual(stats.packets_sent, 500)
+
+    def test_failed_transmit_is_logged(self):
+        handler = ListHandler()
+        logger = logging.getLogger('measure')
+        logger.addHandler(handler)
+        try:
+            stats = tx_measure(FailingDevice(self.dev, 0x02), self.meter(), 5000,
+                workers=self.workers)
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(stats.packets_sent, 0)
+        self.assertEqual(len(handler.messages), 1)
+        self.assertIn("transmit_packets", handler.messages[0])
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class AsyncSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        shutil.copy(os.path.join(os.path.dirname(mg_resultdb.__file__), 'pm_offset.dat'),
+            self.tmp)
+        os.chdir(self.tmp)
+        self.saved = mg_resultdb.RESULT_DB
+        mg_resultdb.RESULT_DB = ''
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        mg_resultdb.RESULT_DB = self.saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def sweep_rows(self, workers):
+        # No jitter or meter noise: the same station gives the same numbers
+        station = SimStation(timing=SimTiming(scale=0.02, jitter=0))
+        station.meter.noise = 0.0
+        try:
+            run_main(mg_txpo_test, station, None, None, [], 'sim', workers)
+        finally:
+            workers.shutdown()
+        path = 'txpo_%s.mgr' % station.TX['mac'].replace(':', '-')
+        return [row[1:5] + [round(row[5], 6)] + row[6:] for row in ResultFile(path).rows()]
+
+    def test_same_rows_as_the_thread_workers(self):
+        threads = self.sweep_rows(MeasurementWorkers())
+        coroutines = self.sweep_rows(AsyncWorkers())
+        self.assertEqual([row[1] for row in coroutines], range(8, 35))
+        self.assertEqual(coroutines, threads)
+
+if __name__ == '__main__':
+    unittest.main()
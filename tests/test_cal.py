@@ -0,0 +1,105 @@
+import os
+import sys
+import shutil
+import logging
+import StringIO
+import tempfile
+import unittest
+try:
+    from mg_cal import CalJournal, run_cal
+    from mg_calstates import rcs, rcss, RADIOCAL_OK, STATE_FIRST, STATE_FINISHED, STATE_IDLE
+    from mg_measure import CalReadings
+    from mg_sim import SimSummitDevice, SimE4418B, SimTiming
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+class Interrupted(object):
+    """A device whose link fails when the session gets to state fail_at"""
+    def __init__(self, dev, fail_at):
+        self.dev = dev
+        self.fail_at = fail_at
+
+    def __getitem__(self, key):
+        return self.dev[key]
+
+    def invoke_radio_cal_state(self, state, measurement):
+        if(state == self.fail_at):
+            raise IOError("serial timeout")
+        return self.dev.invoke_radio_cal_state(state, measurement)
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.log = ListHandler()
+        logging.getLogger('run_cal').addHandler(self.log)
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cal_journal.jsonl')
+        timing = SimTiming(scale=0.002, jitter=0)
+        self.dev = SimSummitDevice('00:25:1d:00:00:01', timing=timing)
+        self.meter = SimE4418B(air=self.dev.air, timing=timing)
+
+    def tearDown(self):
+        logging.getLogger('run_cal').removeHandler(self.log)
+        shutil.rmtree(self.tmp)
+
+    def session(self, dev):
+        readings = CalReadings(self.meter, "MEAS?")
+        (stdout, sys.stdout) = (sys.stdout, StringIO.StringIO())
+        try:
+            return run_cal(dev, readings, CalJournal(self.path))
+        finally:
+            sys.stdout = stdout
+            readings.stop()
+
+    def test_resume_replays_the_journal(self):
+        fail_at = rcss["RADIOCALSTATE_F1_P1"]
+        self.assertRaises(IOError, self.session, Interrupted(self.dev, fail_at))
+        first = list(self.dev.cal_log)
+        # F0 B5-B0 and F0 P0-P2 were completed; F1 P0 was the last accepted
+        self.assertEqual(CalJournal(self.path).resume_point(), rcss["RADIOCALSTATE_F0_P2"])
+
+        (status, state, measurement) = self.session(self.dev)
+        self.assertEqual((status, state), (RADIOCAL_OK, STATE_IDLE))
+        log = self.dev.cal_log
+        # Every state since BEGIN, in order, none skipped
+        self.assertEqual([s for (s, m) in log], range(STATE_FIRST, STATE_FINISHED + 1))
+        # and the firmware got the first session's readings up to F1 P0
+        replayed = [entry for entry in first if entry[0] <= rcss["RADIOCALSTATE_F1_P0"]]
+        self.assertEqual(log[:len(replayed)], replayed)
+        self.assertTrue(all(m is not None for (s, m) in replayed[1:]))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.log.messages, [])
+
+    def test_refused_replay_starts_over(self):
+        self.assertRaises(IOError, self.session,
+            Interrupted(self.dev, rcss["RADIOCALSTATE_F1_P1"]))
+        # The firmware won't take the replay: the session runs from BEGIN
+        refuse = Interrupted(self.dev, None)
+        calls = []
+
+        def invoke(state, measurement):
+            calls.append(state)
+            if(len(calls) == 3):
+                return (rcs["RADIOCAL_INVALID_STATE_TRANSITION"], state)
+            return self.dev.invoke_radio_cal_state(state, measurement)
+        refuse.invoke_radio_cal_state = invoke
+        (status, state, measurement) = self.session(refuse)
+        self.assertEqual((status, state), (RADIOCAL_OK, STATE_IDLE))
+        self.assertEqual([s for (s, m) in self.dev.cal_log],
+            range(STATE_FIRST, STATE_FINISHED + 1))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(len(self.log.messages), 1)
+        self.assertTrue(self.log.messages[0].startswith("Firmware refused the replay"))
+
+if __name__ == '__main__':
+    unittest.main()
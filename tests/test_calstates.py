@@ -0,0 +1,107 @@
+import unittest
+from mg_calstates import StateTable, RADIOCAL_STATES, RADIOCAL_STATUS, rcs, rcss, \
+    RADIOCAL_OK, STATE_IDLE, STATE_BEGIN, STATE_FIRST, STATE_FINISHED
+
+class Enumish(object):
+    """The list lookup the cal scripts used before StateTable"""
+    def __init__(self, data):
+        assert(type(data) == type([]))
+        self.data = data
+
+    def __getitem__(self, index):
+        if(type(index) == type("")):
+            if(index in self.data):
+                return self.data.index(index)
+            else:
+                return None
+        elif(type(index) == type(7)):
+            if(index < len(self.data)):
+                return self.data[index]
+            else:
+                return None
+
+def firmware_states():
+    """The cal states in firmware order: a B5..B0 search at channels 0, 7, 8
+    and 19, and P0..P2 at every channel"""
+    names = ["IDLE", "BEGIN"]
+    for ch in range(35):
+        if(ch in (0, 7, 8, 19)):
+            names += ["F%d_B%d" % (ch, step) for step in range(5, -1, -1)]
+        names += ["F%d_P%d" % (ch, step) for step in range(3)]
+    names += ["FINISHED", "MAX"]
+    return ["RADIOCALSTATE_" + name for name in names]
+
+
+class StateTableTest(unittest.TestCase):
+    def test_firmware_order(self):
+        self.assertEqual(list(rcss.names), firmware_states())
+        self.assertEqual((RADIOCAL_OK, STATE_IDLE, STATE_BEGIN, STATE_FIRST),
+            (0, 0, 1, 2))
+        self.assertEqual((STATE_FINISHED, len(rcss)), (131, 133))
+
+    def test_lookups_match_the_lists(self):
+        for (table, names) in [(rcs, RADIOCAL_STATUS), (rcss, RADIOCAL_STATES)]:
+            old = Enumish(names)
+            for (i, name) in enumerate(names):
+                self.assertEqual(table[name], old[name])
+                self.assertEqual(table[name], i)
+                self.assertEqual(table[i], old[i])
+                self.assertEqual(table[i], name)
+
+    def test_unknown_keys(self):
+        for (table, names) in [(rcs, RADIOCAL_STATUS), (rcss, RADIOCAL_STATES)]:
+            old = Enumish(names)
+            for key in ["RADIOCALSTATE_F35_P0", "radiocal_ok", "", len(names), 1000]:
+                self.assertIsNone(table[key])
+                self.assertIsNone(old[key])
+        # The old list handed back names from the end for negative ids
+        self.assertIsNone(rcss[-1])
+        self.assertEqual(rcs[u"RADIOCAL_OK"], RADIOCAL_OK)
+
+    def test_measurement_boundaries(self):
+        first = rcss.info(STATE_FIRST)
+        self.assertEqual((first.name, first.on_air, first.takes_measurement),
+            ("RADIOCALSTATE_F0_B5", True, False))
+        after = rcss.info(STATE_FIRST + 1)
+        self.assertEqual((after.name, after.on_air, after.takes_measurement),
+            ("RADIOCALSTATE_F0_B4", True, True))
+        last = rcss.info(STATE_FINISHED - 1)
+        self.assertEqual((last.name, last.on_air, last.takes_measurement),
+            ("RADIOCALSTATE_F34_P2", True, True))
+        finished = rcss.info(STATE_FINISHED)
+        self.assertEqual((finished.on_air, finished.takes_measurement, finished.channel),
+            (False, True, None))
+        for state_id in (STATE_IDLE, STATE_BEGIN, STATE_FINISHED + 1):
+            state = rcss.info(state_id)
+            self.assertEqual((state.on_air, state.takes_measurement), (False, False))
+
+    def test_takes_measurement_as_the_old_driver(self):
+        # The old driver invoked every state after BEGIN with a measurement
+        # except F0_B5, and stopped once it reached IDLE again
+        for state in rcss.states:
+            expected = Enumish(RADIOCAL_STATES)["RADIOCALSTATE_F0_B5"] < state.id <= \
+                Enumish(RADIOCAL_STATES)["RADIOCALSTATE_FINISHED"]
+            self.assertEqual(state.takes_measurement, expected, state.name)
+            self.assertEqual(state.on_air, STATE_FIRST <= state.id < STATE_FINISHED,
+                state.name)
+
+    def test_cal_points(self):
+        self.assertEqual(rcss.info(rcss["RADIOCALSTATE_F7_B3"])[2:5], (7, 'B', 3))
+        self.assertEqual(rcss.info(rcss["RADIOCALSTATE_F12_P1"])[2:5], (12, 'P', 1))
+        self.assertEqual(rcss.info(STATE_FINISHED)[2:5], (None, None, None))
+        # F0 B5..B0, F0 P0..P2, F1 P0..P2, ...: one block per channel and kind
+        self.assertEqual(len(rcss.blocks), 4 + 35)
+        self.assertEqual([rcss[i] for i in rcss.blocks[0]],
+            ["RADIOCALSTATE_F0_B%d" % step for step in range(5, -1, -1)])
+        self.assertEqual([rcss[i] for i in rcss.blocks[1]],
+            ["RADIOCALSTATE_F0_P%d" % step for step in range(3)])
+        self.assertEqual(sum(len(block) for block in rcss.blocks), len(rcss) - 4)
+
+    def test_other_tables(self):
+        table = StateTable(["A", "B"])
+        self.assertEqual((table["B"], table[0], table["C"], table[2]), (1, "A", None, None))
+        self.assertEqual([state.on_air for state in table.states], [False, False])
+        self.assertEqual(table.blocks, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import shutil
+import StringIO
+import tempfile
+import unittest
+import mg_resultdb
+from mg_import import import_files
+from mg_results import ResultWriter
+try:
+    import mg_step_txgc_test
+    from mg_sim import SimStation, SimTiming, run_main
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+COLUMNS = ['datetime', 'MAC', 'channel', 'temp', 'txgc', 'txpo', 'pdout']
+MAC = "00:25:1d:00:00:01"
+
+def runs(db):
+    return mg_resultdb.query("SELECT id, script, rows FROM runs ORDER BY id", db=db)
+
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, 'results.db')
+        self.cwd = os.getcwd()
+        self.station = os.path.join(self.tmp, 'station')
+        self.archive = os.path.join(self.tmp, 'archive')
+        os.makedirs(self.station)
+        os.makedirs(self.archive)
+        os.chdir(self.station)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def sweep(self, mac=MAC):
+        """Record a txpo sweep the way the scripts do; returns its file name"""
+        filename = 'txpo_%s.txt' % mac.replace(':', '-')
+        run = mg_resultdb.open_run('txpo', mac, path=filename, db=self.db)
+        with ResultWriter('txpo.mgr', COLUMNS, script='txpo', csv_path=filename,
+                          run=run) as results:
+            for ch in range(8, 12):
+                results.add((time.strftime("%m/%d/%Y %H:%M:%S"), mac, ch, 25, 42,
+                    18.0 + 0.1 * ch, 1200 + ch))
+        return filename
+
+    def test_skips_the_live_run_by_path(self):
+        self.sweep()
+        counts = import_files([self.station], self.db, 1)
+        self.assertEqual((counts['live'], counts['imported']), (1, 0))
+        self.assertEqual(runs(self.db), [(1, 'txpo', 4)])
+
+    def test_skips_a_copy_of_the_live_run(self):
+        filename = self.sweep()
+        shutil.copy(filename, self.archive)
+        os.chdir(self.tmp)
+        counts = import_files([self.archive], self.db, 1)
+        self.assertEqual((counts['live'], counts['imported']), (1, 0))
+        self.assertEqual(runs(self.db), [(1, 'txpo', 4)])
+        # The copy is recorded as the live run's
+        self.assertEqual(mg_resultdb.query("SELECT run_id FROM imports", db=self.db), [(1,)])
+        counts = import_files([self.archive], self.db, 1)
+        self.assertEqual((counts['unchanged'], counts['imported']), (1, 0))
+
+    def test_imports_other_files(self):
+        self.sweep()
+        other = os.path.join(self.archive, 'txpo_00-25-1d-00-00-02.txt')
+        with open(other, 'w') as f:
+            f.write("%s\n" % ", ".join(COLUMNS))
+            f.write("10/17/2025 12:00:00, 00:25:1d:00:00:02, 8, 25, 42, 18.0, 1200\n")
+        # The same MAC a year before the live run
+        earlier = os.path.join(self.archive, 'old', 'txpo_00-25-1d-00-00-01.txt')
+        os.makedirs(os.path.dirname(earlier))
+        with open(earlier, 'w') as f:
+            f.write("%s\n" % ", ".join(COLUMNS))
+            f.write("10/17/2025 12:00:00, 00:25:1d:00:00:01, 8, 25, 42, 18.0, 1200\n")
+        counts = import_files([self.archive], self.db, 1)
+        self.assertEqual((counts['live'], counts['imported']), (0, 2))
+        self.assertEqual(len(runs(self.db)), 3)
+        # A changed imported file is a new run, not a live one
+        with open(other, 'a') as f:
+            f.write("10/17/2025 12:00:01, 00:25:1d:00:00:02, 9, 25, 42, 18.1, 1201\n")
+        counts = import_files([self.archive], self.db, 1)
+        self.assertEqual((counts['live'], counts['imported'], counts['unchanged']), (0, 1, 1))
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class SweepImportTest(unittest.TestCase):
+    """Importing the files of a steptxgc sweep run on the simulator"""
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        shutil.copy(os.path.join(os.path.dirname(mg_resultdb.__file__), 'pm_offset.dat'),
+            self.tmp)
+        os.chdir(self.tmp)
+        self.db = os.path.join(self.tmp, 'results.db')
+        self.saved = mg_resultdb.RESULT_DB
+        mg_resultdb.RESULT_DB = self.db
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        mg_resultdb.RESULT_DB = self.saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_sweep_files(self):
+        station = SimStation(timing=SimTiming(scale=0.0, jitter=0))
+        run_main(mg_step_txgc_test, station)
+        filename = 'steptxgc_%s.csv' % station.TX['mac'].replace(':', '-')
+        archive = os.path.join(self.tmp, 'archive')
+        os.makedirs(archive)
+        shutil.copy(filename, archive)
+        counts = import_files([self.tmp], self.db, 1)
+        self.assertEqual((counts['live'], counts['imported']), (2, 0))
+        self.assertEqual(mg_resultdb.query("SELECT script, rows FROM runs"),
+            [('steptxgc', 16)])
+        self.assertEqual(mg_resultdb.query("SELECT count(*) FROM results"), [(16,)])
+
+if __name__ == '__main__':
+    unittest.main()
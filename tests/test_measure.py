@@ -0,0 +1,236 @@
+import gc
+import sys
+import math
+import time
+import random
+import logging
+import weakref
+import unittest
+try:
+    import mg_measure
+    from mg_measure import Handshake, PMThread, SummitDeviceThread, RunningStats, CalReadings, \
+        AdaptiveStop
+    from mg_calstates import STATE_BEGIN, STATE_FIRST
+    from mg_sim import SimSummitDevice, SimE4418B, SimTiming
+    from pysummit import decoders as dec
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+class FailingDevice(object):
+    """transmit_packets fails at once"""
+    def transmit_packets(self, packet_count):
+        return (0x02, None)
+
+class _ReadyThenWait(object):
+    """pm_ready whose set() returns only once the device is done, as when
+    the meter thread isn't scheduled again until after the transmission"""
+    def __init__(self, hs):
+        self.hs = hs
+        self.event = hs.pm_ready
+
+    def set(self):
+        self.event.set()
+        self.hs.tx_done.wait(5.0)
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class HandshakeTest(unittest.TestCase):
+    def test_meter_does_not_wait_for_a_device_already_done(self):
+        hs = Handshake()
+        hs.pm_ready = _ReadyThenWait(hs)
+        dev = SummitDeviceThread()
+        log = ListHandler()
+        dev.logger.addHandler(log)
+        self.addCleanup(dev.logger.removeHandler, log)
+        dev.start()
+        future = mg_measure.Future()
+        dev.jobs.put((FailingDevice(), 100, None, hs, future))
+        meter = SimE4418B(timing=SimTiming(scale=0))
+        t0 = time.time()
+        stats = PMThread().sample(meter, "FETCH?", None, hs)
+        self.assertLess(time.time() - t0, 1.0)
+        self.assertEqual(future.result(1.0), 0)
+        self.assertEqual(stats.count, 0)
+        dev.jobs.put(None)
+        dev.join()
+        # The failed transmit is logged, not printed from the device thread
+        self.assertEqual([message for message in log.messages if "transmit_packets" in message],
+            [dec.decode_error_status(0x02, 'transmit_packets')])
+
+    def test_tx_measure_reads_while_transmitting(self):
+        timing = SimTiming(scale=0.1, jitter=0)
+        dev = SimSummitDevice('00:25:1d:00:00:01', timing=timing)
+        meter = SimE4418B(air=dev.air, timing=timing, noise=0.0)
+        workers = mg_measure.MeasurementWorkers()
+        try:
+            stats = mg_measure.tx_measure(dev, meter, 5000, workers=workers)
+        finally:
+            workers.shutdown()
+        self.assertEqual(stats.packets_sent, 5000)
+        self.assertGreater(stats.count, 2)
+        self.assertAlmostEqual(stats.trimmed_mean(), dev.output_power(), places=3)
+
+    def released(self, refs, timeout=5.0):
+        # The workers drop a job just after handing back its result
+        deadline = time.time() + timeout
+        while(time.time() < deadline):
+            gc.collect()
+            if(all(ref() is None for ref in refs)):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_workers_keep_no_job(self):
+        timing = SimTiming(scale=0.01, jitter=0)
+        workers = mg_measure.MeasurementWorkers()
+        try:
+            for fail in (False, True):
+                dev = SimSummitDevice('00:25:1d:00:00:01', timing=timing)
+                meter = SimE4418B(air=dev.air, timing=timing)
+                if(fail):
+                    dev.transmit_packets = self.raise_ioerror
+                meas = mg_measure.start_tx_measure(dev, meter, 5000, workers=workers)
+                try:
+                    meas.result(5.0)
+                except IOError:
+                    # The traceback has the job's frames in it
+                    sys.exc_clear()
+                refs = [weakref.ref(dev), weakref.ref(meter)]
+                del dev, meter, meas
+                self.assertTrue(self.released(refs), "a worker still holds the %s job" %
+                    ("failed" if fail else "last"))
+        finally:
+            workers.shutdown()
+
+    def raise_ioerror(self, packet_count):
+        raise IOError("serial timeout")
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class RunningStatsTest(unittest.TestCase):
+    def replies(self, n):
+        rng = random.Random(1)
+        replies = ["%+.8E" % rng.gauss(18.3, 0.05) for i in range(n)]
+        replies[3] = "+9.90000000E+37"
+        replies[5] = "garbage"
+        replies[7] = "-150.0"
+        return replies
+
+    def test_statistics(self):
+        replies = self.replies(1000)
+        stats = RunningStats()
+        for meas in replies:
+            stats.add(meas)
+        data = [float(r) for (i, r) in enumerate(replies) if i not in (3, 5, 7)]
+        trimmed = data[1:-1]
+        mean = sum(trimmed) / len(trimmed)
+        variance = sum((x - mean) ** 2 for x in trimmed) / (len(trimmed) - 1)
+        self.assertEqual(stats.count, len(data))
+        self.assertEqual(stats.trimmed_count(), len(trimmed))
+        self.assertAlmostEqual(stats.trimmed_mean(), mean, places=12)
+        self.assertAlmostEqual(stats.variance(), variance, places=12)
+        self.assertAlmostEqual(stats.ci95(), 1.96 * math.sqrt(variance / len(trimmed)),
+            places=12)
+        self.assertEqual((stats.min, stats.max), (min(data), max(data)))
+        self.assertEqual(stats.rejected(), 3)
+        self.assertEqual(stats.parser.rejected, {'malformed': 1, 'overload': 1, 'range': 1})
+
+    def test_keeps_no_readings(self):
+        stats = RunningStats()
+        for meas in self.replies(20000):
+            stats.add(meas)
+        # Nothing grows with the number of readings
+        self.assertEqual(sorted(vars(stats.parser)), ['high', 'low', 'rejected'])
+        self.assertIsNone(stats.values)
+        self.assertRaises(ValueError, stats.readings)
+
+    def test_keep(self):
+        replies = self.replies(100)
+        stats = RunningStats(keep=True)
+        for meas in replies:
+            stats.add(meas)
+        self.assertEqual(list(stats.readings()),
+            [float(r) for (i, r) in enumerate(replies) if i not in (3, 5, 7)])
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class AdaptiveStopTest(unittest.TestCase):
+    def settled_after(self, rule, values):
+        """The number of readings after which rule settled, or None"""
+        stats = RunningStats()
+        for value in values:
+            stats.add(value)
+            if(rule.settled(stats)):
+                return stats.count
+        return None
+
+    def test_settle_rule(self):
+        rule = AdaptiveStop(tolerance_db=0.02, min_samples=10, max_samples=200)
+        rng = random.Random(1)
+        # min_samples trimmed readings: the first and the newest don't count
+        self.assertEqual(self.settled_after(rule, [18.3] * 500), 12)
+        self.assertEqual(self.settled_after(rule, [rng.gauss(18.3, 1.0) for i in range(500)]),
+            200)
+        self.assertEqual(self.settled_after(AdaptiveStop(max_samples=1000),
+            [rng.gauss(18.3, 1.0) for i in range(500)]), None)
+
+    def measure(self, noise, adaptive):
+        timing = SimTiming(scale=0.1, jitter=0)
+        dev = SimSummitDevice('00:25:1d:00:00:01', timing=timing)
+        meter = SimE4418B(air=dev.air, timing=timing, noise=noise)
+        workers = mg_measure.MeasurementWorkers()
+        try:
+            return mg_measure.tx_measure(dev, meter, 5000, workers=workers, adaptive=adaptive)
+        finally:
+            workers.shutdown()
+
+    def test_quiet_signal_stops_early(self):
+        stats = self.measure(0.0, AdaptiveStop(tolerance_db=0.02, min_samples=3,
+            max_samples=200, chunk_packets=500))
+        self.assertGreaterEqual(stats.trimmed_count(), 3)
+        self.assertLess(stats.packets_sent, 5000)
+        self.assertEqual(stats.packets_sent % 500, 0)
+
+    def test_noisy_signal_runs_to_the_end(self):
+        stats = self.measure(1.0, AdaptiveStop(tolerance_db=0.001, min_samples=3,
+            max_samples=1000, chunk_packets=500))
+        self.assertEqual(stats.packets_sent, 5000)
+        self.assertGreater(stats.ci95(), 0.001)
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class CalReadingsTest(unittest.TestCase):
+    def test_readings_tagged_with_their_state(self):
+        timing = SimTiming(scale=0.1, jitter=0)
+        dev = SimSummitDevice('00:25:1d:00:00:01', timing=timing)
+        meter = SimE4418B(air=dev.air, timing=timing, noise=0.0)
+        readings = CalReadings(meter, "MEAS?")
+        dev.invoke_radio_cal_state(STATE_BEGIN, None)
+        time.sleep(0.02)
+        try:
+            for state in range(STATE_FIRST, STATE_FIRST + 3):
+                readings.open(state)
+                dev.invoke_radio_cal_state(state, None)
+                stats = readings.close()
+                self.assertEqual(readings.state, state)
+                self.assertGreaterEqual(stats.count, 2)
+                # Only readings taken while the device was on the air: none
+                # that ran on past the state, onto the meter's floor
+                self.assertAlmostEqual(stats.min, dev.output_power(), places=4)
+                self.assertAlmostEqual(stats.max, dev.output_power(), places=4)
+                time.sleep(0.02)
+        finally:
+            readings.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import StringIO
+import tempfile
+import unittest
+import mg_resultdb
+try:
+    import mg_meter
+    import mg_step_txgc_test
+    from mg_meter import BufferedReadout, MeterConfig, setup_meter, meter_session
+    from mg_sim import SimE4418B, SimStation, SimTiming, run_main
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+class RecordingMeter(object):
+    """Passes calls to a meter, recording (command, do_error_check)"""
+    def __init__(self, meter):
+        self.meter = meter
+        self.sent = []
+
+    def cmd(self, command, timeout=None, do_error_check=True):
+        self.sent.append((command, do_error_check))
+        return self.meter.cmd(command, timeout=timeout, do_error_check=do_error_check)
+
+    def clear_errors(self):
+        self.sent.append(("*CLS", True))
+        return self.meter.clear_errors()
+
+    def meter_reset(self):
+        self.sent.append(("*RST", True))
+        return self.meter.meter_reset()
+
+class IgnoresCountMeter(RecordingMeter):
+    """A meter that takes TRIG:COUN without an error but triggers one
+    reading at a time anyway"""
+    def cmd(self, command, timeout=None, do_error_check=True):
+        if(command.startswith("TRIG:COUN ")):
+            command = "TRIG:COUN 1"
+        return RecordingMeter.cmd(self, command, timeout, do_error_check)
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class ClosingMeter(object):
+    def __init__(self, port):
+        self.port = port
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class MeterSessionTest(unittest.TestCase):
+    def setUp(self):
+        mg_meter.set_meter_factory(ClosingMeter)
+
+    def tearDown(self):
+        mg_meter.set_meter_factory(None)
+
+    def test_closes_what_it_opened(self):
+        with meter_session(None, 'meter0') as PM:
+            self.assertEqual((PM.port, PM.closed), ('meter0', False))
+        self.assertTrue(PM.closed)
+        try:
+            with meter_session(None, 'meter0') as PM:
+                raise IOError("serial timeout")
+        except IOError:
+            pass
+        self.assertTrue(PM.closed)
+
+    def test_leaves_a_meter_it_was_handed(self):
+        meter = ClosingMeter('shared')
+        with meter_session(meter, 'meter0') as PM:
+            self.assertIs(PM, meter)
+        self.assertFalse(meter.closed)
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class SetupMeterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmp, 'meter_state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def setup(self, pm, config):
+        pm.sent = []
+        setup_meter(pm, config, port='sim', state_file=self.state_file)
+        return pm.sent
+
+    def meter(self, sensor="E4412A", buffered=False):
+        return RecordingMeter(SimE4418B(timing=SimTiming(scale=0), sensor=sensor,
+            buffered=buffered))
+
+    def test_unchanged(self):
+        pm = self.meter()
+        sent = self.setup(pm, MeterConfig(0.5, 1.0))
+        self.assertIn(("SYST:PRES", True), sent)
+        self.assertEqual(self.setup(pm, MeterConfig(0.5, 1.0)), [("CORR:DCYC?", True)])
+
+    def test_duty_cycle_goes_with_its_clear(self):
+        pm = self.meter()
+        self.setup(pm, MeterConfig(0.5, 1.0))
+        self.assertEqual(self.setup(pm, MeterConfig(0.25, 1.0)),
+            [("CORR:DCYC?", True), ("CORR:DCYC 25.0PCT", False), ("*CLS", True)])
+        self.assertEqual(pm.meter.errors, [])
+
+    def test_only_what_changed(self):
+        pm = self.meter()
+        self.setup(pm, MeterConfig(0.5, 1.0))
+        self.assertEqual(self.setup(pm, MeterConfig(0.5, 2.0)),
+            [("CORR:DCYC?", True), ("CORR:GAIN2 2.0", True)])
+
+    def test_unchecked_duty_cycle(self):
+        for (check_dcyc, checked) in [(True, True), (False, False)]:
+            pm = self.meter(sensor="A")
+            sent = self.setup(pm, MeterConfig(0.5, 1.0, check_dcyc=check_dcyc))
+            self.assertIn(("CORR:DCYC 50.0PCT", checked), sent)
+            self.assertEqual(self.setup(pm, MeterConfig(0.25, 1.0, check_dcyc=check_dcyc)),
+                [("CORR:DCYC?", True), ("CORR:DCYC 25.0PCT", checked)])
+            os.remove(self.state_file)
+
+    def test_trigger_count_put_back(self):
+        pm = self.meter(buffered=True)
+        self.setup(pm, MeterConfig(0.5, 1.0))
+        buffered = BufferedReadout(pm, readings=20, port='sim', state_file=self.state_file)
+        self.assertTrue(buffered.probe())
+        buffered.arm()
+        pm.cmd("INIT:CONT ON")
+        self.assertEqual(pm.meter.settings["TRIG:COUN"], "20")
+        self.assertEqual(self.setup(pm, MeterConfig(0.5, 1.0)),
+            [("CORR:DCYC?", True), ("TRIG:COUN 1", True)])
+        self.assertEqual(pm.meter.settings["TRIG:COUN"], "1")
+        self.assertEqual(self.setup(pm, MeterConfig(0.5, 1.0)), [("CORR:DCYC?", True)])
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class BufferedReadoutTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmp, 'meter_state.json')
+        self.log = ListHandler()
+        logging.getLogger('BufferedReadout').addHandler(self.log)
+
+    def tearDown(self):
+        logging.getLogger('BufferedReadout').removeHandler(self.log)
+        shutil.rmtree(self.tmp)
+
+    def meter(self, sensor="E4412A", buffered=True, cls=RecordingMeter):
+        return cls(SimE4418B(timing=SimTiming(scale=0), sensor=sensor, buffered=buffered))
+
+    def readout(self, pm, port=None):
+        return BufferedReadout(pm, readings=20, port=port, state_file=self.state_file)
+
+    def test_probe(self):
+        pm = self.meter()
+        buffered = self.readout(pm)
+        self.assertTrue(buffered.probe())
+        self.assertEqual(pm.sent, [("SERV:SENS1:TYPE?", True), ("TRIG:COUN?", False),
+            ("SYST:ERR?", False)])
+        # Only once
+        self.assertTrue(buffered.probe())
+        self.assertEqual(len(pm.sent), 3)
+
+    def test_probe_falls_back_without_buffered_readout(self):
+        pm = self.meter(buffered=False)
+        buffered = self.readout(pm)
+        self.assertFalse(buffered.probe())
+        self.assertFalse(buffered.supported)
+        # The probe read its own error back off the queue
+        self.assertEqual(pm.meter.errors, [])
+        self.assertEqual(self.log.messages,
+            ["Meter has no buffered readout, using FETCH? per reading"])
+
+    def test_probe_falls_back_for_sensor_a(self):
+        pm = self.meter(sensor="A")
+        buffered = self.readout(pm)
+        self.assertFalse(buffered.probe())
+        self.assertEqual(pm.sent, [("SERV:SENS1:TYPE?", True)])
+
+    def test_read(self):
+        pm = self.meter()
+        buffered = self.readout(pm)
+        self.assertTrue(buffered.probe())
+        buffered.arm()
+        time.sleep(0.1)
+        self.assertEqual(len(buffered.read()), 20)
+        self.assertTrue(buffered.supported)
+
+    def test_single_value_readback_falls_back(self):
+        pm = self.meter(cls=IgnoresCountMeter)
+        buffered = self.readout(pm)
+        self.assertTrue(buffered.probe())
+        buffered.arm()
+        time.sleep(0.1)
+        self.assertEqual(len(buffered.read()), 1)
+        self.assertFalse(buffered.supported)
+        self.assertEqual(self.log.messages, ["Buffered readout returned 1 reading(s), "
+            "falling back to FETCH? per reading"])
+        self.assertFalse(buffered.probe())
+
+    def test_trigger_count_noted(self):
+        pm = self.meter()
+        setup_meter(pm, MeterConfig(0.5, 1.0), port='sim', state_file=self.state_file)
+        with open(self.state_file) as f:
+            self.assertNotIn('trigger_count', json.load(f)['sim'])
+        buffered = self.readout(pm, port='sim')
+        buffered.arm()
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f)['sim']['trigger_count'], 20)
+        # Sent once, while it stays the same
+        pm.sent = []
+        buffered.arm()
+        self.assertEqual(pm.sent, [("INIT:CONT OFF", True), ("INIT", True)])
+
+    def test_trigger_count_not_noted_without_setup(self):
+        buffered = self.readout(self.meter(), port='sim')
+        buffered.arm()
+        self.assertFalse(os.path.exists(self.state_file))
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class ScriptMeterSetupTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        shutil.copy(os.path.join(os.path.dirname(mg_resultdb.__file__), 'pm_offset.dat'),
+            self.tmp)
+        os.chdir(self.tmp)
+        self.saved = mg_resultdb.RESULT_DB
+        mg_resultdb.RESULT_DB = ''
+        self.stdout = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        mg_resultdb.RESULT_DB = self.saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def output(self, station):
+        sys.stdout = StringIO.StringIO()
+        station.meter.sent = []
+        send = station.meter.cmd
+
+        def cmd(command, **kwargs):
+            station.meter.sent.append(command)
+            return send(command, **kwargs)
+        station.meter.cmd = cmd
+        try:
+            run_main(mg_step_txgc_test, station)
+        finally:
+            del station.meter.cmd
+        return sys.stdout.getvalue()
+
+    def test_cal_table_reported_for_sensor_a(self):
+        station = SimStation(timing=SimTiming(scale=0), sensor="A")
+        self.assertIn("(' Using Sensor Cal Table', 'HP8481A')", self.output(station))
+        self.assertIn("SYST:PRES", station.meter.sent)
+        # and again when the setup comes from the cache
+        self.assertIn("(' Using Sensor Cal Table', 'HP8481A')", self.output(station))
+        self.assertNotIn("SYST:PRES", station.meter.sent)
+
+    def test_no_cal_table_for_other_sensors(self):
+        station = SimStation(timing=SimTiming(scale=0))
+        self.assertNotIn("Using Sensor Cal Table", self.output(station))
+        self.assertNotIn("CORR:CSET1:SEL?", station.meter.sent)
+
+if __name__ == '__main__':
+    unittest.main()
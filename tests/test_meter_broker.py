@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import shutil
+import StringIO
+import tempfile
+import threading
+import unittest
+import mg_resultdb
+try:
+    import mg_meter
+    import mg_meter_broker
+    import mg_txpo_test
+    from mg_meter import connect_meter, close_meter
+    from mg_meter_broker import BrokerMeter, MeterBroker, MeterBrokerError, _Server, \
+        _SessionHandler
+    from mg_measure import MeasurementWorkers
+    from mg_sim import SimStation, SimE4418B, SimTiming
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+
+class BrokerTestCase(unittest.TestCase):
+    """Serves a MeterBroker of simulated meters on a free local port"""
+    def setUp(self):
+        self.meters = {}
+        self.saved = (mg_meter_broker.open_meter, mg_meter_broker.LEASE_TIMEOUT,
+            mg_meter.METER_BROKER)
+        mg_meter_broker.open_meter = self.open_meter
+        self.broker = MeterBroker()
+        self.server = _Server(('127.0.0.1', 0), _SessionHandler)
+        self.server.broker = self.broker
+        self.thread = threading.Thread(target=self.server.serve_forever,
+            kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.address = '127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        (mg_meter_broker.open_meter, mg_meter_broker.LEASE_TIMEOUT,
+            mg_meter.METER_BROKER) = self.saved
+
+    def open_meter(self, port):
+        if(port not in self.meters):
+            self.meters[port] = SimE4418B(timing=SimTiming(scale=0))
+        return self.meters[port]
+
+    def wait_for(self, condition, timeout=5.0):
+        # The broker releases a dropped session's lease on its own thread
+        deadline = time.time() + timeout
+        while(not condition() and time.time() < deadline):
+            time.sleep(0.01)
+        return condition()
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class MeterBrokerTest(BrokerTestCase):
+    def test_lease_and_release(self):
+        pm = BrokerMeter(self.address, 'meter0', session='first')
+        pm.cmd("FREQ 5.500GHZ")
+        self.assertEqual(pm.cmd("FREQ?"), "5.500GHZ")
+        self.assertEqual(self.broker.status()['meter0']['owner'], 'first')
+        pm.close()
+        self.assertEqual(self.broker.status()['meter0']['owner'], None)
+        # The next session gets the port as it was left, without reopening it
+        pm = BrokerMeter(self.address, 'meter0', session='second')
+        self.assertEqual(pm.cmd("FREQ?"), "5.500GHZ")
+        pm.close()
+        status = self.broker.status()['meter0']
+        self.assertEqual((status['opens'], status['leases']), (1, 2))
+
+    def test_second_session_times_out(self):
+        first = BrokerMeter(self.address, 'meter0', session='first')
+        t0 = time.time()
+        self.assertRaises(MeterBrokerError, BrokerMeter, self.address, 'meter0',
+            session='second', timeout=0.2)
+        self.assertLess(time.time() - t0, 5.0)
+        # Other ports are not held up
+        BrokerMeter(self.address, 'meter1', timeout=0.2).close()
+        first.close()
+        BrokerMeter(self.address, 'meter0', timeout=0.2).close()
+
+    def test_connect_meter_times_out(self):
+        mg_meter.METER_BROKER = self.address
+        mg_meter_broker.LEASE_TIMEOUT = 0.2
+        first = connect_meter('meter0')
+        self.assertRaises(MeterBrokerError, connect_meter, 'meter0')
+        self.assertTrue(close_meter(first))
+        close_meter(connect_meter('meter0'))
+
+    def test_dropped_connection_releases(self):
+        pm = BrokerMeter(self.address, 'meter0')
+        # The process goes away without a release
+        pm._file.close()
+        pm._sock.close()
+        self.assertTrue(self.wait_for(
+            lambda: self.broker.status()['meter0']['owner'] is None))
+        BrokerMeter(self.address, 'meter0', timeout=0.2).close()
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class BrokerSessionTest(BrokerTestCase):
+    """Two script runs in one process, leasing the meter from the broker"""
+    def setUp(self):
+        super(BrokerSessionTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        shutil.copy(os.path.join(os.path.dirname(mg_resultdb.__file__), 'pm_offset.dat'),
+            self.tmp)
+        os.chdir(self.tmp)
+        self.saved_db = mg_resultdb.RESULT_DB
+        mg_resultdb.RESULT_DB = ''
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        self.station = SimStation(timing=SimTiming(scale=0.01))
+        self.meters['meter0'] = self.station.meter
+        self.sent = []
+        send = self.station.meter.cmd
+
+        def cmd(command, **kwargs):
+            self.sent.append(command)
+            return send(command, **kwargs)
+        self.station.meter.cmd = cmd
+        mg_meter.METER_BROKER = self.address
+        mg_meter_broker.LEASE_TIMEOUT = 5.0
+        self.workers = MeasurementWorkers()
+
+    def tearDown(self):
+        self.workers.shutdown()
+        sys.stdout = self.stdout
+        mg_resultdb.RESULT_DB = self.saved_db
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        super(BrokerSessionTest, self).tearDown()
+
+    def run_txpo(self):
+        errors = []
+
+        def run():
+            try:
+                mg_txpo_test.main(self.station.TX, self.station.RX, meter_port='meter0',
+                    workers=self.workers)
+            except Exception as info:
+                errors.append(info)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(60)
+        self.assertFalse(thread.is_alive(), "the run hung")
+        self.assertEqual(errors, [])
+
+    def test_second_run_gets_the_meter(self):
+        self.run_txpo()
+        self.assertEqual(self.broker.status()['meter0']['owner'], None)
+        self.assertIn("SYST:PRES", self.sent)
+        del self.sent[:]
+        self.run_txpo()
+        status = self.broker.status()['meter0']
+        self.assertEqual((status['owner'], status['opens'], status['leases']), (None, 1, 2))
+        # The second run found the meter as the first one left it
+        self.assertNotIn("SYST:PRES", self.sent)
+        self.assertIn("FETCH?", self.sent)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import shutil
+import StringIO
+import tempfile
+import threading
+import unittest
+import mg_resultdb
+from mg_results import ResultFile
+try:
+    from mg_multi_dut import LockedDevice, run_all
+    from mg_sim import SimStation, SimTiming
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+class LinkDevice(object):
+    """Records how many calls were on the shared link at once"""
+    def __init__(self, link):
+        self.link = link
+
+    def _call(self):
+        with self.link['lock']:
+            self.link['active'] += 1
+            self.link['most'] = max(self.link['most'], self.link['active'])
+        time.sleep(0.01)
+        with self.link['lock']:
+            self.link['active'] -= 1
+        return (0x01, None)
+
+    def rd(self, addr):
+        return self._call()
+
+    def transmit_packets(self, packet_count):
+        return self._call()
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class LockedDeviceTest(unittest.TestCase):
+    def test_no_two_calls_on_the_link(self):
+        link = {'lock': threading.Lock(), 'active': 0, 'most': 0}
+        lock = threading.RLock()
+        devs = [LockedDevice(LinkDevice(link), lock) for i in range(4)]
+
+        def sweep(dev):
+            for i in range(5):
+                dev.rd(0x406004)
+                dev.transmit_packets(100)
+        threads = [threading.Thread(target=sweep, args=(dev,)) for dev in devs]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(link['most'], 1)
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class RunAllTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        shutil.copy(os.path.join(os.path.dirname(mg_resultdb.__file__), 'pm_offset.dat'),
+            self.tmp)
+        os.chdir(self.tmp)
+        self.saved = mg_resultdb.RESULT_DB
+        mg_resultdb.RESULT_DB = ''
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        mg_resultdb.RESULT_DB = self.saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def sweep_rows(self, coroutines):
+        ports = ['meter0', 'meter1', 'meter2']
+        station = SimStation(n_slaves=2, timing=SimTiming(scale=0.02, jitter=0),
+            meter_ports=ports)
+        for meter in station.meters.values():
+            meter.noise = 0.0
+        station.install()
+        try:
+            sessions = run_all(station.TX, station.RX, ports, 'txpo', coroutines=coroutines)
+        finally:
+            station.uninstall()
+        self.assertEqual([session.exc_info for session in sessions], [None] * 3)
+        rows = {}
+        for dev in station.devices():
+            path = 'txpo_%s.mgr' % dev['mac'].replace(':', '-')
+            rows[dev['mac']] = [row[1:5] + [round(row[5], 6)] + row[6:]
+                for row in ResultFile(path).rows()]
+            os.remove(path)
+        return rows
+
+    def test_coroutines_same_rows_as_threads(self):
+        threads = self.sweep_rows(False)
+        coroutines = self.sweep_rows(True)
+        self.assertEqual(len(coroutines), 3)
+        for rows in coroutines.values():
+            self.assertEqual([row[1] for row in rows], range(8, 35))
+        self.assertEqual(coroutines, threads)
+
+if __name__ == '__main__':
+    unittest.main()
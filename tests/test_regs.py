@@ -0,0 +1,223 @@
+import os
+import sys
+import shutil
+import StringIO
+import tempfile
+import unittest
+import mg_resultdb
+from mg_regs import rd_batch, wr_batch, contiguous_runs, first_error, CachedDevice, GC_ADDRS, \
+    IRQ_EN_REG, BASEBAND_CCA_CTL_REG
+from mg_results import ResultFile
+try:
+    import mg_txpo_test_slave
+    import mg_step_txgc_test
+    from mg_sim import SimStation, SimSummitDevice, SimTiming, run_main
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+class PlainDevice(object):
+    """rd/wr only, like the TxAPI"""
+    def __init__(self):
+        self.regs = {}
+        self.writes = 0
+
+    def rd(self, addr):
+        return (0x01, self.regs.get(addr, 0))
+
+    def wr(self, addr, value):
+        self.writes += 1
+        self.regs[addr] = value
+        return (0x01, None)
+
+class BlockDevice(PlainDevice):
+    """With block transfers, recording each call; fail makes a block that
+    starts there fail"""
+    def __init__(self, fail=None):
+        PlainDevice.__init__(self)
+        self.fail = fail
+        self.calls = []
+
+    def wr(self, addr, value):
+        self.calls.append(('wr', addr))
+        return PlainDevice.wr(self, addr, value)
+
+    def rd_block(self, addr, count):
+        return (0x01, [self.regs.get(addr + 4 * i, 0) for i in range(count)])
+
+    def wr_block(self, addr, values):
+        self.calls.append(('wr_block', addr, len(values)))
+        if(addr == self.fail):
+            return (0x07, None)
+        for (i, value) in enumerate(values):
+            self.regs[addr + 4 * i] = value
+        return (0x01, None)
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class CachedDeviceTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimSummitDevice("00:25:1d:00:00:01", timing=SimTiming(scale=0))
+
+    def test_fresh_read_sees_the_device(self):
+        dev = CachedDevice(self.sim)
+        dev.wr(IRQ_EN_REG, 0x00)
+        # The module changes it behind the host's back
+        self.sim.regs[IRQ_EN_REG] = 0x13
+        self.assertEqual(dev.rd(IRQ_EN_REG), (0x01, 0x00))
+        self.assertEqual(dev.rd(IRQ_EN_REG, fresh=True), (0x01, 0x13))
+        # and the shadow now holds what the device does
+        self.assertEqual(dev.rd(IRQ_EN_REG), (0x01, 0x13))
+
+    def test_fresh_batch(self):
+        for block_ops in [False, True]:
+            sim = SimSummitDevice("00:25:1d:00:00:01", timing=SimTiming(scale=0),
+                block_ops=block_ops)
+            dev = CachedDevice(sim)
+            dev.wr(IRQ_EN_REG, 0x00)
+            dev.wr(BASEBAND_CCA_CTL_REG, 0x00)
+            gc = [val for (status, val) in rd_batch(dev, GC_ADDRS)]
+            sim.regs[IRQ_EN_REG] = 0x01
+            sim.regs[BASEBAND_CCA_CTL_REG] = 0x02
+            for addr in GC_ADDRS:
+                sim.regs[addr] = 0x77
+            addrs = [IRQ_EN_REG, BASEBAND_CCA_CTL_REG] + GC_ADDRS
+            self.assertEqual([val for (status, val) in rd_batch(dev, addrs)],
+                [0x00, 0x00] + gc)
+            self.assertEqual([val for (status, val) in rd_batch(dev, addrs, fresh=True)],
+                [0x01, 0x02] + [0x77] * 8)
+            # A plain device takes fresh too
+            self.assertEqual(rd_batch(sim, [IRQ_EN_REG], fresh=True), [(0x01, 0x01)])
+
+    def test_written_registers_survive_transmitting(self):
+        dev = CachedDevice(self.sim)
+        dev.wr(IRQ_EN_REG, 0x00)
+        wr_batch(dev, [(addr, 9) for addr in GC_ADDRS])
+        dev.transmit_packets(100)
+        dev.get_pdout(4000, 32)
+        dev.temperature()
+        self.assertEqual(rd_batch(dev, [IRQ_EN_REG] + GC_ADDRS), [(0x01, 0x00)] + [(0x01, 9)] * 8)
+        self.assertEqual((dev.hits, dev.misses), (9, 0))
+
+    def test_set_radio_channel_drops_the_gain_table(self):
+        dev = CachedDevice(self.sim)
+        dev.wr(IRQ_EN_REG, 0x00)
+        wr_batch(dev, [(addr, 9) for addr in GC_ADDRS])
+        dev.set_radio_channel(0, 24)
+        self.assertEqual(dev.rd(IRQ_EN_REG), (0x01, 0x00))
+        self.assertEqual([val for (status, val) in rd_batch(dev, GC_ADDRS)],
+            [self.sim.regs[addr] for addr in GC_ADDRS])
+        self.assertNotEqual(self.sim.regs[GC_ADDRS[0]], 9)
+        self.assertEqual((dev.hits, dev.misses), (1, 8))
+
+    def test_unlisted_calls_drop_everything(self):
+        dev = CachedDevice(self.sim)
+        dev.wr(IRQ_EN_REG, 0x00)
+        rd_batch(dev, GC_ADDRS)
+        dev.set_power_comp_enable(0)
+        misses = dev.misses
+        rd_batch(dev, [IRQ_EN_REG] + GC_ADDRS)
+        self.assertEqual(dev.misses, misses + 1 + len(GC_ADDRS))
+
+    def test_cal_state_drops_config_and_gain_table(self):
+        dev = CachedDevice(self.sim)
+        dev.wr(IRQ_EN_REG, 0x00)
+        rd_batch(dev, GC_ADDRS)
+        dev.invoke_radio_cal_state(0, 0)
+        misses = dev.misses
+        rd_batch(dev, [IRQ_EN_REG] + GC_ADDRS)
+        self.assertEqual(dev.misses, misses + 1 + len(GC_ADDRS))
+
+    def test_own_invalidation_lists(self):
+        dev = CachedDevice(self.sim, call_invalidates={'invoke_radio_cal_state': ['config']})
+        dev.wr(IRQ_EN_REG, 0x00)
+        rd_batch(dev, GC_ADDRS)
+        dev.invoke_radio_cal_state(0, 0)
+        self.assertEqual(rd_batch(dev, GC_ADDRS), [(0x01, self.sim.regs[a]) for a in GC_ADDRS])
+        self.assertEqual(dev.hits, 8)
+        dev.rd(IRQ_EN_REG)
+        self.assertEqual(dev.hits, 8)
+
+    def test_block_ops_only_with_the_device(self):
+        self.assertFalse(hasattr(CachedDevice(self.sim), 'rd_block'))
+        self.assertFalse(hasattr(CachedDevice(self.sim), 'wr_block'))
+        sim = SimSummitDevice("00:25:1d:00:00:01", timing=SimTiming(scale=0), block_ops=True)
+        dev = CachedDevice(sim)
+        wr_batch(dev, [(addr, 5) for addr in GC_ADDRS])
+        self.assertEqual(sim.busy.calls['reg'], 1)
+        self.assertEqual(rd_batch(dev, GC_ADDRS), [(0x01, 5)] * 8)
+        self.assertEqual(sim.busy.calls['reg'], 1)
+
+
+class BatchTest(unittest.TestCase):
+    def test_contiguous_runs(self):
+        self.assertEqual(contiguous_runs([]), [])
+        self.assertEqual(contiguous_runs(GC_ADDRS), [(GC_ADDRS[0], 8)])
+        self.assertEqual(contiguous_runs([0x40100C] + GC_ADDRS[:3] + GC_ADDRS[4:]),
+            [(0x40100C, 1), (GC_ADDRS[0], 3), (GC_ADDRS[4], 4)])
+        # Out of order is not a run
+        self.assertEqual(contiguous_runs([GC_ADDRS[1], GC_ADDRS[0]]),
+            [(GC_ADDRS[1], 1), (GC_ADDRS[0], 1)])
+
+    def test_wr_batch(self):
+        dev = BlockDevice()
+        pairs = [(0x40100C, 3)] + [(addr, i) for (i, addr) in enumerate(GC_ADDRS)]
+        self.assertEqual(wr_batch(dev, pairs), [(0x01, None)] * 9)
+        self.assertEqual(dev.regs, dict(pairs))
+        self.assertEqual(dev.calls, [('wr', 0x40100C), ('wr_block', GC_ADDRS[0], 8)])
+        self.assertEqual(rd_batch(dev, [addr for (addr, val) in pairs]),
+            [(0x01, val) for (addr, val) in pairs])
+
+    def test_wr_batch_error(self):
+        dev = BlockDevice(fail=GC_ADDRS[0])
+        results = wr_batch(dev, [(addr, 1) for addr in GC_ADDRS[:4]])
+        self.assertEqual(results, [(0x07, None)] * 4)
+        self.assertEqual(first_error(results), 0x07)
+        self.assertEqual(first_error([(0x01, None)]), None)
+        # Without block ops every register is its own write
+        plain = CachedDevice(PlainDevice())
+        self.assertEqual(wr_batch(plain, [(addr, 1) for addr in GC_ADDRS]), [(0x01, None)] * 8)
+        self.assertEqual(plain.dev.writes, 8)
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class SweepRegistersTest(unittest.TestCase):
+    """The register traffic of the sweep scripts"""
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        shutil.copy(os.path.join(os.path.dirname(mg_resultdb.__file__), 'pm_offset.dat'),
+            self.tmp)
+        os.chdir(self.tmp)
+        self.saved = mg_resultdb.RESULT_DB
+        mg_resultdb.RESULT_DB = ''
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        mg_resultdb.RESULT_DB = self.saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_txgc_from_the_batch(self):
+        station = SimStation(timing=SimTiming(scale=0, jitter=0))
+        slave = station.RX[0]
+        run_main(mg_txpo_test_slave, station)
+        rows = ResultFile('txpo_%s.mgr' % slave.mac.replace(':', '-')).rows()
+        self.assertEqual([row[2] for row in rows], range(8, 35))
+        for row in rows:
+            (txgc, gc_index, gc) = (row[4], row[6], row[7:15])
+            self.assertEqual(txgc, gc[gc_index])
+        # Per channel: one batch of the index and the eight gain registers
+        self.assertEqual(slave.busy.calls['reg'], 3 + 3 + 1 + 1 + 27 * 9)
+
+    def test_steptxgc_cache_hits(self):
+        station = SimStation(timing=SimTiming(scale=0, jitter=0))
+        run_main(mg_step_txgc_test, station)
+        # The txgc read after each of the 16 measurements is the value written
+        self.assertIn("register cache: 16 hits", sys.stdout.getvalue())
+        self.assertEqual(station.TX.busy.calls['reg'], 3 + 3 + 2 + 16 * (8 + 1))
+
+if __name__ == '__main__':
+    unittest.main()
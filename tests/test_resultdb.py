@@ -0,0 +1,115 @@
+import os
+import sys
+import shutil
+import StringIO
+import tempfile
+import unittest
+import mg_resultdb
+from mg_results import ResultWriter, ResultFile
+try:
+    import mg_step_txgc_test
+    from mg_sim import SimStation, SimTiming, run_main
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+COLUMNS = ['datetime', 'MAC', 'channel', 'temp', 'txgc', 'txpo', 'pdout']
+MAC = "00:25:1d:00:00:01"
+
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, 'results.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, run, rows, batch_rows=4):
+        path = os.path.join(self.tmp, 'txpo.mgr')
+        with ResultWriter(path, COLUMNS, script='txpo', run=run, batch_rows=batch_rows) as results:
+            for row in rows:
+                results.add(row)
+
+    def test_rows_go_into_the_run(self):
+        rows = [("10/17/2026 12:00:%02d" % i, MAC, 8 + i, 25, 42, 18.0 + 0.5 * i, 1200 + i)
+                for i in range(10)]
+        run = mg_resultdb.open_run('txpo', MAC, 0xFD, (198 << 5) | 3, path='txpo.txt', db=self.db)
+        self.write(run, rows)
+        (script, mac, module_id, major, minor, started, finished, path, count) = \
+            mg_resultdb.query("SELECT script, mac, module_id, firmware_major, firmware_minor, "
+                "started, finished, path, rows FROM runs", db=self.db)[0]
+        self.assertEqual((script, mac, module_id, major, minor, path, count),
+            ('txpo', MAC, 0xFD, 198, 3, 'txpo.txt', 10))
+        self.assertTrue(finished >= started)
+        found = mg_resultdb.query("SELECT channel, txpo, pdout FROM readings "
+            "WHERE script = 'txpo' AND firmware_major >= 198 ORDER BY channel", db=self.db)
+        self.assertEqual(found, [(row[2], row[5], row[6]) for row in rows])
+
+    def test_mac_from_the_rows(self):
+        run = mg_resultdb.open_run('steptxgc', db=self.db)
+        self.write(run, [("10/17/2026 12:00:00", MAC, 8, 25, 9, 10.0, None)])
+        self.assertEqual(mg_resultdb.query("SELECT mac, rows FROM runs", db=self.db),
+            [(MAC, 1)])
+        self.assertEqual(mg_resultdb.query("SELECT pdout FROM readings", db=self.db), [(None,)])
+
+    def test_unfinished_run(self):
+        run = mg_resultdb.open_run('txpo', MAC, db=self.db)
+        run.add(COLUMNS, [(1792238400, MAC, 8, 25, 42, 18.0, 1200)])
+        self.assertEqual(mg_resultdb.query("SELECT finished, rows FROM runs", db=self.db),
+            [(None, 1)])
+        run.finish()
+        run.finish()
+        self.assertEqual(mg_resultdb.query("SELECT count(*) FROM runs WHERE finished IS NULL",
+            db=self.db), [(0,)])
+
+    def test_no_database(self):
+        saved = mg_resultdb.RESULT_DB
+        mg_resultdb.RESULT_DB = ''
+        try:
+            self.assertEqual(mg_resultdb.open_run('txpo', MAC), None)
+        finally:
+            mg_resultdb.RESULT_DB = saved
+
+    def test_unknown_column(self):
+        self.assertRaises(ValueError, mg_resultdb.rows_insert, 1, ['datetime', 'bogus'])
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class SweepRunTest(unittest.TestCase):
+    """A steptxgc sweep on the simulator records its run"""
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        shutil.copy(os.path.join(os.path.dirname(mg_resultdb.__file__), 'pm_offset.dat'),
+            self.tmp)
+        os.chdir(self.tmp)
+        self.saved = mg_resultdb.RESULT_DB
+        mg_resultdb.RESULT_DB = os.path.join(self.tmp, 'results.db')
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        mg_resultdb.RESULT_DB = self.saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_sweep(self):
+        station = SimStation(timing=SimTiming(scale=0.0, jitter=0))
+        run_main(mg_step_txgc_test, station)
+        mac = station.TX['mac']
+        filename = 'steptxgc_%s.csv' % mac.replace(':', '-')
+        runs = mg_resultdb.query("SELECT id, script, mac, path, rows, finished FROM runs")
+        self.assertEqual(len(runs), 1)
+        (run_id, script, run_mac, path, count, finished) = runs[0]
+        self.assertEqual((script, run_mac, path, count), ('steptxgc', mac, filename, 16))
+        self.assertNotEqual(finished, None)
+        found = mg_resultdb.query("SELECT datetime, channel, temp, txgc, txpo, pdout "
+            "FROM readings WHERE run_id = ? ORDER BY rowid", (run_id,))
+        self.assertEqual(sorted(set(row[3] for row in found)), [9, 56])
+        saved = [(row[0], row[2], row[3], row[4], row[5], row[6]) for row in
+            ResultFile(os.path.join(self.tmp, filename.replace('.csv', '.mgr'))).rows()]
+        self.assertEqual(found, saved)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mg_results import ResultWriter, ResultFile, format_csv, timestamp
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNS = ['datetime', 'MAC', 'channel', 'temp', 'txgc', 'txpo', 'pdout']
+
+def make_rows(n):
+    rows = []
+    for i in range(n):
+        mac = "00:25:1d:00:00:%02x" % (i % 3)
+        pdout = None if i % 7 == 0 else 1800 + i
+        rows.append(("10/17/2026 12:%02d:%02d" % (i // 60, i % 60), mac, 8 + i % 27, 35,
+            40 + i % 24, 18.0 + 0.0137 * i, pdout))
+    return rows
+
+class ResultWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'txpo.mgr')
+        self.csv_path = os.path.join(self.tmp, 'txpo.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def expected(self, rows):
+        return [[timestamp(row[0])] + list(row[1:]) for row in rows]
+
+    def csv_lines(self, rows):
+        return [", ".join(COLUMNS)] + [format_csv(COLUMNS, row) for row in
+            self.expected(rows)]
+
+    def test_round_trip(self):
+        rows = make_rows(200)
+        with ResultWriter(self.path, COLUMNS, script='txpo', csv_path=self.csv_path,
+                          batch_rows=16) as results:
+            for row in rows:
+                results.add(row)
+        f = ResultFile(self.path)
+        self.assertEqual((f.script, f.columns, len(f)), ('txpo', COLUMNS, len(rows)))
+        self.assertEqual(list(f.rows()), self.expected(rows))
+        with open(self.csv_path) as csv:
+            self.assertEqual(csv.read().splitlines(), self.csv_lines(rows))
+        export = os.path.join(self.tmp, 'export.txt')
+        f.export_csv(export)
+        with open(export) as csv:
+            self.assertEqual(csv.read().splitlines(), self.csv_lines(rows))
+
+    def test_crash_keeps_committed_rows(self):
+        rows = make_rows(40)
+        results = ResultWriter(self.path, COLUMNS, script='txpo', csv_path=self.csv_path,
+            batch_rows=16, commit_interval=3600)
+        for row in rows:
+            results.add(row)
+        # Never closed: two batches of 16 were committed, 8 rows weren't
+        f = ResultFile(self.path)
+        self.assertEqual(list(f.rows()), self.expected(rows[:32]))
+        with open(self.csv_path) as csv:
+            self.assertEqual(csv.read().splitlines(), self.csv_lines(rows[:32]))
+        results.close()
+        self.assertEqual(len(ResultFile(self.path)), 40)
+
+    @unittest.skipIf(numpy is None, "needs numpy")
+    def test_to_numpy(self):
+        rows = make_rows(50)
+        with ResultWriter(self.path, COLUMNS, script='txpo') as results:
+            for row in rows:
+                results.add(row)
+        f = ResultFile(self.path)
+        table = f.to_numpy()
+        expected = self.expected(rows)
+        self.assertEqual(list(table['channel']), [row[2] for row in expected])
+        self.assertEqual(list(table['txpo']), [row[5] for row in expected])
+        self.assertEqual([f.macs[i] for i in table['MAC']], [row[1] for row in expected])
+        self.assertEqual([bool(p & (1 << 6)) for p in table['present']],
+            [row[6] is not None for row in expected])
+
+if __name__ == '__main__':
+    unittest.main()
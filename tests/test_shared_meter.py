@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from mg_meter import MeterConfig, setup_meter
+    from mg_shared_meter import RFSwitch, SharedMeter
+    from mg_sim import SimAir, SimE4418B, SimRFSwitch, SimTiming
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class SharedMeterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        timing = SimTiming(scale=0)
+        self.switch = SimRFSwitch([SimAir(), SimAir()], timing=timing)
+        self.meter = SimE4418B(air=self.switch, timing=timing, sensor="E4412A")
+        self.shared = SharedMeter(self.meter, self.switch)
+        self.vmeters = [self.shared.virtual_meter(port) for port in (0, 1)]
+        state_file = os.path.join(self.tmp, 'meter_state.json')
+        for (vmeter, duty_factor) in zip(self.vmeters, (0.5, 0.25)):
+            setup_meter(vmeter, MeterConfig(duty_factor, 1.0), state_file=state_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def lease(self, vmeter):
+        vmeter.begin_lease()
+        vmeter.end_lease()
+
+    def test_duty_cycle_replayed_with_its_clear(self):
+        self.assertEqual(self.meter.errors, [])
+        for vmeter in self.vmeters * 2:
+            self.lease(vmeter)
+            self.assertEqual(self.switch.selected, vmeter.switch_port)
+            self.assertEqual(self.meter.settings["CORR:DCYC"],
+                vmeter.settings["CORR:DCYC"][0].split(" ", 1)[1])
+            # The error CORR:DCYC flags on this sensor was cleared
+            self.assertEqual(self.meter.errors, [])
+        self.assertEqual(self.meter.cmd("SYST:ERR?"), '+0,"No error"')
+
+    def test_restored_in_order(self):
+        sent = []
+        meter = SimE4418B(air=SimAir(), timing=SimTiming(scale=0), sensor="E4412A")
+        meter_cmd = meter.cmd
+
+        def cmd(command, **kwargs):
+            sent.append(command)
+            return meter_cmd(command, **kwargs)
+        meter.cmd = cmd
+        shared = SharedMeter(meter, SimRFSwitch([SimAir(), SimAir()]))
+        (first, second) = [shared.virtual_meter(port) for port in (0, 1)]
+        commands = ["CORR:CSET1:SEL 'HP8481A'", "CORR:CSET1:STAT ON",
+                    "SENS:AVER:COUN:AUTO OFF", "SENS:AVER:COUN 1", "SENS:POW:AC:RANGE 1",
+                    "FREQ 5.500GHZ", "CORR:DCYC 34.0PCT", "TRIG:COUN 20"]
+        for command in commands:
+            first.cmd(command)
+        del sent[:]
+        second.cmd("TRIG:COUN 20")
+        # In the order first made them, the SENS:AVER:COUN restore only once
+        self.assertEqual(sent, ["CORR:CSET1:STAT OFF", "SENS:AVER:COUN:AUTO ON",
+            "SENS:POW:AC:RANGE:AUTO ON", "FREQ 50MHZ", "CORR:DCYC:STAT OFF",
+            "TRIG:COUN 1", "TRIG:COUN 20"])
+        self.assertEqual(shared.presets, 0)
+        # and back again, in the order first sent them
+        del sent[:]
+        self.lease(first)
+        self.assertEqual(sent, commands[:-1])
+
+    def test_rf_switch_is_abstract(self):
+        self.assertRaises(TypeError, RFSwitch)
+        self.assertTrue(isinstance(self.switch, RFSwitch))
+
+if __name__ == '__main__':
+    unittest.main()
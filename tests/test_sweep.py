@@ -0,0 +1,112 @@
+import os
+import sys
+import shutil
+import StringIO
+import tempfile
+import threading
+import unittest
+import mg_resultdb
+from mg_results import ResultFile
+try:
+    import mg_txpo_test
+    from mg_measure import MeasurementWorkers
+    from mg_sweep import ChannelSweep
+    from mg_sim import SimStation, SimSummitDevice, SimE4418B, SimTiming, run_main
+    MISSING = None
+except ImportError as info:
+    MISSING = str(info)
+
+class FailingDevice(object):
+    """A device whose link fails once it is set to channel fail_at"""
+    def __init__(self, dev, fail_at):
+        self.dev = dev
+        self.fail_at = fail_at
+
+    def __getattr__(self, name):
+        return getattr(self.dev, name)
+
+    def transmit_packets(self, packet_count):
+        if(self.dev.channel == self.fail_at):
+            raise IOError("serial timeout")
+        return self.dev.transmit_packets(packet_count)
+
+
+@unittest.skipIf(MISSING, "needs pysummit and rfmeter (%s)" % MISSING)
+class PipelinedSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        shutil.copy(os.path.join(os.path.dirname(mg_resultdb.__file__), 'pm_offset.dat'),
+            self.tmp)
+        os.chdir(self.tmp)
+        self.saved = (mg_resultdb.RESULT_DB, mg_txpo_test.PIPELINED_SWEEP)
+        mg_resultdb.RESULT_DB = ''
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        self.workers = MeasurementWorkers()
+
+    def tearDown(self):
+        self.workers.shutdown()
+        sys.stdout = self.stdout
+        (mg_resultdb.RESULT_DB, mg_txpo_test.PIPELINED_SWEEP) = self.saved
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def station(self):
+        # No jitter or meter noise: the same station gives the same numbers
+        station = SimStation(timing=SimTiming(scale=0.02, jitter=0))
+        station.meter.noise = 0.0
+        return station
+
+    def sweep_rows(self, pipelined):
+        mg_txpo_test.PIPELINED_SWEEP = pipelined
+        station = self.station()
+        run_main(mg_txpo_test, station, None, None, [], 'sim', self.workers)
+        path = 'txpo_%s.mgr' % station.TX['mac'].replace(':', '-')
+        # All but the datetime; the mean of a different number of equal
+        # readings can differ in the last bit
+        return [row[1:5] + [round(row[5], 6)] + row[6:] for row in ResultFile(path).rows()]
+
+    def test_same_rows_as_sequential(self):
+        sequential = self.sweep_rows(False)
+        pipelined = self.sweep_rows(True)
+        self.assertEqual([row[1] for row in pipelined], range(8, 35))
+        self.assertEqual(pipelined, sequential)
+
+    def test_device_error_comes_out(self):
+        timing = SimTiming(scale=0.02, jitter=0)
+        dev = FailingDevice(SimSummitDevice('00:25:1d:00:00:01', timing=timing), 12)
+        meter = SimE4418B(air=dev.air, timing=timing)
+        rows = []
+        errors = []
+
+        def setup(ch):
+            dev.set_radio_channel(0, ch)
+            return {}
+
+        def make_rows(ch, state, data):
+            return [(ch, data.count)]
+
+        def run():
+            sweep = ChannelSweep(dev, meter, setup, lambda ch, state: state, make_rows,
+                workers=self.workers)
+            try:
+                for row in sweep.run(range(8, 16)):
+                    rows.append(row)
+            except IOError as info:
+                errors.append(info)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), "the sweep hung")
+        self.assertEqual([ch for (ch, count) in rows], [8, 9, 10, 11])
+        self.assertEqual([str(info) for info in errors], ["serial timeout"])
+        # The workers are still good for the next sweep
+        dev.fail_at = None
+        sweep = ChannelSweep(dev, meter, setup, lambda ch, state: state, make_rows,
+            workers=self.workers)
+        self.assertEqual([ch for (ch, count) in sweep.run([8, 9])], [8, 9])
+
+if __name__ == '__main__':
+    unittest.main()
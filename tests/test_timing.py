@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import mg_timing
+from mg_timing import Timer, Histogram, monotonic, METER_PHASES
+
+class Meter(object):
+    def cmd(self, command, timeout=None):
+        time.sleep(0.001)
+        return "+1.0E+01"
+
+class MonotonicTest(unittest.TestCase):
+    @unittest.skipIf(mg_timing._gettime is None, "no clock_gettime")
+    def test_clock_gettime(self):
+        self.assertNotEqual(monotonic, time.time)
+        times = [monotonic() for i in range(10000)]
+        self.assertEqual(times, sorted(times))
+        t0 = monotonic()
+        time.sleep(0.05)
+        self.assertTrue(0.04 < monotonic() - t0 < 1.0)
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets(self):
+        hist = Histogram()
+        for seconds in [0.00005, 0.0015, 0.0015, 0.3, 20.0]:
+            hist.add(seconds)
+        self.assertEqual(hist.count, 5)
+        self.assertEqual((hist.min, hist.max), (0.00005, 20.0))
+        self.assertAlmostEqual(hist.mean(), 20.30305 / 5)
+        self.assertEqual(hist.percentile(50), 2e-3)
+        self.assertEqual(hist.percentile(100), 20.0)
+
+class TimerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_disabled(self):
+        timer = Timer(enabled=False)
+        meter = Meter()
+        self.assertIs(timer.instrument(meter, METER_PHASES), meter)
+        with timer.span('file_write'):
+            pass
+        timer.begin('meter_setup').end()
+        self.assertEqual((timer.spans, timer.histograms), ([], {}))
+
+    def test_instrumented_meter(self):
+        timer = Timer()
+        pm = timer.instrument(Meter(), METER_PHASES)
+        pm.cmd("FETCH?")
+        pm.cmd("FETCH?")
+        pm.cmd("SYST:ERR?")
+        self.assertEqual(timer.histograms['fetch'].count, 2)
+        self.assertEqual(timer.histograms['meter_cmd'].count, 1)
+        self.assertEqual([(phase, name) for (phase, name, start, duration, thread) in
+            timer.spans], [('fetch', "FETCH?"), ('fetch', "FETCH?"), ('meter_cmd', "SYST:ERR?")])
+        self.assertEqual(timer.report().split("\n")[1].split()[:2], ['fetch', '2'])
+
+    def test_chrome_trace(self):
+        timer = Timer()
+        with timer.span('sweep'):
+            for ch in [8, 9]:
+                with timer.span('channel', 'channel %d' % ch):
+                    time.sleep(0.002)
+                    with timer.span('register'):
+                        time.sleep(0.001)
+            worker = threading.Thread(target=lambda: timer.span('fetch').begin().end(),
+                name='PMThread')
+            worker.start()
+            worker.join()
+        path = os.path.join(self.tmp, 'trace.json')
+        timer.write_chrome_trace(path)
+        with open(path) as f:
+            trace = json.load(f)
+        events = trace['traceEvents']
+        threads = dict((e['tid'], e['args']['name']) for e in events if e['ph'] == 'M')
+        self.assertEqual(sorted(threads.values()), ['MainThread', 'PMThread'])
+        spans = [e for e in events if e['ph'] == 'X']
+        self.assertEqual(sorted(e['name'] for e in spans),
+            ['channel 8', 'channel 9', 'fetch', 'register', 'register', 'sweep'])
+        self.assertEqual(threads[[e for e in spans if e['cat'] == 'fetch'][0]['tid']],
+            'PMThread')
+
+        def within(inner, outer):
+            return (outer['ts'] <= inner['ts'] and
+                    inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur'])
+        (sweep,) = [e for e in spans if e['name'] == 'sweep']
+        channels = sorted((e for e in spans if e['cat'] == 'channel'), key=lambda e: e['ts'])
+        registers = sorted((e for e in spans if e['cat'] == 'register'), key=lambda e: e['ts'])
+        self.assertEqual([e['name'] for e in channels], ['channel 8', 'channel 9'])
+        # Channel 8 ends before channel 9 starts; each register span is
+        # inside its channel, and everything inside the sweep
+        self.assertLessEqual(channels[0]['ts'] + channels[0]['dur'], channels[1]['ts'])
+        for (register, channel) in zip(registers, channels):
+            self.assertTrue(within(register, channel))
+        for e in spans:
+            self.assertTrue(within(e, sweep) or e is sweep)
+            self.assertGreaterEqual(e['ts'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
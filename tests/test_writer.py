@@ -0,0 +1,101 @@
+import os
+import sys
+import shutil
+import StringIO
+import tempfile
+import unittest
+from mg_writer import Sink, BackgroundWriter, QueuedResultWriter
+from mg_results import ResultWriter, ResultFile
+
+class ListSink(Sink):
+    def __init__(self):
+        self.items = []
+        self.flushes = 0
+        self.syncs = 0
+        self.closed = False
+
+    def write(self, item):
+        self.items.append(item)
+
+    def flush(self):
+        self.flushes += 1
+
+    def sync(self):
+        self.syncs += 1
+
+    def close(self):
+        self.closed = True
+
+class FailingSink(Sink):
+    def write(self, item):
+        raise IOError("disk full")
+
+class FailingResults(object):
+    def add(self, values):
+        raise IOError("disk full")
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.writer = BackgroundWriter(sync_interval=3600)
+        self.writer.start()
+        # The writer thread reports a failing sink there
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        self.writer.stop()
+        sys.stderr = self.stderr
+
+    def test_sink_is_abstract(self):
+        self.assertRaises(TypeError, Sink)
+
+        class NoWrite(Sink):
+            pass
+        self.assertRaises(TypeError, NoWrite)
+
+    def test_writes_in_order_and_drains(self):
+        sink = ListSink()
+        for i in range(1000):
+            self.writer.submit(sink, i)
+        self.assertTrue(self.writer.drain(5.0))
+        self.assertEqual(sink.items, range(1000))
+        self.assertGreaterEqual(sink.flushes, 1)
+        self.assertGreaterEqual(sink.syncs, 1)
+        self.writer.close_sink(sink)
+        self.writer.drain(5.0)
+        self.assertTrue(sink.closed)
+
+    def test_failing_sink_keeps_its_first_error(self):
+        sink = FailingSink()
+        self.writer.submit(sink, 1)
+        self.writer.submit(sink, 2)
+        self.writer.drain(5.0)
+        self.assertIsInstance(sink.error[1], IOError)
+        self.assertIn("FailingSink failed", sys.stderr.getvalue())
+
+    def test_queued_result_writer(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'r.mgr')
+            columns = ['datetime', 'MAC', 'channel', 'txpo']
+            rows = [(1792238400 + i, "00:25:1d:00:00:01", 8 + i, 18.0 + i) for i in range(100)]
+            with QueuedResultWriter(ResultWriter(path, columns, csv_path=path + '.csv'),
+                                    writer=self.writer) as results:
+                for row in rows:
+                    results.add(row)
+            self.assertEqual([tuple(row) for row in ResultFile(path).rows()], rows)
+            failing = QueuedResultWriter(FailingResults(), writer=self.writer)
+            failing.add(rows[0])
+            self.assertRaises(IOError, failing.close)
+        finally:
+            shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    unittest.main()